@@ -0,0 +1,458 @@
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.page_content import BLANK, BLANK_PAGE_POLICIES
+from utils.page_hash import DEFAULT_MAX_DISTANCE
+from utils.spelling import MIN_CONFIDENCE
+from utils.text_index import default_index_path
+
+# Keep Kivy from parsing our command line arguments when image_processing is imported
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.webp')
+# Separates the pages in the text of a photo with several documents
+PAGE_BREAK = '\f'
+# How often the images left unfinished by a worker that died (e.g. out of memory) get a new pool
+POOL_RESTARTS = 1
+
+# Processing options understood by process_file
+DEFAULT_OPTIONS = {
+    'binarize': True,  # Convert the pages to black and white
+    'enhance_mode': 'adaptive',  # How: 'adaptive' (robust to shadows), 'otsu' (fastest) or 'unsharp'
+    'run_ocr': True,  # Extract the text into a .txt file
+    'tiled_ocr': False,  # Read large pages in parallel bands
+    'formats': ('pdf',),  # Output formats to write ('pdf' and/or 'png')
+    'debug_dir': None,  # If given, the result of every pipeline stage is dumped there as a PNG
+    'detection_mode': 'full',  # 'full', 'pyramid' or 'robust' document detection (see contour_detection)
+    'multi_page': False,  # Find every document in a photo, each becoming a page (PDF page, numbered PNG)
+    'lang': 'eng',  # OCR language
+    'cache_dir': None,  # Directory of the result cache; unchanged pages are not reprocessed
+    'cache_max_bytes': 2 * 1024 ** 3,  # Size limit of the on-disk cache
+    'combine': None,  # File name of a single PDF with all pages in input order
+    'text_layer': True,  # Make the PDFs searchable with an invisible layer of the OCR text (needs run_ocr)
+    'text_index': None,  # Database the OCR text of every page is added to for full-text search (needs run_ocr)
+    'page_index': None,  # Database of page hashes; rescans of a known page reuse its outputs (not with multi_page)
+    'spelling': None,  # Spelling dictionary (.npz, see spelling_dictionary.py) to correct uncertain OCR words with
+    'protected_terms': None,  # File of names, course codes etc. that spelling correction must not touch
+    'min_confidence': MIN_CONFIDENCE,  # Tesseract confidence (0-100) below which a word may be corrected
+    'classify_pages': True,  # Sort pages into blank, image-only and text; only the text areas of text pages are OCR'd
+    'blank_pages': 'keep',  # 'keep' blank pages in the outputs or 'drop' them (needs classify_pages)
+    'max_distance': DEFAULT_MAX_DISTANCE,  # Differing hash bits up to which two pages count as the same (out of 256)
+}
+
+# One result cache per worker process, created on first use
+_cache = None
+_page_index = None
+_spell_checker = None
+
+
+# COLLECT THE IMAGES TO SCAN
+def collect_images(inputs):
+    """
+    Expands directories and glob patterns into a sorted list of image files.
+
+    :param inputs: Directories, glob patterns or file paths given on the command line.
+    :return: A sorted list of unique image paths.
+    """
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            candidates = glob.glob(item, recursive=True)
+        for candidate in candidates:
+            if os.path.isfile(candidate) and candidate.lower().endswith(IMAGE_EXTENSIONS):
+                paths.add(os.path.abspath(candidate))
+    return sorted(paths)
+
+
+def output_names(image_paths):
+    """
+    Names the outputs of every image after its path below the folder all the images are in, so images with
+    the same name in different subfolders get matching subfolders of the output directory. Images whose
+    names only differ in the extension (scan.jpg and scan.png) get it added (scan_jpg and scan_png).
+
+    :param image_paths: Absolute paths of the images, see collect_images.
+    :return: Dictionary of image path -> output name (path relative to the output directory, without extension).
+    :raises ValueError: If two images would still write the same files, e.g. names that only differ in case.
+    """
+    if not image_paths:
+        return {}
+    root = os.path.commonpath([os.path.dirname(path) for path in image_paths])
+    relative = {path: os.path.relpath(path, root) for path in image_paths}
+    by_stem = {}
+    for path, name in relative.items():
+        by_stem.setdefault(os.path.splitext(name)[0].lower(), []).append(path)
+    names = {}
+    for paths in by_stem.values():
+        for path in paths:
+            stem, extension = os.path.splitext(relative[path])
+            names[path] = stem if len(paths) == 1 else f"{stem}_{extension[1:].lower()}"
+    # Compared without case, as on Windows and macOS file systems
+    taken = {}
+    for path, name in names.items():
+        other = taken.setdefault(name.lower(), path)
+        if other != path:
+            raise ValueError(f"{other} and {path} would overwrite each other's outputs; rename one of them")
+    return names
+
+
+def get_cache(directory, max_bytes):
+    global _cache
+    if _cache is None or _cache.directory != directory:
+        from utils.cache import ResultCache
+        _cache = ResultCache(directory, max_disk_bytes=max_bytes)
+    return _cache
+
+
+def get_page_index(path, max_distance):
+    global _page_index
+    if _page_index is None:
+        from utils.page_hash import PageHashIndex
+        _page_index = PageHashIndex(path)
+    _page_index.max_distance = max_distance
+    return _page_index
+
+
+def get_spell_checker(path, terms_path):
+    global _spell_checker
+    if _spell_checker is None:
+        from utils.spelling import SpellChecker, read_terms
+        _spell_checker = SpellChecker.load(path, read_terms(terms_path) if terms_path else ())
+    return _spell_checker
+
+
+def init_worker():
+    """ Runs once in every worker process; each process gets one core, so OpenCV should not spawn its own threads. """
+    import cv2
+    cv2.setNumThreads(1)
+
+
+# RUN THE FULL PIPELINE ON ONE IMAGE
+def process_file(image_path, output_dir, options=None, output_name=None):
+    """
+    Runs detection, perspective transform, binarization, sharpening and OCR on a single image
+    and writes the outputs next to each other in the output directory.
+    Never raises: failures are reported in the returned result.
+
+    :param image_path: Path to the source image.
+    :param output_dir: Directory for the generated files.
+    :param options: Processing options, see DEFAULT_OPTIONS.
+    :param output_name: Name of the outputs, relative to output_dir and without extension (see output_names).
+                        Defaults to the name of the image.
+    :return: A dictionary describing the outcome for this file.
+    """
+    from utils.image_processing import (detection_pipeline, enhancement_pipeline, load_image, scan_pipeline,
+                                        ocr_pipeline, turn_into_pdf)
+    from utils.page_content import classify_page
+    from utils.page_hash import page_hash
+    from utils.pipeline import DebugDumpObserver, Pipeline, Stage, TimingObserver
+    import cv2
+
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    formats = options['formats']
+    start = time.perf_counter()
+    stem = output_name or os.path.splitext(os.path.basename(image_path))[0]
+    result = {'source': image_path, 'status': 'ok', 'outputs': [], 'error': None}
+    try:
+        timing = TimingObserver()
+        observers = [timing]
+        if options['debug_dir']:
+            observers.append(DebugDumpObserver(options['debug_dir'], prefix=f"{stem.replace(os.sep, '_')}_"))
+        if options['multi_page']:
+            # Every document is found and warped first, then each page runs through the rest on its own
+            detection = detection_pipeline(observers, options['detection_mode'], multi=True)
+            pipeline = enhancement_pipeline(options['binarize'], observers, mode=options['enhance_mode'])
+        else:
+            pipeline = scan_pipeline(options['binarize'], observers, options['detection_mode'],
+                                     enhance_mode=options['enhance_mode'])
+        if options['run_ocr']:
+            spell_checker = None
+            if options['spelling']:
+                spell_checker = get_spell_checker(options['spelling'], options['protected_terms'])
+            pipeline = pipeline + ocr_pipeline(options['tiled_ocr'], options['lang'], observers, spell_checker,
+                                               options['min_confidence'], options['classify_pages'])
+        elif options['classify_pages']:
+            pipeline = pipeline + Pipeline(
+                [Stage("Page Content", classify_page, inputs=['final_image'], output='page_content')], observers)
+        if options['cache_dir']:
+            pipeline.cache = get_cache(options['cache_dir'], options['cache_max_bytes'])
+        inputs = {'image': load_image(image_path)}
+        if options['multi_page']:
+            detection.cache = pipeline.cache
+            contexts = [pipeline.run(warped=warped) for warped in detection.run(**inputs)['warped_pages']]
+        else:
+            if options['page_index']:
+                # Find the page first: a rescan of a known page reuses the outputs of the first scan
+                hashing = detection_pipeline(observers, options['detection_mode']) + Pipeline(
+                    [Stage("Page Hash", page_hash, inputs=['warped'], output='page_hash')], observers)
+                hashing.cache = pipeline.cache
+                inputs = hashing.run(**inputs)
+                match = get_page_index(options['page_index'], options['max_distance']).find(inputs['page_hash'])
+                if match is not None:
+                    result.update(status='duplicate', outputs=[output['path'] for output in match['outputs']],
+                                  duplicate_of=match['source'], drive_ids={output['path']: output['id']
+                                                                           for output in match['outputs']})
+                    result['seconds'] = round(time.perf_counter() - start, 3)
+                    return result
+            contexts = [pipeline.run(**inputs)]
+        if options['classify_pages']:
+            result['page_kinds'] = [context['page_content']['kind'] for context in contexts]
+            if options['blank_pages'] == 'drop':
+                contexts = [context for context in contexts if context['page_content']['kind'] != BLANK]
+                if not contexts:
+                    # Nothing is written, so there is nothing to upload either
+                    result['status'] = 'blank'
+                    result['seconds'] = round(time.perf_counter() - start, 3)
+                    return result
+        result['page_hash'] = contexts[0].get('page_hash')
+        final_images = [context['final_image'] for context in contexts]
+        # The words from the single OCR pass become the PDF text layer
+        words = [context.get('words') if options['text_layer'] else None for context in contexts]
+        result['stage_seconds'] = {name: round(seconds, 4) for name, seconds in timing.timings.items()}
+        os.makedirs(os.path.dirname(os.path.join(output_dir, stem)), exist_ok=True)
+
+        if 'png' in formats:
+            for number, final_image in enumerate(final_images, start=1):
+                name = f"{stem}_{number}.png" if options['multi_page'] else f"{stem}.png"
+                png_path = os.path.join(output_dir, name)
+                cv2.imwrite(png_path, final_image)
+                result['outputs'].append(png_path)
+        if 'pdf' in formats:
+            pdf_path = os.path.join(output_dir, f"{stem}.pdf")
+            turn_into_pdf(final_images, pdf_path=pdf_path, open_viewer=False, words=words)
+            result['outputs'].append(pdf_path)
+        if options['combine']:
+            result['pages'] = list(zip(final_images, words))  # Sent back to the main process for the combined PDF
+
+        if options['run_ocr']:
+            # Pages are separated by form feeds, as in the text output of Tesseract and pdftotext
+            text = PAGE_BREAK.join(context['text'] for context in contexts)
+            text_path = os.path.join(output_dir, f"{stem}.txt")
+            with open(text_path, 'w') as file:
+                file.write(text)
+            result['outputs'].append(text_path)
+            result['text'] = text  # Indexed by the main process, which owns the text index
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def index_page(text_index, result, text):
+    """
+    Adds the OCR text of a processed image to the text index, linked to its PDF (or first output).
+    Each page of a photo with several documents (see PAGE_BREAK) is indexed as a page of its own.
+    """
+    files = [path for path in result['outputs'] if path.endswith('.pdf')] or result['outputs']
+    text_index.add_many([(result['source'], page_text, page, result['source'], files[0], None)
+                         for page, page_text in enumerate(text.split(PAGE_BREAK), start=1)])
+
+
+# SCAN MANY IMAGES ACROSS ALL CPU CORES
+def run_batch(image_paths, output_dir, workers=None, **options):
+    """
+    Processes the images in a process pool and writes a summary file with the per-file results.
+
+    :param image_paths: Paths of the images to process.
+    :param output_dir: Directory for the generated files and the summary.
+    :param workers: Number of worker processes (defaults to the number of CPU cores).
+    :param options: Processing options, see DEFAULT_OPTIONS.
+    :return: The summary dictionary.
+    :raises ValueError: If two images would overwrite each other's outputs (see output_names).
+    """
+    from utils.pdf_writer import PdfWriter, A4
+    from utils.page_hash import PageHashIndex
+    from utils.text_index import TextIndex
+
+    names = output_names(image_paths)
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    start = time.perf_counter()
+    writer = PdfWriter(os.path.join(output_dir, options['combine']), paper_size=A4) if options.get('combine') else None
+    text_index = TextIndex(options['text_index']) if options.get('text_index') else None
+    page_index = PageHashIndex(options['page_index']) if options.get('page_index') else None
+    pending = {}  # Finished pages waiting for earlier pages, so the combined PDF keeps the input order
+    next_page = 0
+    remaining = dict(enumerate(image_paths))  # Input position -> image, until its result is in
+
+    def record(index, result):
+        nonlocal next_page
+        pending[index] = result.pop('pages', [])
+        text = result.pop('text', None)
+        if text_index is not None and text is not None:
+            index_page(text_index, result, text)
+        if page_index is not None and result.get('page_hash'):
+            page_index.add(result['page_hash'], result['source'], result['outputs'])
+        results.append(result)
+        print(f"[{len(results)}/{len(image_paths)}] {result['status']:6} {os.path.basename(result['source'])}"
+              + (f" - {result['error']}" if result['error'] else "")
+              + (f" - same page as {result['duplicate_of']}" if result.get('duplicate_of') else ""))
+        # Stream every page that is now in order into the combined PDF
+        while next_page in pending:
+            pages = pending.pop(next_page)
+            next_page += 1
+            if writer is None:
+                continue
+            for image, words in pages:
+                if words is not None:
+                    writer.add_searchable_page(image, words)
+                else:
+                    writer.add_page(image)
+
+    try:
+        broken = None
+        for _ in range(POOL_RESTARTS + 1):
+            if not remaining:
+                break
+            if broken is not None:
+                print(f"A worker process died ({broken}); retrying {len(remaining)} unfinished images")
+                broken = None
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+                futures = {executor.submit(process_file, path, output_dir, options, names[path]): index
+                           for index, path in remaining.items()}
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        # A worker was killed (e.g. out of memory on a huge photo), which takes down the whole
+                        # pool and every image it had not finished
+                        broken = e
+                        continue
+                    del remaining[index]
+                    record(index, result)
+        # Still unfinished after the restarts: likely the image that kills its worker, or caught up with it
+        for index, path in sorted(remaining.items()):
+            record(index, {'source': path, 'status': 'failed', 'outputs': [],
+                           'error': f"worker process died: {broken}"})
+    finally:
+        if writer is not None:
+            writer.close()
+        if text_index is not None:
+            text_index.close()
+        if page_index is not None:
+            page_index.close()
+
+    elapsed = time.perf_counter() - start
+    failures = [r for r in results if r['status'] == 'failed']
+    summary = {
+        'total': len(results),
+        'succeeded': len(results) - len(failures),
+        'failed': len(failures),
+        'duplicates': sum(r['status'] == 'duplicate' for r in results),
+        'blank': sum(r['status'] == 'blank' for r in results),
+        'elapsed_seconds': round(elapsed, 3),
+        # Failed images are not pages scanned, however fast they failed
+        'pages_per_second': round((len(results) - len(failures)) / elapsed, 3) if elapsed > 0 else 0.0,
+        'failures': failures,
+        'results': sorted(results, key=lambda r: r['source']),
+    }
+    with open(os.path.join(output_dir, 'batch_summary.json'), 'w') as file:
+        json.dump(summary, file, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan a folder of document photos without the GUI.")
+    parser.add_argument('inputs', nargs='+', help="Image files, directories or glob patterns (quote the globs)")
+    parser.add_argument('-o', '--output-dir', default='scanned', help="Where to write the results")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--format', dest='formats', action='append', choices=['pdf', 'png'],
+                        help="Output format, can be repeated (default: pdf)")
+    parser.add_argument('--no-binarize', action='store_true', help="Keep the pages in colour")
+    parser.add_argument('--enhance', choices=['adaptive', 'otsu', 'unsharp'], default='adaptive',
+                        help="Black & white conversion: 'adaptive' copes with shadows and uneven light, "
+                             "'otsu' is fastest on evenly lit pages, 'unsharp' helps with faint print")
+    parser.add_argument('--no-ocr', action='store_true', help="Skip text extraction")
+    parser.add_argument('--no-text-layer', action='store_true', help="Write image-only PDFs (not searchable)")
+    parser.add_argument('--tiled-ocr', action='store_true', help="Read large pages in parallel horizontal bands")
+    parser.add_argument('--detection', choices=['full', 'pyramid', 'robust'], default='full',
+                        help="'pyramid' finds the page on a downscaled copy first (faster for large photos); "
+                             "'robust' tries several detector settings at once, for difficult lighting")
+    parser.add_argument('--multi', action='store_true',
+                        help="Find every document in each photo (receipts side by side, the two pages of an open "
+                             "book, ...); each becomes a page of the photo's PDF and a numbered PNG")
+    parser.add_argument('--combine', metavar='NAME.pdf', help="Also write all pages into one PDF, in input order")
+    parser.add_argument('--lang', default='eng', help="OCR language, e.g. 'eng' or 'eng+lav'")
+    parser.add_argument('--spelling', metavar='DICTIONARY',
+                        help="Correct the words OCR was unsure about with this dictionary (see spelling_dictionary.py)")
+    parser.add_argument('--protected-terms', metavar='FILE',
+                        help="Names, course codes etc. (one per line) that spelling correction leaves alone")
+    parser.add_argument('--min-confidence', type=int, default=MIN_CONFIDENCE,
+                        help=f"OCR confidence (0-100) from which words are kept as read (default {MIN_CONFIDENCE})")
+    parser.add_argument('--no-classify', action='store_true',
+                        help="OCR every page in full, instead of skipping blank and image-only pages and reading "
+                             "only the text area of the others")
+    parser.add_argument('--blank-pages', choices=BLANK_PAGE_POLICIES, default='keep',
+                        help="'drop' leaves blank pages (empty backs, separator sheets) out of the outputs and uploads")
+    parser.add_argument('--debug-dir', help="Dump the output of every pipeline stage into this directory")
+    parser.add_argument('--cache-dir', help="Result cache directory (default: .cache inside the output directory)")
+    parser.add_argument('--cache-size', type=float, default=2.0, help="Cache size limit in GB")
+    parser.add_argument('--no-cache', action='store_true', help="Reprocess every page from scratch")
+    parser.add_argument('--index', help="Full-text index the OCR text is added to "
+                                         "(default: ocr_index.sqlite3 in the user data directory)")
+    parser.add_argument('--no-index', action='store_true', help="Do not add the text to the full-text index")
+    parser.add_argument('--skip-duplicates', metavar='PAGE_INDEX', nargs='?', const='page_hashes.sqlite3',
+                        help="Reuse the outputs of pages scanned before instead of processing rescans of them "
+                             "(pages are remembered in PAGE_INDEX, default page_hashes.sqlite3; not with --multi)")
+    parser.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                        help=f"Differing hash bits (of 256) up to which two pages are the same "
+                             f"(default {DEFAULT_MAX_DISTANCE})")
+    args = parser.parse_args()
+    if args.blank_pages == 'drop' and args.no_classify:
+        parser.error("--blank-pages drop needs the page classification that --no-classify turns off")
+    if args.multi and args.skip_duplicates:
+        parser.error("--skip-duplicates knows one page per photo, so it cannot be combined with --multi")
+
+    image_paths = collect_images(args.inputs)
+    if not image_paths:
+        parser.error("No images found for the given inputs.")
+    try:
+        output_names(image_paths)
+    except ValueError as e:
+        parser.error(str(e))
+    cache_dir = None if args.no_cache else args.cache_dir or os.path.join(args.output_dir, '.cache')
+
+    summary = run_batch(image_paths, args.output_dir, workers=args.workers,
+                        binarize=not args.no_binarize,
+                        enhance_mode=args.enhance,
+                        run_ocr=not args.no_ocr,
+                        tiled_ocr=args.tiled_ocr,
+                        text_layer=not args.no_text_layer,
+                        formats=tuple(args.formats or ['pdf']),
+                        debug_dir=args.debug_dir,
+                        detection_mode=args.detection,
+                        multi_page=args.multi,
+                        lang=args.lang,
+                        spelling=args.spelling,
+                        protected_terms=args.protected_terms,
+                        min_confidence=args.min_confidence,
+                        classify_pages=not args.no_classify,
+                        blank_pages=args.blank_pages,
+                        combine=args.combine,
+                        cache_dir=cache_dir,
+                        text_index=None if args.no_index else args.index or default_index_path(),
+                        page_index=args.skip_duplicates,
+                        max_distance=args.max_distance,
+                        cache_max_bytes=int(args.cache_size * 1024 ** 3))
+
+    print(f"\n{summary['succeeded']}/{summary['total']} pages scanned in {summary['elapsed_seconds']:.1f}s "
+          f"({summary['pages_per_second']:.2f} pages/s)")
+    if summary['blank']:
+        print(f"{summary['blank']} were blank and left out")
+    if summary['duplicates']:
+        print(f"{summary['duplicates']} were rescans of known pages; their earlier outputs were reused")
+    if summary['failed']:
+        print(f"{summary['failed']} failed, see {os.path.join(args.output_dir, 'batch_summary.json')}")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,93 @@
+"""
+Compares coarse-to-fine (pyramid) document detection with full-resolution detection on synthetic photos with
+known corners: pages found, corner error and speed. Fails if the pyramid misses a page that full-resolution
+detection finds, or places its corners noticeably worse.
+
+Run from the src directory:
+    python -m benchmarks.detection_pyramid
+    python -m benchmarks.detection_pyramid --resolutions 1080p 12mp --lighting even gradient --repeat 5
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import LIGHTING, make_scenes
+from utils.detection import DocumentNotFoundError, detect_document_pyramid, edge_map, find_document_contour, order_points
+
+RESOLUTIONS = {'1080p': (1920, 1080), '12mp': (4000, 3000), '48mp': (8000, 6000)}
+
+
+def detect_full(image):
+    return find_document_contour(edge_map(image))
+
+
+def corner_error(detected, truth):
+    """ Largest distance in pixels between a detected corner and the true one. """
+    detected = order_points(np.asarray(detected, np.float32).reshape(4, 2))
+    return float(np.linalg.norm(detected - order_points(truth), axis=1).max())
+
+
+def run(detector, scene, repeat):
+    """ :return: (corner error in pixels or None if no document was found, fastest duration in seconds) """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            corners = detector(scene['image'])
+        except DocumentNotFoundError:
+            corners = None
+        seconds = min(seconds, time.perf_counter() - start)
+    return (None if corners is None else corner_error(corners, scene['corners'])), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pyramid against full-resolution document detection.")
+    parser.add_argument('--resolutions', nargs='+', choices=sorted(RESOLUTIONS), default=['1080p', '12mp', '48mp'])
+    parser.add_argument('--lighting', nargs='+', choices=LIGHTING, default=['even'])
+    parser.add_argument('--skews', nargs='+', type=float, default=[0, 5, 10, 15, 20, 25],
+                        help="Page rotations in degrees")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per detector and scene; the fastest is reported")
+    parser.add_argument('--tolerance', type=float, default=1.0,
+                        help="Pixels by which a pyramid corner may be further off than the full-resolution one")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic scenes")
+    args = parser.parse_args()
+
+    print(f"{'scene':32} {'full':>16} {'pyramid':>16} {'speedup':>7}")
+    problems = []
+    totals = {'full': 0.0, 'pyramid': 0.0}
+    errors = {'full': [], 'pyramid': []}
+    found = {'full': 0, 'pyramid': 0}
+    count = 0
+    for scene in make_scenes([RESOLUTIONS[name] for name in args.resolutions], args.lighting, args.skews, args.seed):
+        count += 1
+        full_error, full_seconds = run(detect_full, scene, args.repeat)
+        pyramid_error, pyramid_seconds = run(detect_document_pyramid, scene, args.repeat)
+        cells = []
+        for name, error, seconds in (('full', full_error, full_seconds), ('pyramid', pyramid_error, pyramid_seconds)):
+            totals[name] += seconds
+            if error is not None:
+                found[name] += 1
+                errors[name].append(error)
+            cells.append(f"{'miss' if error is None else f'{error:.2f}px'} {seconds * 1000:>7.1f}ms")
+        print(f"{scene['name']:32} {cells[0]:>16} {cells[1]:>16} {full_seconds / pyramid_seconds:>6.1f}x")
+        if full_error is not None and pyramid_error is None:
+            problems.append(f"{scene['name']}: missed by the pyramid")
+        elif full_error is not None and pyramid_error > full_error + args.tolerance:
+            problems.append(f"{scene['name']}: corners {pyramid_error:.2f}px off, {full_error:.2f}px at full size")
+
+    print()
+    for name in ('full', 'pyramid'):
+        mean = f"{statistics.mean(errors[name]):.2f}px" if errors[name] else "-"
+        print(f"{name:8} found {found[name]}/{count}, mean corner error {mean}, total {totals[name]:.2f}s")
+    print(f"Speedup: {totals['full'] / totals['pyramid']:.1f}x")
+    if problems:
+        print("\nAccuracy lost:\n  " + "\n  ".join(problems))
+        return 1
+    print("\nNo accuracy lost against full-resolution detection.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
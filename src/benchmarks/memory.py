@@ -0,0 +1,106 @@
+"""
+Compares the peak memory of the normal and the low-memory pipeline on one very large synthetic photo.
+Each mode runs in a fresh Python process, so the peak resident memory (RSS) of one does not hide the other;
+the tracemalloc peak shows the memory taken by the image arrays.
+
+Run from the src directory:
+    python -m benchmarks.memory --megapixels 48
+    python -m benchmarks.memory --megapixels 48 --budget-mb 1200
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+
+MODES = ('normal', 'low-memory')
+
+
+def run_mode(mode, image_path, budget_mb=None):
+    """ Scans the photo like the app holds it in the given mode and returns its memory figures. """
+    from utils.image_processing import load_image, scan_pipeline
+    from utils.memory import MemoryBudget, current_rss, peak_rss
+
+    start = time.perf_counter()
+    tracemalloc.start()
+    if mode == 'normal':
+        # Like the app without low-memory mode: every intermediate image stays in the context
+        context = scan_pipeline().run(image=load_image(image_path))
+    else:
+        budget = MemoryBudget(int(budget_mb * 1024 ** 2)) if budget_mb else None
+        image = budget.load(image_path) if budget else load_image(image_path)
+        pipeline = scan_pipeline(low_memory=True)
+        if budget_mb:
+            pipeline.add_observer(budget)
+        # Handed over without keeping a reference, so the photo is freed once the page is warped
+        context = pipeline.run(image=image)
+        del image
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'mode': mode, 'seconds': round(time.perf_counter() - start, 2),
+            'final_shape': list(context['final_image'].shape), 'tracemalloc_peak_mb': round(peak / 1024 ** 2, 1),
+            'retained_mb': round(retained / 1024 ** 2, 1), 'rss_mb': round((current_rss() or 0) / 1024 ** 2, 1),
+            'peak_rss_mb': round((peak_rss() or 0) / 1024 ** 2, 1)}
+
+
+def make_photo(path, megapixels, seed):
+    """ Writes a synthetic 4:3 document photo of about the given size. """
+    import cv2
+    import numpy as np
+    from benchmarks.synthetic import make_page, make_scene
+
+    rng = np.random.default_rng(seed)
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    page, _ = make_page(int(height * 0.6 * 850 / 1100), int(height * 0.6), rng)
+    scene, _ = make_scene(page, (width, height), skew=10, rng=rng)
+    cv2.imwrite(path, scene, [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_JPEG_QUALITY, 90])
+    return width, height
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of the normal and the low-memory pipeline.")
+    parser.add_argument('--megapixels', type=float, default=48, help="Size of the synthetic photo")
+    parser.add_argument('--image', help="Use this photo instead of a synthetic one")
+    parser.add_argument('--budget-mb', type=float, help="Memory budget for the low-memory run")
+    parser.add_argument('--format', choices=['jpg', 'png'], default='jpg', help="File format of the synthetic photo")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--run', choices=MODES, help=argparse.SUPPRESS)  # Used for the child processes
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_mode(args.run, args.image, args.budget_mb)))
+        return 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        image_path = args.image
+        if image_path is None:
+            image_path = os.path.join(directory, f"photo.{args.format}")
+            width, height = make_photo(image_path, args.megapixels, args.seed)
+            print(f"Synthetic photo: {width}x{height} ({width * height / 1e6:.0f} MP)")
+        results = []
+        for mode in MODES:
+            command = [sys.executable, '-m', 'benchmarks.memory', '--run', mode, '--image', image_path]
+            if args.budget_mb and mode == 'low-memory':
+                command += ['--budget-mb', str(args.budget_mb)]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':12} {'tracemalloc peak':>17} {'retained':>10} {'peak RSS':>10} {'time':>7}  final image")
+    for result in results:
+        print(f"{result['mode']:12} {result['tracemalloc_peak_mb']:>14.0f} MB {result['retained_mb']:>7.0f} MB "
+              f"{result['peak_rss_mb']:>7.0f} MB {result['seconds']:>6.1f}s  {result['final_shape']}")
+    normal, low = results
+    print(f"\nLow-memory mode: {1 - low['tracemalloc_peak_mb'] / normal['tracemalloc_peak_mb']:.0%} lower array peak, "
+          f"{1 - low['peak_rss_mb'] / normal['peak_rss_mb']:.0%} lower peak RSS")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,104 @@
+"""
+Compares single-call OCR with tile-parallel OCR on the same pages: speed, and whether tiling loses text.
+Without images, synthetic A4 pages at 300 dpi with known text are read, and each result is scored against
+that text (character error rate). Fails if tiling reads a page noticeably worse than a single call.
+
+Run from the src directory:
+    python -m benchmarks.ocr_tiling
+    python -m benchmarks.ocr_tiling page1.png page2.png --repeat 3
+"""
+import argparse
+import difflib
+import os
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import character_error_rate, make_page
+from utils.ocr import get_engine, ocr_tiled, split_into_bands
+
+A4_300DPI = (2480, 3508)
+
+
+def best_time(func, repeat):
+    """ Runs func repeat times and returns (fastest duration in seconds, result of the last run). """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def load_pages(args):
+    """ Yields (name, page, true text or None) for the given images, or for synthetic pages if none are given. """
+    if not args.images:
+        rng = np.random.default_rng(args.seed)
+        for number in range(args.synthetic):
+            page, text = make_page(*A4_300DPI, rng=rng)
+            yield f"synthetic{number}", page, text
+        return
+    for path in args.images:
+        yield os.path.basename(path), cv2.imread(path), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single-call OCR against tile-parallel OCR.")
+    parser.add_argument('images', nargs='*', help="Scanned pages (ideally already warped and binarized); "
+                                                  "synthetic pages with known text if none are given")
+    parser.add_argument('--synthetic', type=int, default=4, help="Number of synthetic pages")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic pages")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per page; the fastest one is reported")
+    parser.add_argument('--band-height', type=int, default=600, help="Target band height in pixels")
+    parser.add_argument('--workers', type=int, default=None, help="Parallel bands (default: all cores)")
+    parser.add_argument('--lang', default='eng')
+    parser.add_argument('--backend', choices=['auto', 'inprocess', 'subprocess'], default='auto',
+                        help="OCR engine backend")
+    parser.add_argument('--max-cer-increase', type=float, default=0.005,
+                        help="How much higher the character error rate of a tiled page may be than a single call's")
+    parser.add_argument('--min-similarity', type=float, default=0.99,
+                        help="Smallest share of the single-call text a tiled page without known text must reproduce")
+    args = parser.parse_args()
+    engine = get_engine(args.lang, args.backend)
+
+    print(f"{'page':30} {'size':>11} {'bands':>5} {'single':>9} {'tiled':>9} {'speedup':>7} {'same text':>9} "
+          f"{'CER single':>10} {'CER tiled':>9}")
+    total_single = total_tiled = 0.0
+    problems = []
+    for name, image, truth in load_pages(args):
+        if image is None:
+            print(f"{name:30} could not be read")
+            continue
+        single_seconds, single_text = best_time(lambda: engine.image_to_string(image), args.repeat)
+        tiled_seconds, tiled_text = best_time(
+            lambda: ocr_tiled(image, args.lang, args.band_height, args.workers, engine), args.repeat)
+        # How much of the single-call text the tiled result reproduces (whitespace-insensitive)
+        similarity = difflib.SequenceMatcher(None, " ".join(single_text.split()), " ".join(tiled_text.split())).ratio()
+        total_single += single_seconds
+        total_tiled += tiled_seconds
+        rates = ""
+        if truth is not None:
+            single_cer, tiled_cer = character_error_rate(single_text, truth), character_error_rate(tiled_text, truth)
+            rates = f" {single_cer:>10.3f} {tiled_cer:>9.3f}"
+            if tiled_cer > single_cer + args.max_cer_increase:
+                problems.append(f"{name}: character error rate {tiled_cer:.3f} tiled, {single_cer:.3f} in one call")
+        elif similarity < args.min_similarity:
+            problems.append(f"{name}: tiled text only {similarity:.1%} the same as the single-call text")
+        print(f"{name[:30]:30} {image.shape[1]:>5}x{image.shape[0]:<5} "
+              f"{len(split_into_bands(image, args.band_height)):>5} {single_seconds:>8.2f}s {tiled_seconds:>8.2f}s "
+              f"{single_seconds / tiled_seconds:>6.2f}x {similarity:>8.1%}{rates}")
+
+    if total_tiled:
+        print(f"\nTotal: single {total_single:.2f}s, tiled {total_tiled:.2f}s, "
+              f"speedup {total_single / total_tiled:.2f}x")
+    if problems:
+        print("\nAccuracy lost:\n  " + "\n  ".join(problems))
+        return 1
+    print("\nTiling read the pages as well as single calls.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,90 @@
+"""
+Measures how fast and how accurately the page hash index (utils.page_hash) recognises rescans. Synthetic pages
+are photographed twice, under different lighting, skew and noise; the first photo of each is indexed together
+with random hashes that pad the index to its full size, and the second is looked up. Fails if a rescan is not
+matched to its own page, if a page that was never indexed is matched, or if the median lookup is too slow.
+
+Run from the src directory:
+    python -m benchmarks.page_hash_lookup
+    python -m benchmarks.page_hash_lookup --pages 1000000 --known 100
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import LIGHTING, make_page, make_scene
+from utils.image_processing import perspective_transform
+from utils.page_hash import DEFAULT_MAX_DISTANCE, PageHashIndex, page_hash
+
+
+def photo_hash(page, rng):
+    """ Hash of the page as the scanner sees it: photographed at a random angle and lighting, then warped. """
+    scene, corners = make_scene(page, lighting=str(rng.choice(LIGHTING)), skew=float(rng.uniform(-20, 20)), rng=rng)
+    return page_hash(perspective_transform(scene, corners))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lookups in the page hash index.")
+    parser.add_argument('--pages', type=int, default=100000, help="Pages in the index")
+    parser.add_argument('--known', type=int, default=40, help="Synthetic pages indexed and then rescanned")
+    parser.add_argument('--unseen', type=int, default=40, help="Synthetic pages looked up without being indexed")
+    parser.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE)
+    parser.add_argument('--max-ms', type=float, default=1.0, help="Slowest acceptable median lookup in milliseconds")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic pages")
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    index = PageHashIndex(':memory:', args.max_distance)
+    rescans = []
+    for number in range(args.known):
+        page, _ = make_page(rng=rng)
+        index.add(photo_hash(page, rng), f'page{number}', [])
+        rescans.append((f'page{number}', photo_hash(page, rng)))
+    unseen = [photo_hash(make_page(rng=rng)[0], rng) for _ in range(args.unseen)]
+    with index.connection:
+        index.connection.executemany(
+            "INSERT INTO pages (hash, source, created) VALUES (?, 'filler', 0)",
+            ((rng.integers(0, 256, 32, dtype=np.uint8).tobytes().hex(),) for _ in range(args.pages - args.known)))
+    index.find(unseen[0] if unseen else rescans[0][1])  # Loads the hashes into memory
+
+    durations = []
+    problems = []
+    distances = []
+    for source, value in rescans:
+        start = time.perf_counter()
+        found = index.find(value)
+        durations.append(time.perf_counter() - start)
+        if found is None:
+            problems.append(f"{source}: rescan not recognised")
+        elif found['source'] != source:
+            problems.append(f"{source}: rescan matched to {found['source']}")
+        else:
+            distances.append(found['distance'])
+    false_matches = 0
+    for value in unseen:
+        start = time.perf_counter()
+        found = index.find(value)
+        durations.append(time.perf_counter() - start)
+        if found is not None:
+            false_matches += 1
+            problems.append(f"unseen page matched to {found['source']} ({found['distance']} bits apart)")
+
+    median = statistics.median(durations) * 1000
+    print(f"Index of {len(index)} pages, {len(durations)} lookups")
+    print(f"Lookup: median {median:.3f}ms, slowest {max(durations) * 1000:.3f}ms")
+    print(f"Rescans recognised: {len(distances)}/{len(rescans)}"
+          + (f", {statistics.mean(distances):.1f} bits apart on average, {max(distances)} at most" if distances else ""))
+    print(f"Unseen pages matched: {false_matches}/{len(unseen)}")
+    if median > args.max_ms:
+        problems.append(f"median lookup {median:.3f}ms, more than {args.max_ms}ms")
+    if problems:
+        print("\nProblems:\n  " + "\n  ".join(problems))
+        return 1
+    print("\nEvery rescan was recognised, no unseen page was matched.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
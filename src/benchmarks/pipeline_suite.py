@@ -0,0 +1,223 @@
+"""
+Runs the scanning pipeline on synthetic document photos with known corners and text, and records
+per stage: latency, peak memory, corner error (detection) and character error rate (OCR).
+The old two-step enhancement (binarize, then sharpen) is measured too, to compare with the fused stage.
+Results are written as JSON; compare them with an earlier run to catch regressions.
+
+Run from the src directory:
+    python -m benchmarks.pipeline_suite -o bench.json
+    python -m benchmarks.pipeline_suite -o new.json --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import LIGHTING, character_error_rate, make_scenes
+from utils.detection import DocumentNotFoundError, order_points
+from utils.image_processing import (ENHANCE_MODES, binarize_image, contour_detection, enhance_page, ocr,
+                                    perspective_transform, sharpen_image)
+
+RESOLUTIONS = {'720p': (1280, 720), '1080p': (1920, 1080), '12mp': (4000, 3000)}
+
+# Allowed change against the baseline before a metric counts as a regression
+DEFAULT_THRESHOLDS = {
+    'latency': 0.25,  # Relative increase of the median latency of a stage
+    'memory': 0.25,  # Relative increase of the peak memory of a stage
+    'corner_error': 2.0,  # Increase of the mean corner error, in pixels
+    'detection_rate': 0.0,  # Drop in the share of scenes where the document was found
+    'cer': 0.02,  # Increase of the mean OCR character error rate
+}
+
+
+# MEASURE ONE STAGE
+def measure(func, *args, repeat=1, **kwargs):
+    """
+    Runs func and records its latency (fastest of repeat runs) and its peak memory (one run under tracemalloc,
+    which covers NumPy arrays, including the ones OpenCV returns, but not OpenCV's internal buffers).
+
+    :return: (result of func, latency in seconds, peak memory in bytes)
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = min(seconds, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+# ACCURACY METRICS
+def corner_error(detected, truth):
+    """ Mean distance in pixels between the detected and the true page corners. """
+    detected = order_points(np.asarray(detected, np.float32).reshape(4, 2))
+    return float(np.linalg.norm(detected - order_points(truth), axis=1).mean())
+
+
+# RUN THE PIPELINE ON ONE SCENE
+def run_scene(scene, directory, mode='full', run_ocr=True, repeat=1, enhance_mode='adaptive'):
+    record = {key: scene[key] for key in ('name', 'resolution', 'lighting', 'skew')}
+    stages = record['stages'] = {}
+    path = os.path.join(directory, f"{scene['name']}.png")
+    cv2.imwrite(path, scene['image'])
+
+    def detect():
+        try:
+            return contour_detection(path, mode)
+        except DocumentNotFoundError:
+            return None  # A miss takes time too, so it is measured like a hit
+
+    detection, seconds, peak = measure(detect, repeat=repeat)
+    stages['detection'] = {'seconds': seconds, 'peak_bytes': peak}
+    record['detected'] = detection is not None
+    if detection is not None:
+        image, contour = detection
+        record['corner_error'] = corner_error(contour, scene['corners'])
+    else:
+        # Keep measuring the later stages on the true corners
+        image, contour = scene['image'], scene['corners']
+        record['corner_error'] = None
+
+    warped, seconds, peak = measure(perspective_transform, image, np.asarray(contour), repeat=repeat)
+    stages['perspective'] = {'seconds': seconds, 'peak_bytes': peak}
+    final, seconds, peak = measure(enhance_page, warped, enhance_mode, repeat=repeat)
+    stages['enhance'] = {'seconds': seconds, 'peak_bytes': peak}
+    _, seconds, peak = measure(lambda page: sharpen_image(binarize_image(page)), warped, repeat=repeat)
+    stages['binarize_sharpen'] = {'seconds': seconds, 'peak_bytes': peak}
+
+    record['cer'] = None
+    if run_ocr:
+        try:
+            text, seconds, peak = measure(ocr, final)
+            stages['ocr'] = {'seconds': seconds, 'peak_bytes': peak}
+            record['cer'] = character_error_rate(text, scene['text'])
+        except Exception as e:  # Tesseract missing or failing: report it, keep the other measurements
+            record['ocr_error'] = f"{type(e).__name__}: {e}"
+    return record
+
+
+def summarise(records):
+    """ Aggregates the per-scene records into per-stage statistics. """
+    summary = {}
+    stage_names = {name for record in records for name in record['stages']}
+    for name in sorted(stage_names):
+        measured = [record['stages'][name] for record in records if name in record['stages']]
+        latencies = sorted(stage['seconds'] * 1000 for stage in measured)
+        summary[name] = {
+            'runs': len(measured),
+            'median_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3),
+            'peak_mb': round(max(stage['peak_bytes'] for stage in measured) / 1024 ** 2, 3),
+        }
+    errors = [record['corner_error'] for record in records if record['corner_error'] is not None]
+    summary.setdefault('detection', {}).update({
+        'detection_rate': round(sum(record['detected'] for record in records) / len(records), 4),
+        'mean_corner_error_px': round(statistics.mean(errors), 3) if errors else None,
+        'max_corner_error_px': round(max(errors), 3) if errors else None,
+    })
+    rates = [record['cer'] for record in records if record['cer'] is not None]
+    if rates:
+        summary.setdefault('ocr', {})['mean_cer'] = round(statistics.mean(rates), 4)
+    return summary
+
+
+# COMPARE WITH AN EARLIER RUN
+def compare(summary, baseline, thresholds):
+    """
+    Compares a summary with a baseline summary.
+
+    :return: List of human-readable regressions (empty if none).
+    """
+    regressions = []
+
+    def check(stage, metric, allowed, relative):
+        old, new = baseline.get(stage, {}).get(metric), summary.get(stage, {}).get(metric)
+        if old is None or new is None:
+            return
+        limit = old * (1 + allowed) if relative else old + allowed
+        if new > limit:
+            regressions.append(f"{stage} {metric}: {old} -> {new} (limit {limit:.3f})")
+
+    for stage in summary:
+        check(stage, 'median_ms', thresholds['latency'], relative=True)
+        check(stage, 'peak_mb', thresholds['memory'], relative=True)
+    check('detection', 'mean_corner_error_px', thresholds['corner_error'], relative=False)
+    check('ocr', 'mean_cer', thresholds['cer'], relative=False)
+    old_rate = baseline.get('detection', {}).get('detection_rate')
+    new_rate = summary['detection']['detection_rate']
+    if old_rate is not None and new_rate < old_rate - thresholds['detection_rate']:
+        regressions.append(f"detection detection_rate: {old_rate} -> {new_rate}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic document photos.")
+    parser.add_argument('-o', '--output', default='pipeline_benchmark.json', help="Where to write the results")
+    parser.add_argument('--resolutions', nargs='+', choices=sorted(RESOLUTIONS), default=['720p', '1080p', '12mp'])
+    parser.add_argument('--lighting', nargs='+', choices=LIGHTING, default=list(LIGHTING))
+    parser.add_argument('--skews', nargs='+', type=float, default=[0, 10, 25], help="Page rotations in degrees")
+    parser.add_argument('--detection', choices=['full', 'pyramid', 'robust'], default='full', help="Detection mode")
+    parser.add_argument('--enhance', choices=ENHANCE_MODES, default='adaptive', help="Enhancement mode")
+    parser.add_argument('--no-ocr', action='store_true', help="Skip OCR (e.g. when Tesseract is not installed)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per stage; the fastest is recorded")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic scenes")
+    parser.add_argument('--baseline', help="Results of an earlier run to compare with")
+    for name, default in DEFAULT_THRESHOLDS.items():
+        parser.add_argument(f"--max-{name.replace('_', '-')}", type=float, default=default, dest=name,
+                            help=f"Allowed regression of {name} (default {default})")
+    args = parser.parse_args()
+
+    records = []
+    with tempfile.TemporaryDirectory() as directory:
+        scenes = make_scenes([RESOLUTIONS[name] for name in args.resolutions], args.lighting, args.skews, args.seed)
+        for scene in scenes:
+            record = run_scene(scene, directory, args.detection, not args.no_ocr, args.repeat, args.enhance)
+            records.append(record)
+            error = f"{record['corner_error']:.2f}px" if record['detected'] else "not found"
+            cer = f"{record['cer']:.3f}" if record['cer'] is not None else "-"
+            timings = "  ".join(f"{stage} {values['seconds'] * 1000:.1f}ms"
+                                for stage, values in record['stages'].items())
+            print(f"{record['name']:32} corners {error:>10}  CER {cer:>6}  {timings}")
+
+    summary = summarise(records)
+    results = {
+        'meta': {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+                 'opencv': cv2.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count(),
+                 'detection_mode': args.detection, 'enhance_mode': args.enhance, 'seed': args.seed,
+                 'repeat': args.repeat},
+        'summary': summary,
+        'scenes': records,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"\n{json.dumps(summary, indent=2)}\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['summary']
+        thresholds = {name: getattr(args, name) for name in DEFAULT_THRESHOLDS}
+        regressions = compare(summary, baseline, thresholds)
+        if regressions:
+            print("\nRegressions against the baseline:\n  " + "\n  ".join(regressions))
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+"""
+Measures how long the app takes to start, in fresh Python processes, and fails if it exceeds a budget,
+so a new top-level import of a heavy library is noticed.
+
+Run from the src directory:
+    python -m benchmarks.startup --repeat 5 --budget-ms 800
+    python -m benchmarks.startup --gui  # Time to the first frame of the window (needs a display)
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# The modules main.py needs before the first window can be shown
+APP_IMPORTS = "import utils.image_processing"
+
+
+def time_command(command, env):
+    """ Runs a command and returns its wall-clock duration in milliseconds. """
+    start = time.perf_counter()
+    subprocess.run(command, check=True, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def time_first_frame(env):
+    """ Starts the app in benchmark mode and returns the startup time it reports, in milliseconds. """
+    output = subprocess.run([sys.executable, 'main.py'], check=True, env={**env, 'STARTUP_BENCHMARK': '1'},
+                            capture_output=True, text=True).stdout
+    match = re.search(r"startup_ms=([\d.]+)", output)
+    if match is None:
+        raise RuntimeError("main.py did not report its startup time")
+    return float(match.group(1))
+
+
+def slowest_imports(env, count):
+    """ Returns the count slowest top-level imports as (milliseconds, module), from python -X importtime. """
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', APP_IMPORTS], check=True, env=env,
+                            capture_output=True, text=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)", line)
+        if match and len(match.group(2)) <= 2:  # Only modules imported directly by our code
+            imports.append((int(match.group(1)) / 1000, match.group(3)))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the app.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of fresh processes; the median is reported")
+    parser.add_argument('--budget-ms', type=float, default=None, help="Exit with an error above this startup time")
+    parser.add_argument('--gui', action='store_true', help="Measure the time to the first frame instead of imports")
+    parser.add_argument('--top', type=int, default=8, help="Number of slowest imports to list")
+    args = parser.parse_args()
+    env = {**os.environ, 'KIVY_NO_ARGS': '1', 'KIVY_NO_CONSOLELOG': '1'}
+
+    if args.gui:
+        label = "first frame"
+        times = [time_first_frame(env) for _ in range(args.repeat)]
+    else:
+        label = "imports"
+        interpreter = statistics.median(time_command([sys.executable, '-c', 'pass'], env) for _ in range(args.repeat))
+        times = [time_command([sys.executable, '-c', APP_IMPORTS], env) - interpreter for _ in range(args.repeat)]
+    startup = statistics.median(times)
+    print(f"Startup ({label}): median {startup:.0f} ms, min {min(times):.0f} ms, max {max(times):.0f} ms")
+
+    print("Slowest imports:")
+    for milliseconds, module in slowest_imports(env, args.top):
+        print(f"  {milliseconds:8.1f} ms  {module}")
+
+    if args.budget_ms is not None and startup > args.budget_ms:
+        print(f"Startup time {startup:.0f} ms is over the budget of {args.budget_ms:.0f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
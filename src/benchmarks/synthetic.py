@@ -0,0 +1,143 @@
+"""
+Synthetic document photos with known ground truth (page corners and text), for measuring the pipeline.
+"""
+import cv2
+import numpy as np
+
+WORDS = ("the quick brown fox jumps over lazy dog study notes chapter physics energy mass light "
+         "speed equation result lecture summary exam question answer theory method data value "
+         "example figure table page section reference important remember review").split()
+
+LIGHTING = ('even', 'dim', 'gradient', 'shadow')
+
+
+# A PAGE OF TEXT
+def make_page(width=850, height=1100, rng=None):
+    """
+    Renders a white page with lines of random words.
+
+    :param width: Page width in pixels.
+    :param height: Page height in pixels.
+    :param rng: numpy.random.Generator, for reproducible pages.
+    :return: (page as a BGR image, the text on it with one line per row)
+    """
+    rng = rng or np.random.default_rng(0)
+    page = np.full((height, width, 3), 250, np.uint8)
+    margin = width // 10
+    scale = width / 850
+    line_height = int(48 * scale)
+    lines = []
+    for y in range(margin + line_height, height - margin, line_height):
+        words = []
+        while True:
+            candidate = " ".join(words + [str(rng.choice(WORDS))])
+            text_width = cv2.getTextSize(candidate, cv2.FONT_HERSHEY_DUPLEX, scale, max(1, round(scale)))[0][0]
+            if text_width > width - 2 * margin:
+                break
+            words = candidate.split()
+        line = " ".join(words)
+        cv2.putText(page, line, (margin, y), cv2.FONT_HERSHEY_DUPLEX, scale, (20, 20, 20), max(1, round(scale)),
+                    cv2.LINE_AA)
+        lines.append(line)
+    return page, "\n".join(lines)
+
+
+def _background(width, height, rng):
+    # A dark, slightly textured table top
+    base = rng.integers(40, 90, size=3)
+    noise = cv2.GaussianBlur(rng.normal(0, 12, (height // 8 + 1, width // 8 + 1)).astype(np.float32), (0, 0), 2)
+    noise = cv2.resize(noise, (width, height))
+    return np.clip(base[None, None, :] + noise[..., None], 0, 255).astype(np.uint8)
+
+
+def _apply_lighting(scene, lighting, rng):
+    height, width = scene.shape[:2]
+    if lighting == 'even':
+        return scene
+    if lighting == 'dim':
+        light = np.full((height, width), 0.45, np.float32)
+    elif lighting == 'gradient':
+        # Light falls off from one side of the frame to the other
+        angle = rng.uniform(0, 2 * np.pi)
+        xs, ys = np.meshgrid(np.linspace(-1, 1, width, dtype=np.float32), np.linspace(-1, 1, height, dtype=np.float32))
+        light = 0.75 + 0.25 * (np.cos(angle) * xs + np.sin(angle) * ys)
+    elif lighting == 'shadow':
+        # A soft-edged shadow (e.g. of the phone or a hand) over part of the page
+        light = np.ones((height, width), np.float32)
+        centre = (int(rng.uniform(0.3, 0.7) * width), int(rng.uniform(0.2, 0.5) * height))
+        axes = (int(width * rng.uniform(0.2, 0.35)), int(height * rng.uniform(0.15, 0.3)))
+        cv2.ellipse(light, centre, axes, rng.uniform(0, 180), 0, 360, 0.55, -1)
+        light = cv2.GaussianBlur(light, (0, 0), max(width, height) / 60)
+    else:
+        raise ValueError(f"Unknown lighting '{lighting}', expected one of {LIGHTING}")
+    return np.clip(scene.astype(np.float32) * light[..., None], 0, 255).astype(np.uint8)
+
+
+# A PHOTO OF THE PAGE
+def make_scene(page, resolution=(1920, 1080), lighting='even', skew=0.0, coverage=0.6, rng=None):
+    """
+    Places a page in a photo: rotated by the skew angle, with a little perspective, on a background,
+    under the given lighting, with mild blur and sensor noise.
+
+    :param page: The page image (see make_page).
+    :param resolution: (width, height) of the photo.
+    :param lighting: One of LIGHTING.
+    :param skew: Rotation of the page in degrees.
+    :param coverage: Approximate share of the photo's height taken by the page.
+    :param rng: numpy.random.Generator, for reproducible scenes.
+    :return: (photo as a BGR image, the page corners in the photo as a 4x2 float32 array ordered
+             top-left, top-right, bottom-right, bottom-left)
+    """
+    rng = rng or np.random.default_rng(0)
+    width, height = resolution
+    page_height, page_width = page.shape[:2]
+
+    # Scale the page into the frame, rotate it around the centre and nudge every corner a little
+    size = coverage * min(height, width * page_height / page_width)
+    half = np.array([size * page_width / page_height, size]) / 2
+    corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * half
+    angle = np.deg2rad(skew)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    corners = corners @ rotation.T + np.array([width, height]) / 2
+    corners += rng.uniform(-0.03, 0.03, size=(4, 2)) * size
+    corners = corners.astype(np.float32)
+
+    source = np.array([[0, 0], [page_width - 1, 0], [page_width - 1, page_height - 1], [0, page_height - 1]],
+                      np.float32)
+    matrix = cv2.getPerspectiveTransform(source, corners)
+    scene = _background(width, height, rng)
+    cv2.warpPerspective(page, matrix, (width, height), dst=scene, borderMode=cv2.BORDER_TRANSPARENT)
+
+    scene = _apply_lighting(scene, lighting, rng)
+    scene = cv2.GaussianBlur(scene, (3, 3), 0.8)
+    scene = np.clip(scene + rng.normal(0, 3, scene.shape), 0, 255).astype(np.uint8)
+    return scene, corners
+
+
+def make_scenes(resolutions, lightings=LIGHTING, skews=(0, 10, 25), seed=0):
+    """
+    Yields every combination of resolution, lighting and skew as a dictionary with the scene,
+    its ground truth and its parameters. The same seed always gives the same scenes.
+    """
+    rng = np.random.default_rng(seed)
+    for width, height in resolutions:
+        for lighting in lightings:
+            for skew in skews:
+                # Page resolution follows the photo, like a real camera
+                page, text = make_page(int(height * 0.6 * 850 / 1100), int(height * 0.6), rng)
+                scene, corners = make_scene(page, (width, height), lighting, skew, rng=rng)
+                yield {'name': f"{width}x{height}_{lighting}_skew{skew:g}", 'image': scene, 'corners': corners,
+                       'text': text, 'resolution': [width, height], 'lighting': lighting, 'skew': skew}
+
+
+# GROUND TRUTH
+def character_error_rate(recognised, truth):
+    """ Edit distance between the texts (whitespace-normalised) divided by the length of the true text. """
+    recognised, truth = " ".join(recognised.split()), " ".join(truth.split())
+    previous = list(range(len(truth) + 1))
+    for i, char in enumerate(recognised, start=1):
+        current = [i]
+        for j, expected in enumerate(truth, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != expected)))
+        previous = current
+    return previous[-1] / max(len(truth), 1)
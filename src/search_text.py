@@ -0,0 +1,28 @@
+import argparse
+
+from utils.text_index import TextIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the text of every scanned page.")
+    parser.add_argument('query', nargs='+', help="Words to look for; end a word with * to match its beginning")
+    parser.add_argument('--index', help="Full-text index to search (default: the one in the user data directory)")
+    parser.add_argument('-n', '--limit', type=int, default=20, help="Number of results")
+    parser.add_argument('--optimize', action='store_true', help="Compact the index first (after many updates)")
+    args = parser.parse_args()
+
+    index = TextIndex(args.index)
+    if args.optimize:
+        index.optimize()
+    results = index.search(" ".join(args.query), args.limit)
+    for result in results:
+        location = result['file_path'] or result['source'] or result['document_id']
+        drive = f"  (Drive ID: {result['drive_id']})" if result['drive_id'] else ""
+        print(f"{location}, page {result['page']}{drive}\n    {' '.join(result['snippet'].split())}")
+    print(f"{len(results)} of {len(index)} pages match")
+    index.close()
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
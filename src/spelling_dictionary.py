@@ -0,0 +1,33 @@
+import argparse
+import os
+import time
+
+from utils.spelling import MAX_EDIT_DISTANCE, SpellChecker, read_frequencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile word frequency lists into the spelling dictionary used to "
+                                                 "correct OCR text (batch_scan.py --spelling, "
+                                                 "SCANNER_SPELLING_DICTIONARY for the app).")
+    parser.add_argument('frequencies', nargs='+',
+                        help="Files with one 'word count' pair per line, e.g. SymSpell's "
+                             "frequency_dictionary_en_82_765.txt or TextBlob's en-spelling.txt")
+    parser.add_argument('-o', '--output', default='spelling.npz', help="Where to write the dictionary")
+    parser.add_argument('--max-distance', type=int, default=MAX_EDIT_DISTANCE,
+                        help="Largest number of edits a correction may make")
+    args = parser.parse_args()
+
+    counts = {}
+    for path in args.frequencies:
+        for word, count in read_frequencies(path).items():
+            counts[word] = counts.get(word, 0) + count
+    start = time.perf_counter()
+    checker = SpellChecker.build(counts, args.max_distance)
+    checker.save(args.output)
+    print(f"{len(checker.words)} words, {len(checker.keys)} index entries in {time.perf_counter() - start:.1f}s; "
+          f"written to {args.output} ({os.path.getsize(args.output) / 1024 ** 2:.1f} MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,74 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from batch_scan import DEFAULT_OPTIONS, collect_images, output_names, run_batch
+from benchmarks.synthetic import make_page, make_scene
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return os.path.abspath(path)
+
+
+def test_collect_images_expands_folders_and_patterns(tmp_path):
+    first = touch(str(tmp_path / 'a' / 'one.jpg'))
+    second = touch(str(tmp_path / 'a' / 'two.PNG'))
+    touch(str(tmp_path / 'a' / 'notes.txt'))
+    nested = touch(str(tmp_path / 'b' / 'c' / 'three.tif'))
+    assert collect_images([str(tmp_path / 'a'), first]) == sorted([first, second])
+    assert collect_images([str(tmp_path / '**' / '*.tif')]) == [nested]
+    assert collect_images([str(tmp_path / 'missing')]) == []
+
+
+def test_output_names_follow_the_folders_below_the_common_one(tmp_path):
+    week1 = str(tmp_path / 'week1' / 'scan.jpg')
+    week2 = str(tmp_path / 'week2' / 'scan.jpg')
+    assert output_names([week1, week2]) == {week1: os.path.join('week1', 'scan'),
+                                            week2: os.path.join('week2', 'scan')}
+    assert output_names([week1]) == {week1: 'scan'}
+    assert output_names([]) == {}
+
+
+def test_output_names_add_the_extension_when_only_it_differs(tmp_path):
+    jpg, png = str(tmp_path / 'scan.jpg'), str(tmp_path / 'Scan.PNG')
+    assert output_names([jpg, png]) == {jpg: 'scan_jpg', png: 'Scan_png'}
+
+
+def test_output_names_refuse_names_that_only_differ_in_case(tmp_path):
+    with pytest.raises(ValueError):
+        output_names([str(tmp_path / 'scan_jpg.png'), str(tmp_path / 'scan.jpg'), str(tmp_path / 'scan.png')])
+
+
+def test_images_with_the_same_name_in_different_folders_keep_their_outputs(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    for folder in ('week1', 'week2'):
+        scene, _ = make_scene(make_page(rng=rng)[0], rng=rng)
+        path = tmp_path / 'photos' / folder / 'scan.jpg'
+        path.parent.mkdir(parents=True)
+        cv2.imwrite(str(path), scene)
+        paths.append(str(path))
+
+    summary = run_batch(paths, str(tmp_path / 'out'), workers=1,
+                        **{**DEFAULT_OPTIONS, 'run_ocr': False, 'formats': ('png',)})
+
+    outputs = sorted(output for result in summary['results'] for output in result['outputs'])
+    assert [result['status'] for result in summary['results']] == ['ok', 'ok']
+    assert summary['pages_per_second'] > 0
+    assert outputs == [str(tmp_path / 'out' / folder / 'scan.png') for folder in ('week1', 'week2')]
+    assert all(os.path.getsize(output) > 0 for output in outputs)
+
+
+def test_failed_images_do_not_count_towards_the_throughput(tmp_path):
+    broken = tmp_path / 'broken.jpg'
+    broken.write_bytes(b'not an image')
+
+    summary = run_batch([str(broken)], str(tmp_path / 'out'), workers=1,
+                        **{**DEFAULT_OPTIONS, 'run_ocr': False, 'formats': ('png',)})
+
+    assert (summary['failed'], summary['succeeded']) == (1, 0)
+    assert summary['pages_per_second'] == 0
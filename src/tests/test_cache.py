@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils.cache import ResultCache, content_key, derived_key
+from utils.pipeline import Pipeline, Stage
+
+
+def add(value, amount=1):
+    return value + amount
+
+
+def double(value):
+    return value * 2
+
+
+def test_content_key_depends_on_pixels_shape_and_dtype():
+    image = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    assert content_key(image) == content_key(image.copy())
+    assert content_key(image) != content_key(image.reshape(4, 3))
+    assert content_key(image) != content_key(image.astype(np.uint16))
+    changed = image.copy()
+    changed[2, 3] += 1
+    assert content_key(image) != content_key(changed)
+    # Views hash their content, not the array they belong to
+    assert content_key(image[:, ::2]) == content_key(np.ascontiguousarray(image[:, ::2]))
+
+
+def test_content_key_tells_types_apart():
+    assert content_key('1') != content_key(1)
+    assert content_key((1, 'a')) == content_key((1, 'a'))
+
+
+def test_derived_key_depends_on_order_and_boundaries():
+    assert derived_key('a', 'b') != derived_key('b', 'a')
+    assert derived_key('ab', 'c') != derived_key('a', 'bc')
+
+
+def test_stage_keys_change_with_the_definition_and_the_inputs():
+    keys = {'value': 'k1'}
+    key = Stage("Add", add, ['value'], 'result', amount=2).cache_key(keys)
+    assert key == Stage("Add", add, ['value'], 'result', amount=2).cache_key(keys)
+    assert key != Stage("Add", add, ['value'], 'result', amount=3).cache_key(keys)
+    assert key != Stage("Add", add, ['value'], 'result', version=2, amount=2).cache_key(keys)
+    assert key != Stage("Add", double, ['value'], 'result', amount=2).cache_key(keys)
+    assert key != Stage("Add", add, ['value'], 'result', amount=2).cache_key({'value': 'k2'})
+
+
+def test_memory_tier_evicts_the_least_recently_used():
+    cache = ResultCache(max_memory_bytes=250)
+    for name in 'abc':
+        cache.put(name, np.zeros(100, np.uint8))
+    assert 'a' not in cache and 'b' in cache and 'c' in cache
+    cache.get('b')
+    cache.put('d', np.zeros(100, np.uint8))
+    assert 'b' in cache and 'c' not in cache
+    assert cache.get('missing', 'default') == 'default'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cached_arrays_are_read_only_copies():
+    cache = ResultCache()
+    image = np.zeros(4, np.uint8)
+    cache.put('image', image)
+    image[0] = 9
+    value = cache.get('image')
+    assert value[0] == 0
+    with pytest.raises(ValueError):
+        value[0] = 1
+
+
+def test_disk_tier_survives_a_restart_and_stays_within_its_size(tmp_path):
+    cache = ResultCache(str(tmp_path), max_disk_bytes=10_000)
+    cache.put('0a', np.ones((10, 10), np.uint8))
+    cache.put('0b', "text")
+    cache.put('0c', {'words': [1, 2]})
+
+    restarted = ResultCache(str(tmp_path), max_disk_bytes=10_000)
+    assert restarted.get('0a').sum() == 100
+    assert restarted.get('0b') == "text"
+    assert restarted.get('0c') == {'words': [1, 2]}
+
+    for number in range(10):
+        restarted.put(f'1{number}', np.zeros(2000, np.uint8))
+    assert restarted.disk_bytes <= 10_000
+    files = [name for _, _, names in os.walk(tmp_path) for name in names]
+    assert len(files) == len(restarted.disk)
+
+
+def test_damaged_files_are_treated_as_missing(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put('0a', np.ones(10, np.uint8))
+    path = cache.disk['0a'][0]
+    with open(path, 'wb') as file:
+        file.write(b'not numpy')
+    restarted = ResultCache(str(tmp_path))
+    assert restarted.get('0a') is None
+    assert '0a' not in restarted
+
+
+def test_pipelines_reuse_cached_results_and_recompute_when_a_stage_changes():
+    calls = []
+
+    def counted(name, func):
+        def run(*args, **params):
+            calls.append(name)
+            return func(*args, **params)
+        run.__qualname__ = func.__qualname__
+        return run
+
+    cache = ResultCache()
+
+    def pipeline(amount):
+        return Pipeline([Stage("Add", counted('add', add), ['image'], 'added', cacheable=False, amount=amount),
+                         Stage("Double", counted('double', double), ['added'], 'doubled')], cache=cache)
+
+    image = np.ones(3, np.int32)
+    assert pipeline(1).run(image=image)['doubled'].tolist() == [4, 4, 4]
+    assert calls == ['add', 'double']
+    # The final result is cached, so neither the stage nor the uncacheable one feeding it runs again
+    assert pipeline(1).run(image=image.copy())['doubled'].tolist() == [4, 4, 4]
+    assert calls == ['add', 'double']
+    assert pipeline(2).run(image=image)['doubled'].tolist() == [6, 6, 6]
+    assert calls == ['add', 'double', 'add', 'double']
+    assert pipeline(1).run(image=image + 1)['doubled'].tolist() == [6, 6, 6]
+    assert len(calls) == 6
@@ -0,0 +1,129 @@
+import threading
+
+from utils.folder_index import FolderIndex
+from utils.google_api import FOLDER_MIME_TYPE
+
+
+class Request:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class FakeDrive:
+    """ Just enough of the Drive API for FolderIndex: folder listing in pages and the changes feed. """
+    def __init__(self, folders, page_size=2):
+        self.folders = folders
+        self.page_size = page_size
+        self.changes_by_token = {}  # Page token -> response of changes().list
+        self.start_token = '1'
+        self.calls = []
+
+    def files(self):
+        return self
+
+    def changes(self):
+        return self
+
+    def getStartPageToken(self):
+        return Request({'startPageToken': self.start_token})
+
+    def list(self, pageToken=None, **params):
+        self.calls.append(('changes' if 'includeRemoved' in params else 'files', pageToken))
+        if 'includeRemoved' in params:
+            return Request(self.changes_by_token[pageToken])
+        start = int(pageToken or 0)
+        response = {'files': self.folders[start:start + self.page_size]}
+        if start + self.page_size < len(self.folders):
+            response['nextPageToken'] = str(start + self.page_size)
+        return Request(response)
+
+
+def folder(folder_id, name, parent=None, **fields):
+    return {'id': folder_id, 'name': name, 'mimeType': FOLDER_MIME_TYPE, **({'parents': [parent]} if parent else {}),
+            **fields}
+
+
+def make_index():
+    drive = FakeDrive([folder('s', 'Study'), folder('y', '2024', 's'), folder('p', 'Physics', 'y'),
+                       folder('b', 'Biology', 'y'), folder('x', 'phys_50%')])
+    index = FolderIndex(':memory:')
+    assert index.sync(drive) == 5
+    return index, drive
+
+
+def test_first_sync_lists_every_folder_and_resolves_paths():
+    index, drive = make_index()
+    assert len(index) == 5
+    assert [call[0] for call in drive.calls] == ['files'] * 3
+    assert index.path_of('p') == 'Study/2024/Physics'
+    assert index.path_of('missing') == ''
+
+
+def test_search_puts_names_starting_with_the_text_first_and_matches_wildcards_literally():
+    index, _ = make_index()
+    assert [hit['name'] for hit in index.search('PHYS')] == ['phys_50%', 'Physics']
+    assert [hit['name'] for hit in index.search('s')] == ['Study', 'phys_50%', 'Physics']
+    assert [hit['id'] for hit in index.search('_5')] == ['x']
+    assert [hit['id'] for hit in index.search('%')] == ['x']
+    assert len(index.search('', limit=2)) == 2
+    assert [hit['path'] for hit in index.search('bio')] == ['Study/2024/Biology']
+
+
+def test_later_syncs_only_apply_the_changes():
+    index, drive = make_index()
+    drive.changes_by_token = {
+        '1': {'nextPageToken': '2', 'changes': [
+            {'fileId': 'p', 'file': folder('p', 'Physics I', 'y')},
+            {'fileId': 'b', 'removed': True},
+        ]},
+        '2': {'newStartPageToken': '3', 'changes': [
+            {'fileId': 'x', 'file': folder('x', 'phys_50%', trashed=True)},
+            {'fileId': 'f', 'file': {'id': 'f', 'name': 'notes.pdf', 'mimeType': 'application/pdf'}},
+            {'fileId': 'c', 'file': folder('c', 'Chemistry', 'y')},
+        ]},
+    }
+    drive.calls.clear()
+    assert index.sync(drive) == 4
+    assert drive.calls == [('changes', '1'), ('changes', '2')]
+    assert sorted(hit['path'] for hit in index.search('')) == ['Study', 'Study/2024', 'Study/2024/Chemistry',
+                                                                'Study/2024/Physics I']
+
+    drive.changes_by_token['3'] = {'newStartPageToken': '3', 'changes': []}
+    assert index.sync(drive) == 0
+
+
+def test_created_folders_show_up_before_the_next_sync():
+    index, _ = make_index()
+    index.add('n', 'New course', 's')
+    assert index.search('new course')[0]['path'] == 'Study/New course'
+
+
+class SlowDrive(FakeDrive):
+    """ Blocks on the changes feed until released, like a slow connection. """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = threading.Event()
+        self.release = threading.Event()
+
+    def list(self, pageToken=None, **params):
+        if 'includeRemoved' in params:
+            self.waiting.set()
+            assert self.release.wait(5)
+        return super().list(pageToken, **params)
+
+
+def test_searches_are_answered_while_a_sync_waits_for_drive():
+    index, _ = make_index()
+    drive = SlowDrive([])
+    drive.changes_by_token['1'] = {'newStartPageToken': '2', 'changes': [{'fileId': 'c', 'file': folder('c', 'Chem')}]}
+    sync = threading.Thread(target=index.sync, args=(drive,))
+    sync.start()
+    assert drive.waiting.wait(5)
+    assert [hit['name'] for hit in index.search('bio')] == ['Biology']
+    assert len(index) == 5
+    drive.release.set()
+    sync.join(5)
+    assert len(index) == 6
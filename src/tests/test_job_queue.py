@@ -0,0 +1,174 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from utils.job_queue import DONE, FAILED, PENDING, PROCESSED, PROCESSING, UPLOADING, JobQueue, file_digest
+import watch_folder
+from watch_folder import ScanDaemon
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(':memory:', max_attempts=2, retry_delay=0.05)
+    yield queue
+    queue.close()
+
+
+def test_file_digest_depends_on_the_content_only(tmp_path):
+    (tmp_path / 'a.jpg').write_bytes(b'page')
+    (tmp_path / 'b.jpg').write_bytes(b'page')
+    (tmp_path / 'c.jpg').write_bytes(b'other page')
+    assert file_digest(tmp_path / 'a.jpg') == file_digest(tmp_path / 'b.jpg') != file_digest(tmp_path / 'c.jpg')
+
+
+def test_the_same_content_is_only_queued_once(queue):
+    assert queue.add('/in/a.jpg', 10, 1, 'digest') == 1
+    assert queue.add('/in/copy of a.jpg', 10, 2, 'digest') is None
+    assert queue.is_known('/in/a.jpg', 10, 1)
+    assert not queue.is_known('/in/a.jpg', 10, 5)
+    assert queue.counts() == {PENDING: 1}
+
+
+def test_jobs_are_claimed_oldest_first_and_go_through_their_states(queue):
+    for name in 'abc':
+        queue.add(f'/in/{name}.jpg', 1, 1, name)
+    job = queue.claim(PENDING, PROCESSING)
+    assert (job['id'], job['state'], job['outputs']) == (1, PROCESSING, [])
+    outputs = [{'path': '/out/a.pdf', 'id': None}]
+    queue.update(job['id'], PROCESSED, outputs)
+    job = queue.claim(PROCESSED, UPLOADING)
+    assert job['outputs'] == outputs
+    queue.update(job['id'], DONE)
+    assert queue.counts() == {PENDING: 2, DONE: 1}
+
+
+def test_failed_steps_wait_for_their_retry_and_fail_for_good_after_the_last_attempt(queue):
+    queue.add('/in/a.jpg', 1, 1, 'a')
+    job = queue.claim(PENDING, PROCESSING)
+    assert queue.fail(job['id'], 'no page found', PENDING) == PENDING
+    assert queue.claim(PENDING, PROCESSING) is None
+    count, delay = queue.waiting([PENDING])
+    assert count == 1 and 0 < delay <= 0.05
+    time.sleep(0.06)
+    assert queue.waiting([PENDING]) == (1, 0.0)
+    job = queue.claim(PENDING, PROCESSING)
+    assert queue.fail(job['id'], 'no page found', PENDING) == FAILED
+    assert [tuple(row) for row in queue.failures()] == [('/in/a.jpg', 'no page found')]
+
+    assert queue.retry_failed() == 1
+    assert queue.claim(PENDING, PROCESSING)['attempts'] == 0
+
+
+def test_failed_uploads_are_retried_without_processing_again(queue):
+    queue.add('/in/a.jpg', 1, 1, 'a')
+    queue.update(1, PROCESSED, [{'path': '/out/a.pdf', 'id': None}])
+    job = queue.claim(PROCESSED, UPLOADING)
+    queue.fail(job['id'], 'timeout', PROCESSED)
+    queue.fail(job['id'], 'timeout', PROCESSED)
+    assert queue.retry_failed() == 1
+    assert queue.counts() == {PROCESSED: 1}
+
+
+def test_interrupted_jobs_resume(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    queue = JobQueue(path)
+    queue.add('/in/a.jpg', 1, 1, 'a')
+    queue.add('/in/b.jpg', 1, 1, 'b')
+    queue.claim(PENDING, PROCESSING)
+    queue.update(2, PROCESSED, [{'path': '/out/b.pdf', 'id': 'drive-1'}])
+    queue.claim(PROCESSED, UPLOADING)
+    queue.close()
+
+    queue = JobQueue(path)
+    assert queue.recover() == 2
+    assert queue.counts() == {PENDING: 1, PROCESSED: 1}
+    assert queue.claim(PROCESSED, UPLOADING)['outputs'] == [{'path': '/out/b.pdf', 'id': 'drive-1'}]
+    queue.close()
+
+
+def test_claims_can_be_limited_to_some_jobs(queue):
+    for name in 'abc':
+        queue.add(f'/in/{name}.jpg', 1, 1, name)
+    assert queue.claim(PENDING, PROCESSING, only={3, 2})['id'] == 2
+    assert queue.claim(PENDING, PROCESSING, only={2}) is None
+    assert queue.claim(PENDING, PROCESSING, only=set()) is None
+
+
+def test_deferred_jobs_keep_their_attempts(queue):
+    queue.add('/in/a.jpg', 1, 1, 'a')
+    job = queue.claim(PENDING, PROCESSING)
+    queue.defer(job['id'], PENDING, 60)
+    assert queue.claim(PENDING, PROCESSING) is None
+    assert queue.waiting([PENDING])[1] > 59
+    assert queue.waiting([PROCESSED]) == (0, None)
+
+
+def test_jobs_sharing_outputs_are_found(queue):
+    for name in 'abc':
+        queue.add(f'/in/{name}.jpg', 1, 1, name)
+    queue.update(1, PROCESSED, [{'path': '/out/a.pdf', 'id': None}, {'path': '/out/a.png', 'id': None}])
+    queue.update(2, PROCESSED, [{'path': '/out/a.png', 'id': None}])
+    queue.update(3, PROCESSED, [{'path': '/out/c.pdf', 'id': None}])
+    job = queue.claim(PROCESSED, UPLOADING)
+    assert [other['id'] for other in queue.sharing_outputs(job)] == [2]
+    assert queue.sharing_outputs({'id': 3, 'outputs': [{'path': '/out/c.pdf'}]}) == []
+
+
+class FakeUploader:
+    def __init__(self, failures=()):
+        self.uploaded = []
+        self.failures = list(failures)
+
+    def upload(self, path, folder_id):
+        time.sleep(0.02)
+        if path in self.failures:
+            self.failures.remove(path)
+            raise OSError("connection reset")
+        self.uploaded.append(path)
+        return f'drive:{path}'
+
+
+def test_rescans_do_not_upload_the_files_of_their_first_scan_again(queue, tmp_path):
+    # Jobs 1 and 2 are the same page: the rescan got the outputs of the first scan before they were uploaded
+    shared = [{'path': '/out/a.pdf', 'id': None}, {'path': '/out/a.png', 'id': None}]
+    for name in 'abc':
+        queue.add(f'/in/{name}.jpg', 1, 1, name)
+    queue.update(1, PROCESSED, shared)
+    queue.update(2, PROCESSED, shared)
+    queue.update(3, PROCESSED, [{'path': '/out/c.pdf', 'id': None}])
+    uploader = FakeUploader(failures=['/out/a.pdf'])
+    daemon = ScanDaemon(SimpleNamespace(poll=lambda: 0, candidates={}), queue, str(tmp_path), uploader=uploader,
+                        upload_workers=3, poll_interval=0.01)
+
+    counts = daemon.run(once=True)
+
+    # --once also waited for the upload that failed once to be retried
+    assert counts == {DONE: 3}
+    assert sorted(uploader.uploaded) == ['/out/a.pdf', '/out/a.png', '/out/c.pdf']
+    assert queue.claim(DONE, DONE)['outputs'] == [{'path': '/out/a.pdf', 'id': 'drive:/out/a.pdf'},
+                                                   {'path': '/out/a.png', 'id': 'drive:/out/a.png'}]
+
+
+def crash_on_bad_pages(path, output_dir, options, name):
+    """ Stands in for batch_scan.process_file: kills its worker process on pages named bad. """
+    time.sleep(0.2)  # Long enough for the pages to be in the pool together
+    if 'bad' in os.path.basename(path):
+        os._exit(1)
+    return {'source': path, 'status': 'ok', 'outputs': [], 'error': None, 'seconds': 0.2}
+
+
+def test_only_the_page_that_crashes_the_pool_on_its_own_uses_up_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch_folder, 'process_file', crash_on_bad_pages)
+    queue = JobQueue(':memory:', max_attempts=1, retry_delay=0.05)
+    for name in ('a', 'bad', 'b'):
+        queue.add(f'/in/{name}.jpg', 1, 1, name)
+    daemon = ScanDaemon(SimpleNamespace(poll=lambda: 0, candidates={}), queue, str(tmp_path), workers=3,
+                        poll_interval=0.01)
+
+    # With a single attempt, the pages that were only next to the crash would have failed with it
+    assert daemon.run(once=True) == {DONE: 2, FAILED: 1}
+    assert [path for path, _ in queue.failures()] == ['/in/bad.jpg']
+    assert not daemon.suspects
+    queue.close()
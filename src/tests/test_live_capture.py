@@ -0,0 +1,48 @@
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_page, make_scene
+from utils.live_capture import CaptureCancelledError, auto_capture
+
+
+@pytest.fixture
+def video(tmp_path):
+    """ A still page filmed for 200 frames, standing in for the webcam (a file is read faster than it is processed). """
+    scene, corners = make_scene(make_page(rng=np.random.default_rng(1))[0], resolution=(640, 480))
+    path = str(tmp_path / 'page.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (640, 480))
+    if not writer.isOpened():
+        pytest.skip("OpenCV cannot write videos here")
+    for _ in range(200):
+        writer.write(scene)
+    writer.release()
+    return path, corners
+
+
+def test_captures_on_a_worker_thread_and_hands_the_preview_frames_over(video):
+    path, corners = video
+    shown = []
+    result = {}
+
+    def capture():
+        result['capture'] = auto_capture(path, steady_frames=4, preview=False, on_frame=shown.append)
+
+    worker = threading.Thread(target=capture)
+    worker.start()
+    worker.join(30)
+    frame, contour = result['capture']
+    assert frame.shape == (480, 640, 3)
+    # Corner order may start anywhere; compare as a set of points
+    distances = np.linalg.norm(contour.reshape(4, 1, 2) - corners.reshape(1, 4, 2), axis=2)
+    assert distances.min(axis=1).max() < 10
+    assert len(shown) == 3 and all(image.shape == frame.shape for image in shown)
+
+
+def test_setting_the_event_cancels_the_capture(video):
+    cancelled = threading.Event()
+    cancelled.set()
+    with pytest.raises(CaptureCancelledError):
+        auto_capture(video[0], preview=False, cancelled=cancelled)
@@ -0,0 +1,102 @@
+import sys
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from utils import memory
+from utils.memory import MIN_PIXELS, BufferPool, MemoryBudget, MemoryBudgetError, image_size
+
+
+def write(path, width, height, *params):
+    image = np.random.default_rng(0).integers(0, 256, (height, width, 3), np.uint8)
+    assert cv2.imwrite(str(path), image, list(params))
+    return str(path)
+
+
+@pytest.mark.parametrize('name, params', [
+    ('photo.png', ()),
+    ('photo.jpg', ()),
+    ('progressive.jpg', (cv2.IMWRITE_JPEG_PROGRESSIVE, 1)),
+    ('optimized.jpg', (cv2.IMWRITE_JPEG_OPTIMIZE, 1)),
+])
+def test_image_size_reads_the_header(tmp_path, name, params):
+    assert image_size(write(tmp_path / name, 321, 123, *params)) == (321, 123)
+
+
+def test_image_size_skips_metadata_segments_before_the_frame(tmp_path):
+    path = write(tmp_path / 'photo.jpg', 64, 48)
+    data = open(path, 'rb').read()
+    exif = b'\xff\xe1' + (2 + 1000).to_bytes(2, 'big') + b'Exif\0\0' + bytes(994)
+    (tmp_path / 'exif.jpg').write_bytes(data[:2] + exif + data[2:])
+    assert image_size(str(tmp_path / 'exif.jpg')) == (64, 48)
+
+
+def test_image_size_of_other_or_broken_files_is_none(tmp_path):
+    (tmp_path / 'notes.txt').write_bytes(b'not an image at all')
+    assert image_size(str(tmp_path / 'notes.txt')) is None
+    path = write(tmp_path / 'photo.jpg', 64, 48)
+    (tmp_path / 'cut.jpg').write_bytes(open(path, 'rb').read()[:20])
+    assert image_size(str(tmp_path / 'cut.jpg')) is None
+
+
+def test_buffer_pool_reuses_buffers_per_thread():
+    pool = BufferPool()
+    first = pool.get('edges', (10, 20))
+    assert pool.get('edges', (10, 20)) is first
+    assert pool.get('edges', (10, 21)) is not first
+    assert pool.get('edges', (10, 21), 'float32').dtype == np.float32
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.get('edges', (10, 21), 'float32')))
+    thread.start()
+    thread.join()
+    assert other[0] is not pool.get('edges', (10, 21), 'float32')
+    assert repr(pool) == "BufferPool()"
+
+
+def test_fit_downscales_photos_to_what_is_left_of_the_budget(monkeypatch):
+    monkeypatch.setattr(memory, 'current_rss', lambda: 100 * 1024 ** 2)
+    budget = MemoryBudget(100 * 1024 ** 2 + 2_000_000 * 9)  # Room for 2 MP on top of what is in use
+    small = np.zeros((1000, 1500, 3), np.uint8)
+    assert budget.fit(small) == (small, 1.0)
+    large = np.zeros((3000, 4000, 3), np.uint8)
+    # The photo counts as in use already, so a little more than 2 MP fits
+    fitted, scale = budget.fit(large)
+    assert fitted.shape[0] * fitted.shape[1] <= 2_000_000 + large.nbytes // 9
+    assert fitted.shape[1] == round(4000 * scale)
+
+
+def test_fit_refuses_a_budget_without_room_for_a_page(monkeypatch):
+    monkeypatch.setattr(memory, 'current_rss', lambda: 500 * 1024 ** 2)
+    with pytest.raises(MemoryBudgetError):
+        MemoryBudget(400 * 1024 ** 2).fit(np.zeros((3000, 4000, 3), np.uint8))
+
+
+def test_load_decodes_large_photos_at_a_reduced_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory, 'current_rss', lambda: 0)
+    path = write(tmp_path / 'photo.jpg', 4000, 3000)
+    image = MemoryBudget(4_000_000 * 9).load(path)
+    assert image.shape[:2] == (1500, 2000)
+    # Never below MIN_PIXELS, even when the budget is smaller than that
+    height, width = MemoryBudget(MIN_PIXELS * 9).load(path).shape[:2]
+    assert width * height >= MIN_PIXELS
+    with pytest.raises(FileNotFoundError):
+        MemoryBudget(MIN_PIXELS * 9).load(str(tmp_path / 'missing.jpg'))
+
+
+def test_resident_memory_is_measured_on_linux_and_macos():
+    if not sys.platform.startswith('linux') and sys.platform != 'darwin':
+        pytest.skip("Only measured on Linux and macOS")
+    rss = memory.current_rss()
+    assert rss is not None and 0 < rss <= memory.peak_rss()
+
+
+def test_budgets_warn_where_the_memory_in_use_cannot_be_measured(monkeypatch):
+    monkeypatch.setattr(memory, 'current_rss', lambda: None)
+    budget = MemoryBudget(MIN_PIXELS * 9)
+    with pytest.warns(RuntimeWarning, match="cannot be measured"):
+        budget.check('Warped Image')
+    photo = np.zeros((1000, 1000, 3), np.uint8)
+    with pytest.warns(RuntimeWarning):
+        assert budget.fit(photo) == (photo, 1.0)
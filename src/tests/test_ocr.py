@@ -0,0 +1,141 @@
+import os
+import stat
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import WORDS
+from utils import ocr
+from utils.ocr import (TSV_COLUMNS, SubprocessEngine, ocr_words, parse_tsv, select_words, split_into_bands,
+                       words_to_text)
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def render_page(rng, lines=40, width=1200, line_height=45, margin_rule=False):
+    """ A page of random words and the box of every word on it, as (text, left, top, width, height, line). """
+    page = np.full((lines * line_height + 100, width), 255, np.uint8)
+    boxes = []
+    for line in range(lines):
+        x, baseline = 60, 70 + line * line_height
+        while True:
+            word = str(rng.choice(WORDS))
+            (word_width, word_height), descent = cv2.getTextSize(word, FONT, 1, 2)
+            if x + word_width > width - 60:
+                break
+            # Drawn on its own first, for the box of its ink (as Tesseract reports it) when lines touch
+            ink = np.full_like(page, 255)
+            cv2.putText(ink, word, (x, baseline), FONT, 1, 0, 2)
+            np.minimum(page, ink, out=page)
+            rows = np.flatnonzero((ink < 128).any(axis=1))
+            boxes.append((word, x, int(rows[0]), word_width, int(rows[-1] - rows[0] + 1), line))
+            x += word_width + 20
+    if margin_rule:
+        page[:, 20:24] = 0
+    return page, boxes
+
+
+class FakeEngine:
+    """
+    Reads the words of a rendered page perfectly, as long as they are whole in the image it is given:
+    like Tesseract, it misses words cut by the edge of a band.
+    """
+    def __init__(self, page, boxes):
+        self.page, self.boxes = page, boxes
+
+    def image_to_data(self, image):
+        # The bands are views of the page, so where they start tells which part of the page they show
+        start = image.__array_interface__['data'][0] - self.page.__array_interface__['data'][0]
+        offset = start // self.page.strides[0]
+        data = {column: [] for column in TSV_COLUMNS}
+        for number, (text, left, top, width, height, line) in enumerate(self.boxes):
+            if top >= offset and top + height <= offset + image.shape[0]:
+                row = (5, 1, 1, 1, line + 1, number, left, top - offset, width, height, 95.0, text)
+                for column, value in zip(TSV_COLUMNS, row):
+                    data[column].append(value)
+        return data
+
+    def image_to_string(self, image):
+        return words_to_text(select_words(self.image_to_data(image)))
+
+
+# Spaced lines are cut between them; touching lines and a rule down the margin leave no empty row to cut at
+LAYOUTS = [{}, {'line_height': 26}, {'margin_rule': True}]
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_bands_cover_the_page_and_every_line_is_whole_in_its_band(layout):
+    page, boxes = render_page(np.random.default_rng(0), **layout)
+    bands = split_into_bands(page, band_height=300)
+    assert len(bands) > 3
+    assert bands[0][2] == 0 and bands[-1][3] == page.shape[0]
+    assert all(previous[3] == band[2] for previous, band in zip(bands, bands[1:]))
+    for _, _, top, _, height, _ in boxes:
+        centre = top + height / 2
+        crop_top, crop_bottom, _, _ = next(band for band in bands if band[2] <= centre < band[3])
+        assert crop_top <= top and top + height <= crop_bottom
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_tiled_ocr_reads_every_word_once_in_reading_order(layout):
+    page, boxes = render_page(np.random.default_rng(1), **layout)
+    engine = FakeEngine(page, boxes)
+    single = ocr_words(page, engine=engine)
+    tiled = ocr_words(page, tiled=True, band_height=300, workers=4, engine=engine)
+    assert tiled['text'] == single['text'] == [box[0] for box in boxes]
+    assert tiled['top'] == single['top']
+    assert words_to_text(tiled).split() == words_to_text(single).split()
+
+
+def test_region_words_are_returned_in_page_coordinates():
+    page, boxes = render_page(np.random.default_rng(2), lines=5)
+    region = (0, 100, page.shape[1], 150)
+    words = ocr_words(page, engine=FakeEngine(page, boxes), region=region)
+    inside = [box for box in boxes if box[2] >= 100 and box[2] + box[4] <= 250]
+    assert words['text'] == [box[0] for box in inside]
+    assert words['top'] == [box[2] for box in inside]
+
+
+def test_words_to_text_separates_lines_and_paragraphs():
+    rows = [(1, 1, 1, 'Energy'), (1, 1, 1, 'is'), (1, 1, 2, 'conserved.'), (2, 1, 1, 'Next'), (2, 2, 1, 'page')]
+    words = {column: [] for column in TSV_COLUMNS}
+    for block, paragraph, line, text in rows:
+        words['block_num'].append(block)
+        words['par_num'].append(paragraph)
+        words['line_num'].append(line)
+        words['text'].append(text)
+    assert words_to_text(words) == "Energy is\nconserved.\n\nNext\n\npage"
+
+
+def test_parse_tsv_skips_the_header_and_keeps_empty_text():
+    tsv = ("level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n"
+           "1\t1\t0\t0\t0\t0\t0\t0\t100\t50\t-1\n"
+           "5\t1\t1\t1\t1\t1\t10\t20\t30\t40\t96.5\tmass\n")
+    data = parse_tsv(tsv)
+    assert data['text'] == ['', 'mass']
+    assert data['conf'] == [-1.0, 96.5]
+    assert select_words(data)['left'] == [10]
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="the fake tesseract is a POSIX script")
+def test_thread_limit_only_reaches_the_limited_engine(tmp_path, monkeypatch):
+    # Prints the thread limit it was started with as the only word it reads
+    fake = tmp_path / 'tesseract'
+    fake.write_text(f"#!{sys.executable}\n"
+                    "import os, sys\n"
+                    "sys.stdin.buffer.read()\n"
+                    "print('level\\tpage_num\\tblock_num\\tpar_num\\tline_num\\tword_num\\tleft\\ttop\\twidth\\theight"
+                    "\\tconf\\ttext')\n"
+                    "print('5\\t1\\t1\\t1\\t1\\t1\\t0\\t0\\t9\\t9\\t90\\tomp' + os.environ.get('OMP_THREAD_LIMIT', '-'))\n")
+    fake.chmod(fake.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(ocr, 'TESSERACT_CMD', str(fake))
+    monkeypatch.delenv('OMP_THREAD_LIMIT', raising=False)
+
+    engine = SubprocessEngine()
+    limited = engine.with_threads(1)
+    assert engine.with_threads(1) is limited and engine.with_threads(None) is engine
+    page = np.full((20, 20), 255, np.uint8)
+    assert limited.image_to_data(page)['text'] == ['omp1']
+    assert 'OMP_THREAD_LIMIT' not in os.environ
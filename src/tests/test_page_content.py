@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import make_page
+from utils.page_content import BLANK, IMAGE_ONLY, TEXT, classify_page, text_lines
+
+
+def blank_page(width=850, height=1100):
+    return np.full((height, width, 3), 250, np.uint8)
+
+
+def test_text_lines_keeps_runs_of_text_height():
+    profile = np.array([0, 3, 4, 4, 0, 0, 1, 0, 2, 2, 2, 2, 2, 2, 2, 2, 0])
+    assert text_lines(profile, 2, 4) == [(1, 4)]
+    assert text_lines(profile, 1, 8) == [(1, 4), (6, 7), (8, 16)]
+
+
+def test_blank_pages_with_specks_and_a_dark_edge_are_blank():
+    rng = np.random.default_rng(0)
+    page = blank_page()
+    for x, y in rng.integers(40, 800, (30, 2)):
+        cv2.circle(page, (int(x), int(y)), 1, (30, 30, 30), -1)
+    page[:, :12] = 40  # Left over from warping
+    result = classify_page(page)
+    assert result['kind'] == BLANK
+    assert result['text_box'] is None
+
+
+def test_text_pages_get_a_box_around_the_text():
+    page, _ = make_page(rng=np.random.default_rng(1))
+    result = classify_page(page)
+    assert result['kind'] == TEXT
+    assert result['lines'] >= 15
+    ys, xs = np.nonzero(cv2.cvtColor(page, cv2.COLOR_BGR2GRAY) < 128)
+    x, y, width, height = result['text_box']
+    assert x <= xs.min() and y <= ys.min()
+    assert x + width >= xs.max() and y + height >= ys.max()
+    # And not much more than the text
+    assert width * height <= 1.3 * (xs.max() - xs.min()) * (ys.max() - ys.min())
+
+
+def test_black_and_white_and_large_pages_are_read_the_same():
+    page, _ = make_page(rng=np.random.default_rng(2))
+    grey = cv2.cvtColor(page, cv2.COLOR_BGR2GRAY)
+    binary = cv2.threshold(grey, 128, 255, cv2.THRESH_BINARY)[1]
+    assert classify_page(binary)['kind'] == TEXT
+    large = cv2.resize(page, None, fx=3, fy=3, interpolation=cv2.INTER_CUBIC)
+    assert classify_page(large)['kind'] == TEXT
+
+
+def test_pictures_without_text_are_image_pages():
+    page = blank_page()
+    cv2.rectangle(page, (150, 200), (700, 600), (90, 140, 60), -1)
+    cv2.circle(page, (420, 850), 120, (40, 40, 160), -1)
+    result = classify_page(page)
+    assert result['kind'] == IMAGE_ONLY
+    assert result['text_box'] is None
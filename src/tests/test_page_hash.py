@@ -0,0 +1,87 @@
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import LIGHTING, make_page, make_scene
+from utils.page_hash import DEFAULT_MAX_DISTANCE, PageHashIndex, hash_words, page_hash
+
+
+def distance(a, b):
+    return int(sum(np.bitwise_count(x ^ y) for x, y in zip(hash_words(a), hash_words(b))))
+
+
+def photograph(page, lighting, rng):
+    """ The page as the scanner gets it from a photo: placed in a scene under the lighting, then warped back. """
+    height, width = page.shape[:2]
+    scene, corners = make_scene(page, lighting=lighting, skew=8, rng=rng)
+    target = np.float32([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]])
+    return cv2.warpPerspective(scene, cv2.getPerspectiveTransform(corners, target), (width, height))
+
+
+def rescan(page, rng):
+    """ The page as another photo of it would warp it: other resolution, lighting, blur and sensor noise. """
+    height, width = page.shape[:2]
+    image = cv2.resize(page, (int(width * 1.7), int(height * 1.7)), interpolation=cv2.INTER_CUBIC)
+    image = cv2.GaussianBlur(image, (5, 5), 0).astype(np.float32) * 0.8 + 20
+    image += rng.normal(0, 6, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def test_hash_is_256_bits_and_ignores_the_colour_conversion():
+    page, _ = make_page(rng=np.random.default_rng(0))
+    value = page_hash(page)
+    assert len(value) == 64
+    assert value == page_hash(cv2.cvtColor(page, cv2.COLOR_BGR2GRAY))
+
+
+def test_rescans_are_close_and_other_pages_are_far():
+    rng = np.random.default_rng(1)
+    pages = [make_page(rng=rng)[0] for _ in range(6)]
+    hashes = [page_hash(page) for page in pages]
+    for page, value in zip(pages, hashes):
+        assert distance(value, page_hash(rescan(page, rng))) <= DEFAULT_MAX_DISTANCE // 2
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            assert distance(hashes[i], hashes[j]) > DEFAULT_MAX_DISTANCE
+
+
+def test_photos_under_any_lighting_are_close():
+    rng = np.random.default_rng(3)
+    page, _ = make_page(rng=rng)
+    hashes = [page_hash(photograph(page, lighting, rng)) for lighting in LIGHTING]
+    for value in hashes[1:]:
+        assert distance(hashes[0], value) <= DEFAULT_MAX_DISTANCE
+
+
+def test_index_finds_the_closest_page_within_the_distance():
+    rng = np.random.default_rng(2)
+    index = PageHashIndex(':memory:')
+    assert index.find('00' * 32) is None
+    # More pages than the initial capacity, so the arrays have to grow
+    hashes = [rng.integers(0, 256, 32, dtype=np.uint8).tobytes().hex() for _ in range(1500)]
+    for number, value in enumerate(hashes):
+        index.add(value, f'photo{number}.jpg', [f'out/photo{number}.pdf'])
+    assert len(index) == 1500
+
+    target = bytearray(bytes.fromhex(hashes[1234]))
+    target[0] ^= 0b111  # 3 bits off
+    found = index.find(target.hex())
+    assert found['source'] == 'photo1234.jpg'
+    assert found['distance'] == 3
+    assert [output['path'].endswith('photo1234.pdf') for output in found['outputs']] == [True]
+
+    index.max_distance = 2
+    assert index.find(target.hex()) is None
+
+
+def test_drive_ids_and_pages_recorded_by_another_process_are_found(tmp_path):
+    path = str(tmp_path / 'pages.sqlite3')
+    reader, writer = PageHashIndex(path), PageHashIndex(path)
+    value = 'ab' * 32
+    assert reader.find(value) is None
+    writer.add(value, 'scan.jpg', ['scan.pdf', 'scan.png'])
+    assert writer.set_drive_id('scan.pdf', 'drive-1') == 1
+    found = reader.find(value)
+    assert found['distance'] == 0
+    assert [output['id'] for output in found['outputs']] == ['drive-1', None]
+    reader.close()
+    writer.close()
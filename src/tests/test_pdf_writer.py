@@ -0,0 +1,134 @@
+import io
+import re
+import zlib
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.pdf_writer import A4, PdfWriter, encode_page, pdf_string, text_layer
+
+
+def bilevel_page(width=400, height=300):
+    page = np.full((height, width), 255, np.uint8)
+    cv2.putText(page, "Lecture 4", (20, 150), cv2.FONT_HERSHEY_SIMPLEX, 2, 0, 4)
+    return cv2.threshold(page, 127, 255, cv2.THRESH_BINARY)[1]
+
+
+def words(*entries):
+    """ OCR word columns from (text, left, top, width, height) entries. """
+    return {'text': [entry[0] for entry in entries], 'left': [entry[1] for entry in entries],
+            'top': [entry[2] for entry in entries], 'width': [entry[3] for entry in entries],
+            'height': [entry[4] for entry in entries]}
+
+
+def read_objects(data):
+    """ Checks the cross-reference table and returns the objects by number as (dictionary, stream or None). """
+    startxref = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", data).group(1))
+    header = re.match(rb"xref\n0 (\d+)\n0000000000 65535 f \n", data[startxref:])
+    count = int(header.group(1))
+    table = data[startxref + header.end():].split(b"trailer")[0].split(b"\n")[:count - 1]
+    assert re.search(rb"trailer\n<< /Size %d /Root 1 0 R >>" % count, data)
+    objects = {}
+    for number, entry in enumerate(table, start=1):
+        assert entry.endswith(b" 00000 n ")
+        offset = int(entry[:10])
+        match = re.compile(rb"%d 0 obj\n(.*?)\n(?:stream\n|endobj\n)" % number, re.S).match(data, offset)
+        assert match, f"object {number} is not at its offset"
+        stream = None
+        if data[match.end() - 7:match.end()] == b"stream\n":
+            length = int(re.search(rb"/Length (\d+)", match.group(1)).group(1))
+            stream = data[match.end():match.end() + length]
+            assert data[match.end() + length:].startswith(b"\nendstream\nendobj\n")
+        objects[number] = (match.group(1).decode('latin-1'), stream)
+    return objects
+
+
+def test_pages_images_and_contents_are_linked_through_the_page_tree():
+    buffer = io.BytesIO()
+    with PdfWriter(buffer, dpi=100) as writer:
+        writer.add_page(bilevel_page())
+        writer.add_page(np.full((200, 100, 3), 128, np.uint8))
+    objects = read_objects(buffer.getvalue())
+
+    assert objects[1][0] == "<< /Type /Catalog /Pages 2 0 R >>"
+    kids = [int(number) for number in re.findall(r"(\d+) 0 R", objects[2][0])]
+    assert "/Count 2" in objects[2][0] and len(kids) == 2
+    sizes = []
+    for kid in kids:
+        page = objects[kid][0]
+        assert "/Type /Page " in page and "/Parent 2 0 R" in page
+        image = objects[int(re.search(r"/Im0 (\d+) 0 R", page).group(1))]
+        contents = zlib.decompress(objects[int(re.search(r"/Contents (\d+) 0 R", page).group(1))][1])
+        assert contents.endswith(b"/Im0 Do Q\n")
+        sizes.append((re.search(r"/MediaBox \[0 0 ([\d.]+) ([\d.]+)\]", page).groups(), image[0]))
+    # At 100 dpi, 400 x 300 pixels are 288 x 216 points
+    assert sizes[0][0] == ('288.00', '216.00')
+    assert "/BitsPerComponent 1" in sizes[0][1]
+    assert "/DCTDecode" in sizes[1][1] and "/DeviceRGB" in sizes[1][1]
+
+
+def test_black_and_white_pages_keep_every_pixel():
+    page = bilevel_page()
+    encoded = encode_page(page)
+    assert encoded['bits'] == 1
+    if encoded['filter'] == '/FlateDecode':
+        bits = np.frombuffer(zlib.decompress(encoded['data']), np.uint8).reshape(page.shape[0], -1)
+        assert np.array_equal(np.unpackbits(bits, axis=1)[:, :page.shape[1]] * 255, page)
+    else:
+        assert encoded['filter'] == '/CCITTFaxDecode'
+        assert f"/Columns {page.shape[1]} /Rows {page.shape[0]}" in encoded['decode_parms']
+
+
+def test_grey_pages_are_jpeg():
+    encoded = encode_page(np.full((50, 60), 128, np.uint8))
+    assert (encoded['filter'], encoded['color_space'], encoded['bits']) == ('/DCTDecode', '/DeviceGray', 8)
+    assert encoded['data'].startswith(b'\xff\xd8')
+
+
+def test_searchable_pages_share_one_font_and_carry_the_words():
+    buffer = io.BytesIO()
+    page = bilevel_page()
+    with PdfWriter(buffer, dpi=100) as writer:
+        for _ in range(2):
+            writer.add_searchable_page(page, words(("Lecture", 20, 100, 180, 60), ("4", 220, 100, 40, 60)))
+    objects = read_objects(buffer.getvalue())
+    fonts = [number for number, (body, _) in objects.items() if "/BaseFont /Helvetica" in body]
+    assert len(fonts) == 1
+    pages = [body for body, _ in objects.values() if "/Type /Page " in body]
+    assert all(f"/F1 {fonts[0]} 0 R" in body for body in pages)
+    contents = zlib.decompress(objects[int(re.search(r"/Contents (\d+) 0 R", pages[0]).group(1))][1])
+    assert b"3 Tr" in contents and b"(Lecture ) Tj" in contents and b"(4 ) Tj" in contents
+
+
+def test_paper_size_centres_the_scan_below_the_top_margin():
+    writer = PdfWriter(io.BytesIO(), dpi=100, paper_size=A4, margin=20)
+    page_width, page_height, x, y, drawn_width, drawn_height = writer.page_layout(1000, 1000)
+    assert (page_width, page_height) == A4
+    assert drawn_width == drawn_height == pytest.approx(A4[0] - 40)
+    assert x == pytest.approx(20)
+    assert y + drawn_height == pytest.approx(A4[1] - 20)
+
+
+def test_text_layer_places_words_on_their_boxes():
+    layout = (100, 200, 0, 0, 100, 200)  # One point per pixel
+    layer = text_layer(words(("ab", 10, 20, 30, 40), ("", 0, 0, 5, 5), ("c", 0, 0, 0, 10)), (100, 200), layout)
+    assert layer.count(b" Tj") == 1
+    # Baseline at the bottom of the box: 200 - 20 - 40 = 140 points from the bottom of the page
+    assert b"/F1 40.00 Tf" in layer and b"1 0 0 1 10.00 140.00 Tm" in layer
+
+
+def test_pdf_string_escapes_and_replaces_what_winansi_lacks():
+    assert pdf_string("a(b)\\c") == b"(a\\(b\\)\\\\c)"
+    assert pdf_string("café ✓") == b"(caf\xe9 ?)"
+
+
+def test_a_closed_writer_takes_no_more_pages(tmp_path):
+    path = tmp_path / 'out.pdf'
+    writer = PdfWriter(path)
+    writer.add_page(bilevel_page())
+    writer.close()
+    writer.close()
+    assert writer.file.closed and path.read_bytes().startswith(b"%PDF-1.4")
+    with pytest.raises(ValueError):
+        writer.add_page(bilevel_page())
@@ -0,0 +1,89 @@
+from utils.spelling import SpellChecker, deletes, edit_distance, read_frequencies, read_terms
+
+COUNTS = {'the': 500, 'chapter': 40, 'chamber': 10, 'theorem': 30, 'proof': 25, 'lemma': 20, 'their': 60}
+
+
+def make_checker(**kwargs):
+    return SpellChecker.build(COUNTS, **kwargs)
+
+
+def ocr_words(texts, confidences):
+    count = len(texts)
+    return {'text': list(texts), 'conf': list(confidences), 'block_num': [1] * count, 'par_num': [1] * count}
+
+
+def test_deletes_include_the_word_and_every_deletion_up_to_the_distance():
+    assert deletes('abc', 1) == {'abc', 'bc', 'ac', 'ab'}
+    assert deletes('abc', 2) == {'abc', 'bc', 'ac', 'ab', 'a', 'b', 'c'}
+
+
+def test_edit_distance_counts_swaps_as_one_edit_and_stops_at_the_limit():
+    assert edit_distance('proof', 'proof', 2) == 0
+    assert edit_distance('porof', 'proof', 2) == 1
+    assert edit_distance('chapter', 'chamber', 2) == 2
+    assert edit_distance('lemma', 'theorem', 2) == 3
+    assert edit_distance('a', 'abcdef', 2) == 3
+
+
+def test_suggest_finds_the_closest_and_then_most_common_word():
+    checker = make_checker()
+    assert checker.suggest('theorem') == 'theorem'
+    assert checker.suggest('theroem') == 'theorem'
+    assert checker.suggest('chapfer') == 'chapter'
+    assert checker.suggest('thier') == 'their'
+    assert checker.suggest('xyzzy') is None
+
+
+def test_suggest_matches_a_brute_force_search():
+    checker = make_checker()
+    for word in ('lema', 'prooof', 'chamer', 'theoremm', 'th', 'pruf', 'chaptre'):
+        distances = {candidate: edit_distance(word, candidate, 2) for candidate in checker.words}
+        best = min(distances.values())
+        expected = None if best > 2 else max((candidate for candidate in checker.words
+                                              if distances[candidate] == best), key=COUNTS.get)
+        assert checker.suggest(word) == expected, word
+
+
+def test_correct_token_keeps_punctuation_and_capitals_and_leaves_protected_words_alone():
+    checker = make_checker(protected=['Chapfer'])
+    assert checker.correct_token('(theroem),') == '(theorem),'
+    assert checker.correct_token('Theroem') == 'Theorem'
+    assert checker.correct_token('Theroem', capitalised_allowed=False) == 'Theroem'
+    assert checker.correct_token('chapfer') == 'chapfer'
+    assert checker.correct_token('TEHOREM') == 'TEHOREM'
+    assert checker.correct_token('pr00f') == 'pr00f'
+
+
+def test_correct_words_only_changes_uncertain_words():
+    words = ocr_words(['Proff', 'of', 'the', 'lemmma.', 'Theroem'], [50, 95, 95, 95, 40])
+    corrected = make_checker().correct_words(words)
+    assert corrected['text'] == ['Proof', 'of', 'the', 'lemmma.', 'Theorem']
+    assert words['text'][0] == 'Proff'
+
+
+def test_capitalised_words_inside_a_sentence_are_kept_as_names():
+    words = ocr_words(['the', 'Theroem'], [95, 40])
+    assert make_checker().correct_words(words)['text'] == ['the', 'Theroem']
+
+
+def test_save_and_load_give_the_same_checker(tmp_path):
+    checker = make_checker(protected=['lemma'])
+    path = tmp_path / 'spelling.npz'
+    checker.save(path)
+    loaded = SpellChecker.load(path, protected=['lemma'])
+    assert loaded.words == checker.words
+    assert loaded.fingerprint == checker.fingerprint
+    assert loaded.suggest('theroem') == 'theorem'
+
+
+def test_fingerprint_changes_with_the_protected_terms():
+    assert make_checker().fingerprint != make_checker(protected=['proof']).fingerprint
+
+
+def test_read_frequencies_and_terms_skip_comments(tmp_path):
+    frequencies = tmp_path / 'words.txt'
+    frequencies.write_text("; comment\nThe 10\nthe 5\nbroken line\nproof 3\n", encoding='utf-8')
+    assert read_frequencies(frequencies) == {'the': 15, 'proof': 3}
+    terms = tmp_path / 'terms.txt'
+    terms.write_text("MATH101  # course\n\n# only a comment\nRiemann\n", encoding='utf-8')
+    assert read_terms(terms) == ['MATH101', 'Riemann']
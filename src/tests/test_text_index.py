@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from utils.text_index import TextIndex, default_index_path, match_expression
+
+
+@pytest.fixture
+def index():
+    index = TextIndex(':memory:')
+    index.add_many([
+        ('biology.jpg', "Photosynthesis turns light into chemical energy.", 1, 'biology.jpg', 'out/biology.pdf', None),
+        ('biology.jpg', "The Calvin cycle fixes carbon.", 2, 'biology.jpg', 'out/biology.pdf', None),
+        ('physics.jpg', "Light travels at a finite speed; energy is conserved.", 1, 'physics.jpg', 'out/physics.pdf',
+         None),
+        ('french.jpg', "Le café est très chaud.", 1, 'french.jpg', None, None),
+    ])
+    yield index
+    index.close()
+
+
+def test_match_expression_quotes_every_word():
+    assert match_expression('light energy') == '"light" "energy"'
+    assert match_expression('photo* "NEAR(a b)" -x') == '"photo"* "NEAR" "a" "b" "x"'
+    assert match_expression(' ?! ') is None
+
+
+def test_search_needs_every_word_and_supports_prefixes(index):
+    assert {(hit['document_id'], hit['page']) for hit in index.search('light energy')} == {
+        ('biology.jpg', 1), ('physics.jpg', 1)}
+    assert [hit['document_id'] for hit in index.search('photosynth*')] == ['biology.jpg']
+    assert index.search('light carbon') == []
+    assert index.search('') == []
+
+
+def test_search_ignores_case_and_accents_and_marks_the_words(index):
+    hits = index.search('CAFE tres')
+    assert [hit['document_id'] for hit in hits] == ['french.jpg']
+    assert '[café]' in hits[0]['snippet']
+
+
+def test_adding_a_page_again_replaces_its_text_but_keeps_its_details(index):
+    index.add('biology.jpg', "The Krebs cycle releases carbon.", page=2)
+    assert len(index) == 4
+    assert index.text('biology.jpg', 2) == "The Krebs cycle releases carbon."
+    assert index.search('calvin') == []
+    hit, = index.search('krebs')
+    assert hit['file_path'] == os.path.abspath('out/biology.pdf')
+
+
+def test_drive_ids_are_attached_to_every_page_of_the_file(index):
+    assert index.set_drive_id('out/biology.pdf', 'drive-1') == 2
+    assert [hit['drive_id'] for hit in index.search('calvin')] == ['drive-1']
+
+
+def test_removed_documents_are_no_longer_found(index):
+    assert index.remove('biology.jpg') == 2
+    index.optimize()
+    assert index.search('photosynthesis') == []
+    assert [hit['document_id'] for hit in index.search('light')] == ['physics.jpg']
+
+
+def test_default_index_lives_in_the_user_data_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv('SCANNER_DATA_DIR', str(tmp_path / 'data'))
+    assert default_index_path() == str(tmp_path / 'data' / 'ocr_index.sqlite3')
+    TextIndex().close()
+    assert os.path.exists(tmp_path / 'data' / 'ocr_index.sqlite3')
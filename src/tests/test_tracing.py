@@ -0,0 +1,70 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.pipeline import Pipeline, Stage
+from utils.tracing import Tracer, TracingObserver
+
+
+def slow_double(value):
+    time.sleep(0.05)
+    return value * 2
+
+
+def test_nested_spans_share_the_trace_of_their_parent():
+    tracer = Tracer(trace_memory=False)
+    with tracer.span('outer') as outer:
+        with tracer.span('inner') as inner:
+            pass
+    assert (inner.trace_id, inner.parent_id) == (outer.trace_id, outer.span_id)
+    assert outer.parent_id is None and tracer.current() is None
+    assert [span.name for span in tracer.finished] == ['inner', 'outer']
+
+
+def test_work_handed_to_a_worker_thread_is_traced_inside_the_span_that_started_it():
+    tracer = Tracer(trace_memory=False)
+    pipeline = Pipeline([Stage("Doubled", slow_double, inputs=['value'], output='doubled')],
+                        [TracingObserver(tracer)])
+
+    def run(span):
+        with tracer.within(span):
+            return pipeline.run(value=21)['doubled']
+
+    with ThreadPoolExecutor(1) as executor:
+        transition = tracer.start_span('enhance')
+        future = executor.submit(run, transition)
+        tracer.detach(transition)  # The handler returns while the worker is still busy
+        assert tracer.current() is None
+        assert future.result() == 42
+        tracer.end_span(transition)
+
+    stage, = [span for span in tracer.finished if span.name == 'Doubled']
+    assert (stage.trace_id, stage.parent_id) == (transition.trace_id, transition.span_id)
+    # The transition covers the work it waited for, not just the hand-off
+    assert transition.duration >= stage.duration >= 0.05
+
+
+def test_within_leaves_the_span_open_and_the_stack_as_it_was():
+    tracer = Tracer(trace_memory=False)
+    span = tracer.start_span('capture')
+    tracer.detach(span)
+    seen = []
+
+    def worker():
+        with tracer.within(span):
+            seen.append(tracer.current())
+        seen.append(tracer.current())
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert seen == [span, None] and span.duration is None
+
+    with tracer.within(None):
+        assert tracer.current() is None
+    with tracer.within(span):
+        with tracer.span('detected') as callback:
+            pass
+    assert callback.parent_id == span.span_id and tracer.current() is None
+    tracer.end_span(span)
+    assert span.duration is not None and list(tracer.finished)[-1] is span
@@ -0,0 +1,192 @@
+import hashlib
+import io
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from utils.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+
+# HASH A VALUE BY ITS CONTENT
+def content_key(value):
+    """
+    Returns a hex digest identifying the value by its content (pixels, shape and dtype for arrays).
+
+    :param value: NumPy array, string, number or any picklable object.
+    :return: 32-character hex string.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(value, np.ndarray):
+        digest.update(f"ndarray:{value.dtype.str}:{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).data)  # Hashes the pixel buffer without copying it
+    elif isinstance(value, str):
+        digest.update(b"str:" + value.encode())
+    else:
+        digest.update(b"pickle:" + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    return digest.hexdigest()
+
+
+def derived_key(*parts):
+    """ Combines keys and parameters into a new key, e.g. (stage name, stage params, keys of the inputs). """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _size_of(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value)
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+# TWO-TIER (MEMORY + DISK) LRU CACHE FOR PROCESSING RESULTS
+class ResultCache:
+    def __init__(self, directory=None, max_disk_bytes=2 * 1024 ** 3, max_memory_bytes=256 * 1024 ** 2):
+        """
+        Stores processing results by key. Recently used results are kept in memory; all results are also
+        written to disk (if a directory is given), and the least recently used files are deleted once
+        the directory grows beyond max_disk_bytes.
+        Arrays returned by the cache are read-only; copy them before modifying them in place.
+
+        :param directory: Directory for the on-disk tier, or None for a memory-only cache.
+        :param max_disk_bytes: Size limit of the on-disk tier.
+        :param max_memory_bytes: Size limit of the in-memory tier.
+        """
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict()  # key -> (value, size), least recently used first
+        self.memory_bytes = 0
+        self.disk = OrderedDict()  # key -> (path, size), least recently used first
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name.split('.')[0], path, stat.st_size))
+        for _, key, path, size in sorted(entries):  # Oldest access first
+            self.disk[key] = (path, size)
+            self.disk_bytes += size
+
+    def get(self, key, default=None):
+        """ Returns the cached value for key, or default if it is not cached. """
+        with self._lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key][0]
+            entry = self.disk.get(key)
+        if entry is not None:
+            try:
+                value = self._read(entry[0])
+                os.utime(entry[0])  # Record the access for LRU eviction (also across restarts)
+            except (OSError, ValueError, pickle.UnpicklingError):
+                value = None
+            with self._lock:
+                if value is None:
+                    self._forget_disk(key)
+                else:
+                    self.disk.move_to_end(key)
+                    self._remember(key, value)
+                    self.hits += 1
+                    return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """ Stores a value (NumPy array, string or picklable object) under key. """
+        if isinstance(value, np.ndarray):
+            value = value.copy()  # The caller may keep modifying its own array
+            value.setflags(write=False)
+        with self._lock:
+            self._remember(key, value)
+        if self.directory:
+            path, size = self._write(key, value)
+            with self._lock:
+                self._forget_disk(key)
+                self.disk[key] = (path, size)
+                self.disk_bytes += size
+                self._evict_disk()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.memory or key in self.disk
+
+    def _remember(self, key, value):
+        if key in self.memory:
+            self.memory_bytes -= self.memory.pop(key)[1]
+        size = _size_of(value)
+        if size > self.max_memory_bytes:
+            return
+        self.memory[key] = (value, size)
+        self.memory_bytes += size
+        while self.memory_bytes > self.max_memory_bytes:
+            _, (_, evicted) = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted
+
+    def _forget_disk(self, key):
+        entry = self.disk.pop(key, None)
+        if entry is not None:
+            self.disk_bytes -= entry[1]
+
+    def _evict_disk(self):
+        while self.disk_bytes > self.max_disk_bytes and self.disk:
+            _, (path, size) = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Already evicted by another process sharing the directory
+
+    def _write(self, key, value):
+        # Spread the files over subdirectories so no directory gets huge
+        directory = os.path.join(self.directory, key[:2])
+        os.makedirs(directory, exist_ok=True)
+        if isinstance(value, np.ndarray):
+            path = os.path.join(directory, f"{key}.npy")
+            buffer = io.BytesIO()
+            np.save(buffer, value, allow_pickle=False)
+            data = buffer.getvalue()
+        elif isinstance(value, str):
+            path = os.path.join(directory, f"{key}.txt")
+            data = value.encode('utf-8')
+        else:
+            path = os.path.join(directory, f"{key}.pkl")
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        # Write to a temporary file first so readers never see half-written results
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+        return path, len(data)
+
+    @staticmethod
+    def _read(path):
+        if path.endswith('.npy'):
+            value = np.load(path, allow_pickle=False)
+            value.setflags(write=False)
+            return value
+        if path.endswith('.txt'):
+            with open(path, 'rb') as file:
+                return file.read().decode('utf-8')
+        with open(path, 'rb') as file:
+            return pickle.load(file)
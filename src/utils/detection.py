@@ -0,0 +1,464 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# Smallest document area accepted, as a fraction of the frame area.
+# (The old fixed 40000 px filter corresponds to ~4% of a 720p frame.)
+MIN_AREA_RATIO = 0.04
+# Two outlines sharing more than this fraction of the smaller one are the same document (e.g. the inner and
+# outer edge of a page) or one lies within the other (e.g. a table on the page), and only the larger is kept
+MAX_OVERLAP = 0.1
+
+
+# Edge map settings (see edge_map) and outline tolerance tried by detect_document_hypotheses, most likely first.
+# The first one is the classic detector, so photos it handles give the same result
+HYPOTHESES = (
+    {'name': 'default', 'gamma': 0.3, 'threshold': 80, 'kernel_size': 5, 'canny': (50, 150), 'epsilon': 0.02},
+    # Dim or low-contrast photos: the page/background threshold is taken from the histogram
+    {'name': 'otsu', 'gamma': 1.0, 'threshold': 'otsu', 'kernel_size': 5, 'canny': (50, 150), 'epsilon': 0.02},
+    # Bright background (e.g. a light desk): only the brightest areas count as page
+    {'name': 'bright', 'gamma': 1.0, 'threshold': 200, 'kernel_size': 5, 'canny': (50, 150), 'epsilon': 0.02},
+    # Shadows or gradients across the page: edges of the grey photo instead of a global threshold
+    {'name': 'edges', 'gamma': 1.0, 'threshold': None, 'kernel_size': 9, 'canny': (20, 60), 'epsilon': 0.02},
+    # Curled pages and rounded corners: a looser fit of the outline
+    {'name': 'loose', 'gamma': 1.0, 'threshold': None, 'kernel_size': 9, 'canny': (20, 60), 'epsilon': 0.04},
+)
+# Outlines scoring at least this (see score_quadrilateral) are accepted without waiting for other hypotheses
+CONFIDENT_SCORE = 0.8
+# Outlines scoring below this are not documents
+MIN_SCORE = 0.35
+
+
+class DocumentNotFoundError(ValueError):
+    """ Raised when no document outline can be found in an image. """
+
+    def __init__(self, message, detection=None):
+        super().__init__(message)
+        self.detection = detection  # The detection result with the rejected candidates, if there was one
+
+
+# PRE-PROCESS THE IMAGE INTO AN EDGE MAP
+def edge_map(image, buffers=None, gamma=0.3, threshold=80, kernel_size=5, canny=(50, 150)):
+    """
+    Turns a BGR photo into a Canny edge map. Every step works in place on a single grey image.
+    The defaults suit a light page on a darker background; see HYPOTHESES for other lighting.
+
+    :param image: BGR photo.
+    :param buffers: Optional BufferPool (see utils.memory) providing the grey and edge arrays, so photos of
+                    the same size reuse them. The returned edge map is then overwritten by the next call.
+    :param gamma: Gamma correction applied first (below 1 darkens everything but the brightest areas).
+    :param threshold: Grey level separating the page from the background, 'otsu' to pick it from the
+                      histogram, or None to find the edges in the grey photo itself.
+    :param kernel_size: Size of the closing that removes the text and small gaps from the page.
+    :param canny: Low and high Canny thresholds.
+    :return: Binary edge map.
+    """
+    # Step 1: Gamma Correction to Enhance Contrast
+    gray = buffers.get('edge_map.gray', image.shape[:2]) if buffers is not None else None
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+    if gamma != 1.0:
+        invGamma = 1.0 / gamma
+        table = np.array([((i / 255.0) ** invGamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
+        cv2.LUT(gray, table, dst=gray)
+
+    # Step 2: Simple Thresholding
+    if threshold == 'otsu':
+        cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=gray)
+    elif threshold is not None:
+        cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY, dst=gray)
+    else:
+        cv2.GaussianBlur(gray, (5, 5), 0, dst=gray)
+
+    # Step 3: Dilation and Erosion (Morphological Closing)
+    kernel = np.ones((kernel_size, kernel_size), np.uint8)
+    cv2.dilate(gray, kernel, dst=gray, iterations=1)
+    cv2.erode(gray, kernel, dst=gray, iterations=1)
+
+    # Step 4: Canny Edge Detection
+    edges = buffers.get('edge_map.edges', image.shape[:2]) if buffers is not None else None
+    return cv2.Canny(gray, *canny, edges=edges)
+
+
+# DETECT THE DOCUMENT CONTOUR IN AN EDGE MAP
+def find_document_contour(edged, min_area_ratio=MIN_AREA_RATIO, epsilon=0.02):
+    """
+    Finds the largest quadrilateral in an edge map.
+
+    :param edged: Binary edge map (e.g. from edge_map).
+    :param min_area_ratio: Smallest accepted contour area as a fraction of the frame area.
+    :param epsilon: How far the outline may stray from a straight side, as a fraction of its perimeter.
+    :return: The 4 corner points as returned by cv2.approxPolyDP, shape (4, 1, 2).
+    """
+    min_area = min_area_ratio * edged.shape[0] * edged.shape[1]
+
+    # Find Contours and Identify the Largest Quadrilateral
+    contours, _ = cv2.findContours(edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    document_contour = None
+    max_area = 0
+
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area > min_area:  # Filter out small contours
+            peri = cv2.arcLength(contour, True)
+            approx = cv2.approxPolyDP(contour, epsilon * peri, True)
+
+            # Check if the contour has four points and is the largest found
+            if len(approx) == 4 and area > max_area:
+                document_contour = approx  # NumPy array with the coordinates of the vertices
+                max_area = area
+
+    if document_contour is None:
+        raise DocumentNotFoundError("Document contour not found")
+    return document_contour
+
+
+def quadrilaterals(edged, min_area_ratio=MIN_AREA_RATIO, epsilon=0.02):
+    """ Every convex four-sided outline in an edge map, as a list of (area, corners of shape (4, 1, 2)). """
+    min_area = min_area_ratio * edged.shape[0] * edged.shape[1]
+    contours, _ = cv2.findContours(edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    found = []
+    for contour in contours:
+        if cv2.contourArea(contour) > min_area:
+            approx = cv2.approxPolyDP(contour, epsilon * cv2.arcLength(contour, True), True)
+            if len(approx) == 4 and cv2.isContourConvex(approx):
+                found.append((cv2.contourArea(approx), approx))
+    return found
+
+
+# DETECT EVERY DOCUMENT IN AN EDGE MAP
+def find_document_contours(edged, min_area_ratio=MIN_AREA_RATIO, max_documents=None, max_overlap=MAX_OVERLAP):
+    """
+    Finds all the documents in an edge map (e.g. receipts side by side, or the two pages of an open book):
+    every convex quadrilateral, largest first, skipping the ones that overlap a larger one.
+
+    :param edged: Binary edge map (e.g. from edge_map).
+    :param min_area_ratio: Smallest accepted contour area as a fraction of the frame area.
+    :param max_documents: Keep at most this many documents (the largest ones); None keeps all.
+    :param max_overlap: Largest shared area, as a fraction of the smaller outline, of two separate documents.
+    :return: List of corner arrays of shape (4, 1, 2), in reading order (top to bottom, left to right).
+    """
+    candidates = sorted(quadrilaterals(edged, min_area_ratio), key=lambda candidate: candidate[0], reverse=True)
+
+    documents = []
+    for area, approx in candidates:
+        outline = approx.reshape(4, 2).astype(np.float32)
+        if all(cv2.intersectConvexConvex(outline, kept)[0] <= max_overlap * min(area, kept_area)
+               for kept_area, kept, _ in documents):
+            documents.append((area, outline, approx))
+            if len(documents) == max_documents:
+                break
+
+    if not documents:
+        raise DocumentNotFoundError("Document contour not found")
+    return reading_order([approx for _, _, approx in documents])
+
+
+# SORT DOCUMENTS IN READING ORDER
+def reading_order(contours):
+    """
+    Sorts document outlines into rows from top to bottom, and each row from left to right.
+    A document belongs to a row if its centre lies between the top and bottom of the row's first document.
+    """
+    remaining = sorted(contours, key=lambda contour: contour[..., 1].min())
+    ordered = []
+    while remaining:
+        # The first document is always in its own row
+        top, bottom = remaining[0][..., 1].min(), remaining[0][..., 1].max()
+        in_row = [top <= contour[..., 1].mean() <= bottom for contour in remaining]
+        row = [contour for contour, taken in zip(remaining, in_row) if taken]
+        ordered += sorted(row, key=lambda contour: contour[..., 0].mean())
+        remaining = [contour for contour, taken in zip(remaining, in_row) if not taken]
+    return ordered
+
+
+# ORDER THE CORNERS (TOP-LEFT, TOP-RIGHT, BOTTOM-RIGHT, BOTTOM-LEFT)
+def order_points(pts):
+    rect = np.zeros((4, 2), dtype="float32")
+    s = pts.sum(axis=1)
+    # The point with the smallest sum is the top-left corner (because both x and y are smallest)
+    # and the point with the largest sum is the bottom-right corner
+    rect[0] = pts[np.argmin(s)]  # top-left
+    rect[2] = pts[np.argmax(s)]  # bottom-right
+    diff = np.diff(pts, axis=1)
+    # The point with the smallest difference is the top-right corner (where x is large, and y is small)
+    # and the point with the largest difference is the bottom-left corner (where x is small, and y is large)
+    rect[1] = pts[np.argmin(diff)]  # top-right
+    rect[3] = pts[np.argmax(diff)]  # bottom-left
+    return rect
+
+
+# DRAW THE DETECTED DOCUMENT (FOR PREVIEWS)
+def draw_document_contour(image, document_contour):
+    # Draw on a copy, so the scan itself stays clean
+    preview = image.copy()
+    hull = cv2.convexHull(document_contour.astype(np.int32))
+    cv2.drawContours(preview, [hull], -1, (0, 255, 0), 3)
+    return preview
+
+
+def draw_document_contours(image, document_contours):
+    """ Draws every detected document, numbered in the order they become pages. """
+    preview = image.copy()
+    for number, contour in enumerate(document_contours, start=1):
+        hull = cv2.convexHull(contour.astype(np.int32))
+        cv2.drawContours(preview, [hull], -1, (0, 255, 0), 3)
+        x, y = hull.reshape(-1, 2).mean(axis=0).astype(int)
+        cv2.putText(preview, str(number), (x, y), cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 255, 0), 6)
+    return preview
+
+
+# SHRINK THE IMAGE FOR COARSE DETECTION
+def downscale(image, max_side, buffers=None):
+    """
+    Resizes the image so that its longest side is at most max_side pixels.
+
+    :param buffers: Optional BufferPool (see utils.memory) providing the resized array.
+    :return: (resized image, scale factor applied). Images that are already small are returned unchanged.
+    """
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1.0:
+        return image, 1.0
+    size = (round(width * scale), round(height * scale))
+    small = buffers.get('downscale', (size[1], size[0]) + image.shape[2:]) if buffers is not None else None
+    small = cv2.resize(image, size, dst=small, interpolation=cv2.INTER_AREA)
+    return small, scale
+
+
+# REFINE CORNERS AT FULL RESOLUTION
+def refine_corners(image, corners, radius):
+    """
+    Moves each corner to the exact corner position in a small full-resolution window around it.
+    Only a small window around every corner is converted and searched.
+
+    :param image: Full-resolution BGR or grayscale image.
+    :param corners: Approximate corner positions, shape (4, 2), in full-resolution coordinates.
+    :param radius: Half size of the search window in pixels; should cover the coarse detection error.
+    :return: Refined corners as float32, shape (4, 2).
+    """
+    height, width = image.shape[:2]
+    refined = np.asarray(corners, dtype=np.float32).copy()
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+    for i, (x, y) in enumerate(refined):
+        # Crop enough around the corner for cornerSubPix to search +-radius (it needs 2 * win + 5 pixels),
+        # clipped to the image borders
+        margin = 2 * radius + 3
+        x0, y0 = max(int(x) - margin, 0), max(int(y) - margin, 0)
+        x1, y1 = min(int(x) + margin + 1, width), min(int(y) + margin + 1, height)
+        half = min(radius, (min(x1 - x0, y1 - y0) - 5) // 2)
+        if half < 2:
+            continue
+        window = image[y0:y1, x0:x1]
+        if window.ndim == 3:
+            window = cv2.cvtColor(window, cv2.COLOR_BGR2GRAY)
+        window = cv2.GaussianBlur(window, (3, 3), 0)
+
+        local = np.array([[[x - x0, y - y0]]], dtype=np.float32)
+        cv2.cornerSubPix(window, local, (half, half), (-1, -1), criteria)
+        new_x, new_y = local[0, 0] + (x0, y0)
+
+        # Keep the coarse estimate if the refinement ran away (e.g. no real corner nearby)
+        if abs(new_x - x) <= radius and abs(new_y - y) <= radius:
+            refined[i] = (new_x, new_y)
+    return refined
+
+
+# COARSE-TO-FINE DOCUMENT DETECTION
+def support_edges(image):
+    """
+    Edges that candidate outlines are checked against (see score_quadrilateral): independent of the
+    threshold of edge_map, and a little thick, as an outline fitted to a slightly curved or blurred side
+    runs next to its edge rather than on it.
+    """
+    gray = cv2.GaussianBlur(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    return cv2.dilate(cv2.Canny(gray, 20, 60), np.ones((5, 5), np.uint8))
+
+
+def find_coarse_contour(small, edged, min_area_ratio=MIN_AREA_RATIO):
+    """
+    find_document_contour for a downscaled photo. Canny can leave a one-pixel gap at a sharp corner,
+    and on a small copy nothing else closes the outline; closing such gaps also closes false outlines
+    (e.g. along a lighting gradient), so an outline that needed it must score CONFIDENT_SCORE.
+
+    :param small: The downscaled BGR photo.
+    :param edged: Its edge map (see edge_map).
+    :return: The 4 corner points, shape (4, 1, 2), in the coordinates of the small copy.
+    """
+    try:
+        return find_document_contour(edged, min_area_ratio)
+    except DocumentNotFoundError:
+        closed = cv2.morphologyEx(edged, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+        contour = find_document_contour(closed, min_area_ratio)
+        score, _ = score_quadrilateral(contour, support_edges(small), small.shape[0] * small.shape[1])
+        if score < CONFIDENT_SCORE:
+            raise
+        return contour
+
+
+def detect_document_pyramid(image, max_side=800, min_area_ratio=MIN_AREA_RATIO, buffers=None):
+    """
+    Finds the document quadrilateral on a downscaled copy of the image and refines
+    the four corners at full resolution. Much faster than running edge_map and
+    findContours on a multi-megapixel frame. If the copy shows no document (see
+    find_coarse_contour), the search is repeated at full resolution, so no page is missed
+    that find_document_contour finds there.
+
+    :param image: Full-resolution BGR image.
+    :param max_side: Longest side of the image used for the coarse search.
+    :param min_area_ratio: Smallest accepted document area as a fraction of the frame area.
+    :param buffers: Optional BufferPool for the downscaled copy and its edge map, reused from image to image.
+    :return: The 4 corner points in full-resolution coordinates, float32 with shape (4, 1, 2).
+    """
+    small, scale = downscale(image, max_side, buffers)
+    try:
+        coarse = find_coarse_contour(small, edge_map(small, buffers), min_area_ratio).reshape(4, 2).astype(np.float32)
+    except DocumentNotFoundError:
+        if scale == 1.0:
+            raise
+        return find_document_contour(edge_map(image), min_area_ratio).astype(np.float32)
+    corners = coarse / scale
+    if scale < 1.0:
+        # One coarse pixel covers 1/scale full-resolution pixels; search a little beyond that
+        radius = int(np.ceil(2.0 / scale)) + 4
+        corners = refine_corners(image, corners, radius)
+    return corners.reshape(4, 1, 2)
+
+
+def detect_documents_pyramid(image, max_side=800, min_area_ratio=MIN_AREA_RATIO, max_documents=None, buffers=None):
+    """
+    Like detect_document_pyramid, but finds every document in the image (see find_document_contours).
+
+    :return: List of corner arrays in full-resolution coordinates, float32 with shape (4, 1, 2), in reading order.
+    """
+    small, scale = downscale(image, max_side, buffers)
+    try:
+        documents = find_document_contours(edge_map(small, buffers), min_area_ratio, max_documents)
+    except DocumentNotFoundError:
+        if scale == 1.0:
+            raise
+        # See find_coarse_contour; several documents are not scored, so their gaps are not closed either
+        documents = find_document_contours(edge_map(image), min_area_ratio, max_documents)
+        return [contour.astype(np.float32) for contour in documents]
+    radius = int(np.ceil(2.0 / scale)) + 4
+    outlines = []
+    for coarse in documents:
+        corners = coarse.reshape(4, 2).astype(np.float32) / scale
+        if scale < 1.0:
+            corners = refine_corners(image, corners, radius)
+        outlines.append(corners.reshape(4, 1, 2))
+    return outlines
+
+
+# SCORE A CANDIDATE OUTLINE
+def edge_support(edges, corners, samples_per_side=50):
+    """ Fraction of the points along the sides of the outline that lie on an edge of the photo. """
+    start = corners.reshape(4, 2).astype(np.float32)
+    steps = np.linspace(0.0, 1.0, samples_per_side, endpoint=False, dtype=np.float32)[:, None, None]
+    points = np.rint(start + steps * (np.roll(start, -1, axis=0) - start)).reshape(-1, 2).astype(int)
+    height, width = edges.shape[:2]
+    inside = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+    points = points[inside]
+    return float(np.count_nonzero(edges[points[:, 1], points[:, 0]])) / len(inside)
+
+
+def score_quadrilateral(corners, edges, frame_area):
+    """
+    Scores how much a four-sided outline looks like a photographed page, from 0 to 1: the product of
+    its edge support (see edge_support), how close its corners are to right angles, and its size
+    (full marks from a fifth of the frame up).
+
+    :param corners: The outline, shape (4, 1, 2) or (4, 2).
+    :param edges: Dilated edge map of the photo at the outline's scale.
+    :param frame_area: Area of the photo in pixels.
+    :return: (score, {'support', 'angles', 'size'})
+    """
+    points = corners.reshape(4, 2).astype(np.float64)
+    sides = np.roll(points, -1, axis=0) - points
+    lengths = np.linalg.norm(sides, axis=1)
+    if lengths.min() == 0:
+        return 0.0, {'support': 0.0, 'angles': 0.0, 'size': 0.0}
+    # Cosine between each side and the next one: 0 at a right angle
+    cosines = np.abs(np.sum(sides * np.roll(sides, -1, axis=0), axis=1)) / (lengths * np.roll(lengths, -1))
+    parts = {'support': edge_support(edges, points),
+             'angles': float(1.0 - cosines.max()),
+             'size': float(min(1.0, np.sqrt(cv2.contourArea(points.astype(np.float32)) / (0.2 * frame_area))))}
+    return parts['support'] * parts['angles'] * parts['size'], parts
+
+
+# TRY SEVERAL DETECTOR SETTINGS AT ONCE
+def _best_candidate(small, edges, hypothesis, min_area_ratio):
+    edged = edge_map(small, gamma=hypothesis['gamma'], threshold=hypothesis['threshold'],
+                     kernel_size=hypothesis['kernel_size'], canny=hypothesis['canny'])
+    frame_area = small.shape[0] * small.shape[1]
+    best = {'hypothesis': hypothesis['name'], 'score': 0.0, 'contour': None, 'parts': None}
+    for _, approx in quadrilaterals(edged, min_area_ratio, hypothesis['epsilon']):
+        score, parts = score_quadrilateral(approx, edges, frame_area)
+        if score > best['score']:
+            best.update(score=score, contour=approx, parts=parts)
+    return best
+
+
+def detect_document_hypotheses(image, hypotheses=HYPOTHESES, max_side=800, min_area_ratio=MIN_AREA_RATIO,
+                               min_score=MIN_SCORE, confident_score=CONFIDENT_SCORE, workers=None):
+    """
+    Looks for the document with several detector settings at once (see HYPOTHESES), in a thread pool as
+    OpenCV releases the GIL, on a downscaled copy of the photo. Every candidate outline is scored on its
+    shape and on how well the edges of the photo support it (see score_quadrilateral); the first one
+    scoring confident_score is taken without waiting for the other settings, else the best one wins.
+
+    :param image: Full-resolution BGR image.
+    :param hypotheses: Detector settings to try, most likely first.
+    :param max_side: Longest side of the image used for the search.
+    :param min_area_ratio: Smallest accepted document area as a fraction of the frame area.
+    :param min_score: Lowest score of an outline accepted as the document.
+    :param confident_score: Score from which an outline is accepted at once.
+    :param workers: Number of threads (default: one per hypothesis, at most one per CPU core).
+    :return: Dictionary with 'found', 'document_contour' (full-resolution corners, float32 with shape
+             (4, 1, 2), or None), 'score', 'hypothesis' (name of the winning settings), 'candidates'
+             (best outline of every hypothesis that finished, in small-image coordinates) and 'error'.
+             Never raises for a missing document; see detect_document_robust for a detector that does.
+    """
+    small, scale = downscale(image, max_side)
+    edges = support_edges(small)  # Independent of every hypothesis
+
+    executor = ThreadPoolExecutor(max_workers=workers or min(len(hypotheses), os.cpu_count() or 1))
+    futures = [executor.submit(_best_candidate, small, edges, hypothesis, min_area_ratio)
+               for hypothesis in hypotheses]
+    candidates = []
+    try:
+        for future in as_completed(futures):
+            candidates.append(future.result())
+            if candidates[-1]['score'] >= confident_score:
+                break
+    finally:
+        # Settings that have not started are dropped; running ones finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    best = max(candidates, key=lambda candidate: candidate['score'])
+    result = {'found': best['score'] >= min_score, 'document_contour': None, 'score': round(best['score'], 3),
+              'hypothesis': best['hypothesis'], 'candidates': candidates, 'error': None}
+    if not result['found']:
+        result['error'] = (f"Document contour not found (best outline scored {best['score']:.2f}, "
+                           f"{min_score:.2f} needed)" if best['contour'] is not None else "Document contour not found")
+        return result
+    corners = best['contour'].reshape(4, 2).astype(np.float32) / scale
+    if scale < 1.0:
+        corners = refine_corners(image, corners, int(np.ceil(2.0 / scale)) + 4)
+    result['document_contour'] = corners.reshape(4, 1, 2)
+    return result
+
+
+def detect_document_robust(image, **options):
+    """
+    Pipeline stage: the document corners found by detect_document_hypotheses.
+    Raises DocumentNotFoundError, carrying the detection result, if there is no document.
+    """
+    detection = detect_document_hypotheses(image, **options)
+    if not detection['found']:
+        raise DocumentNotFoundError(detection['error'], detection)
+    return detection['document_contour']
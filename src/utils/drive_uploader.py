@@ -3,10 +3,60 @@ from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
 from kivy.uix.label import Label
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.clock import Clock
 
 import os
+import threading
+from functools import partial
 
-from utils.google_api import authenticate_drive, create_folder, list_folders, upload_file_to_drive
+from utils.folder_index import FolderIndex
+from utils.google_api import authenticate_drive, create_folder, get_credentials, upload_files_to_drive
+
+FOLDER_PAGE_SIZE = 100  # Search results fetched from the folder index at a time
+
+
+# SCROLLABLE LIST OF FOLDERS
+class FolderList(RecycleView):
+    def __init__(self, index, select_callback, **kwargs):
+        """
+        Virtualized list of folder search results: widgets are only created for the rows on screen
+        and reused while scrolling, and more results are read from the index when the end is reached.
+
+        :param index: FolderIndex to search.
+        :param select_callback: Called with (folder_id, folder_path) when a folder is pressed.
+        """
+        super().__init__(**kwargs)
+        self.index = index
+        self.select_callback = select_callback
+        self.query = ""
+        self.exhausted = True  # No more results to load for the current query
+        layout = RecycleBoxLayout(orientation='vertical', size_hint_y=None,
+                                  default_size=(None, 40), default_size_hint=(1, None))
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+        self.viewclass = Button
+        self.bind(scroll_y=self.load_more_at_end)
+
+    def _rows(self, folders):
+        return [{'text': folder['path'] or folder['name'],
+                 'on_release': partial(self.select_callback, folder['id'], folder['path'])} for folder in folders]
+
+    def show(self, query):
+        """ Replaces the list with the first page of folders matching the query. """
+        self.query = query
+        folders = self.index.search(query, FOLDER_PAGE_SIZE)
+        self.exhausted = len(folders) < FOLDER_PAGE_SIZE
+        self.data = self._rows(folders)
+        self.scroll_y = 1
+
+    def load_more_at_end(self, instance, scroll_y):
+        if scroll_y > 0 or self.exhausted:
+            return
+        folders = self.index.search(self.query, FOLDER_PAGE_SIZE, offset=len(self.data))
+        self.exhausted = len(folders) < FOLDER_PAGE_SIZE
+        self.data.extend(self._rows(folders))
 
 
 # UPLOADING A FILE TO GOOGLE DRIVE
@@ -18,8 +68,13 @@ class DriveUploaderApp(App):
         """
         # Initialize the parent class (App) and set up initial attributes
         super().__init__(**kwargs)
-        # Authenticate the user with Google Drive and get the service object
-        self.service = authenticate_drive()
+        # Google Drive is signed in to in the background once the window is shown (see on_start)
+        self.credentials = None
+        self.service = None
+        self._drive_thread = None
+        self._drive_error = None
+        # Local copy of the Drive folder tree, updated incrementally instead of listing every folder each time
+        self.folder_index = FolderIndex()
         # Initialize selected_folder_id to None; this will hold the ID of the selected Google Drive folder
         self.selected_folder_id = None
         # Initialize UI components as instance variables; they will be set up in the build() method
@@ -29,7 +84,9 @@ class DriveUploaderApp(App):
         self.select_folder_btn = None
         self.upload_btn = None
         self.status_label = None
-        self.folder_layout = None
+        self.folder_search_input = None
+        self.folder_list = None
+        self._search_event = None
 
     def build(self):
         """
@@ -39,7 +96,7 @@ class DriveUploaderApp(App):
         # Set up the UI layout using a vertical BoxLayout
         self.layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
         # Create a TextInput widget for the user to enter the file name to upload
-        self.file_name_input = TextInput(hint_text='Enter file name', multiline=False)
+        self.file_name_input = TextInput(hint_text='Enter file name (separate several files with ;)', multiline=False)
         self.layout.add_widget(self.file_name_input)
 
         # Create a Button for selecting an existing folder in Google Drive
@@ -51,9 +108,12 @@ class DriveUploaderApp(App):
         self.new_folder_input = TextInput(hint_text='Enter new folder name (optional)', multiline=False)
         self.layout.add_widget(self.new_folder_input)
 
-        # Layout for folder selection buttons
-        self.folder_layout = BoxLayout(orientation='vertical', spacing=5)
-        self.layout.add_widget(self.folder_layout)
+        # Search field and scrollable list for picking a folder
+        self.folder_search_input = TextInput(hint_text='Search folders', multiline=False, size_hint_y=None, height=40)
+        self.folder_search_input.bind(text=self.on_folder_search)
+        self.layout.add_widget(self.folder_search_input)
+        self.folder_list = FolderList(self.folder_index, self.set_selected_folder)
+        self.layout.add_widget(self.folder_list)
 
         # Create a Button for uploading the file to the selected or newly created folder
         self.upload_btn = Button(text="Upload File")
@@ -67,6 +127,62 @@ class DriveUploaderApp(App):
         # Return the completed layout to be used as the root widget of the application
         return self.layout
 
+    def on_start(self):
+        """ Called by Kivy once the window is open; starts signing in to Google Drive. """
+        self.status_label.text = "Connecting to Google Drive..."
+        self.start_drive_connection()
+
+    def start_drive_connection(self):
+        self._drive_thread = threading.Thread(target=self.connect_drive, daemon=True)
+        self._drive_thread.start()
+
+    def connect_drive(self):
+        """ Runs on a background thread: refreshes (or asks for) the credentials and builds the Drive service. """
+        try:
+            self.credentials = get_credentials()
+            self.service = authenticate_drive(self.credentials)
+            message = "Connected to Google Drive."
+        except Exception as e:
+            self._drive_error = e
+            message = f"Could not connect to Google Drive: {e}"
+        self.set_status(message)
+
+    def set_status(self, text):
+        """ Shows a status message; can be called from any thread, as widgets may only be changed from the main one. """
+        Clock.schedule_once(lambda dt: setattr(self.status_label, 'text', text))
+
+    def drive_ready(self):
+        """
+        Waits for the background sign-in to finish (it usually has by the time a button is pressed).
+        Call from a background thread (see run_in_background).
+        :return: True if Google Drive can be used; otherwise the error is shown and sign-in is retried.
+        """
+        self._drive_thread.join()
+        if self.service is None:
+            error = self._drive_error
+            self.start_drive_connection()
+            self.set_status(f"Could not connect to Google Drive: {error}. Retrying...")
+            return False
+        return True
+
+    def run_in_background(self, button, work):
+        """
+        Runs work on a background thread once Google Drive is signed in to, so Drive requests never freeze
+        the window. The button is disabled until the work is done. Work may only change widgets through
+        Clock (e.g. with set_status).
+        """
+        button.disabled = True
+
+        def run():
+            try:
+                if self.drive_ready():
+                    work()
+            except Exception as e:
+                self.set_status(f"Google Drive error: {e}")
+            finally:
+                Clock.schedule_once(lambda dt: setattr(button, 'disabled', False))
+        threading.Thread(target=run, daemon=True).start()
+
     '''
     FUNCTION NO LONGER USED DUE TO THE INCONVENIENCE OF TYPING OUT FOLDER IDS
     def select_folder(self, instance):
@@ -77,25 +193,31 @@ class DriveUploaderApp(App):
 
     def select_folder(self, instance):
         """ Handles the event when the 'Select Folder to Upload' button is pressed. """
-        # Clear any existing folder buttons
-        self.folder_layout.clear_widgets()
-
-        # Fetch folders from Google Drive
-        folders = list_folders(self.service)
-
-        if folders:
-            # Create a button for each folder
-            for folder in folders:
-                button = Button(text=f"{folder['name']} (ID: {folder['id']})", size_hint_y=None, height=40)
-                button.bind(on_press=lambda btn, folder_id=folder['id']: self.set_selected_folder(folder_id))
-                self.folder_layout.add_widget(button)
+        self.status_label.text = "Updating the folder list..."
+        self.run_in_background(instance, self.sync_folders)
+
+    def sync_folders(self):
+        """ Runs on a background thread: fetches the folder changes since the last sync (everything the first time). """
+        self.folder_index.sync(self.service)
+        Clock.schedule_once(self.show_folders)
+
+    def show_folders(self, dt):
+        if len(self.folder_index):
+            self.status_label.text = ""
+            self.folder_list.show(self.folder_search_input.text)
         else:
             self.status_label.text = "No folders found, file will be uploaded to the root directory."
 
-    def set_selected_folder(self, folder_id):
+    def on_folder_search(self, instance, text):
+        # Wait until the user stops typing for a moment before searching
+        if self._search_event is not None:
+            self._search_event.cancel()
+        self._search_event = Clock.schedule_once(lambda dt: self.folder_list.show(text), 0.2)
+
+    def set_selected_folder(self, folder_id, folder_path=None):
         # Set the selected folder ID and update the status label
         self.selected_folder_id = folder_id
-        self.status_label.text = f"Selected Folder ID: {folder_id}"
+        self.status_label.text = f"Selected Folder: {folder_path or folder_id}"
 
     def upload_file(self, instance):
         """
@@ -104,19 +226,35 @@ class DriveUploaderApp(App):
         :param instance: The button instance that triggered the event.
         :return: None
         """
-        # Get the new folder name from the input
+        # Get the new folder name and the file paths from the inputs; the upload itself runs in the background
         new_folder_name = self.new_folder_input.text.strip()
+        file_paths = [path.strip() for path in self.file_name_input.text.split(';') if path.strip()]
+        self.status_label.text = "Uploading..."
+        self.run_in_background(instance, partial(self.upload_files, file_paths, new_folder_name))
+
+    def upload_files(self, file_paths, new_folder_name):
+        """ Runs on a background thread: creates the new folder, if any, and uploads the files into it. """
         if new_folder_name:
             # Create a new folder if a name is provided
-            self.selected_folder_id = create_folder(self.service, new_folder_name, self.status_label)
+            self.selected_folder_id = create_folder(self.service, new_folder_name)
+            self.folder_index.add(self.selected_folder_id, new_folder_name)
+            self.set_status(f"Folder '{new_folder_name}' created with ID: {self.selected_folder_id}")
 
-        file_path = self.file_name_input.text.strip()  # Get the file path from the input
+        if file_paths and all(os.path.exists(path) for path in file_paths):  # Check if the files exist
+            def progress(path, sent, total):
+                self.set_status(f"Uploading '{os.path.basename(path)}': {100 * sent // max(total, 1)}%")
 
-        if file_path and os.path.exists(file_path):  # Check if the file exists
-            # Upload the file to Google Drive
-            upload_file_to_drive(self.service, file_path, self.selected_folder_id, self.status_label)
+            # Upload the files to Google Drive in parallel; interrupted uploads resume on the next attempt
+            results = upload_files_to_drive(file_paths, self.selected_folder_id, credentials=self.credentials,
+                                            progress=progress)
             # Update the status label
-            self.status_label.text += f"\nFile '{file_path}' uploaded successfully!"
+            lines = []
+            for result in results:
+                if result['error']:
+                    lines.append(f"File '{result['path']}' failed: {result['error']}")
+                else:
+                    lines.append(f"File '{result['path']}' uploaded successfully! (ID: {result['id']})")
+            self.set_status("\n".join(lines))
         else:
-            # Display an error if the file doesn't exist
-            self.status_label.text = "File not found. Please check the file name and try again."
+            # Display an error if a file doesn't exist
+            self.set_status("File not found. Please check the file name and try again.")
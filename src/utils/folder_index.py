@@ -0,0 +1,142 @@
+import sqlite3
+import threading
+
+from utils.google_api import FOLDER_MIME_TYPE, list_folders
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL COLLATE NOCASE,
+    parent_id TEXT
+);
+CREATE INDEX IF NOT EXISTS folders_name ON folders (name);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Only the fields we store, so change pages stay small
+CHANGE_FIELDS = "nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, parents, trashed))"
+
+
+def _like_pattern(text):
+    """ Escapes LIKE wildcards so user input is matched literally. """
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# LOCAL COPY OF THE DRIVE FOLDER TREE
+class FolderIndex:
+    def __init__(self, path='drive_folders.sqlite3'):
+        """
+        Keeps the user's Drive folders in a local SQLite database. The first sync lists every folder once;
+        later syncs only fetch what changed since the last one (Drive's changes feed), so opening the folder
+        picker no longer pages through the whole account.
+
+        :param path: Database file, or ':memory:' for a throwaway index.
+        """
+        # The index is synced on a background thread and searched from the UI thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.Lock()  # Guards the connection; held only for single queries and write transactions
+        self._sync_lock = threading.Lock()  # Keeps two syncs from interleaving their page tokens
+
+    # SYNCHRONISATION
+    def _get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def sync(self, service):
+        """
+        Brings the index up to date with Drive.
+
+        :param service: Authorized Google Drive API service instance.
+        :return: Number of folders added, changed or removed.
+        """
+        # Drive is queried without holding the connection lock, so searches from the UI are not kept waiting
+        with self._sync_lock:
+            with self._lock:
+                token = self._get_meta('page_token')
+            if token is None:
+                return self._full_sync(service)
+            return self._incremental_sync(service, token)
+
+    def _full_sync(self, service):
+        # Take the token first, so changes made while listing are picked up by the next sync
+        token = service.changes().getStartPageToken().execute()['startPageToken']
+        folders = list_folders(service)
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM folders")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO folders (id, name, parent_id) VALUES (?, ?, ?)",
+                [(folder['id'], folder['name'], (folder.get('parents') or [None])[0]) for folder in folders])
+            self._set_meta('page_token', token)
+        return len(folders)
+
+    def _incremental_sync(self, service, token):
+        count = 0
+        while True:
+            response = service.changes().list(pageToken=token, spaces='drive', includeRemoved=True,
+                                              pageSize=1000, fields=CHANGE_FIELDS).execute()
+            with self._lock, self.connection:  # One transaction per page; the token is only advanced with its changes
+                for change in response.get('changes', []):
+                    file = change.get('file') or {}
+                    if change.get('removed') or file.get('trashed') or file.get('mimeType') != FOLDER_MIME_TYPE:
+                        # Deleted, trashed or not a folder: forget it (a no-op for ordinary files)
+                        count += self.connection.execute("DELETE FROM folders WHERE id = ?",
+                                                         (change['fileId'],)).rowcount
+                    else:
+                        self.connection.execute(
+                            "INSERT OR REPLACE INTO folders (id, name, parent_id) VALUES (?, ?, ?)",
+                            (file['id'], file['name'], (file.get('parents') or [None])[0]))
+                        count += 1
+                token = response.get('nextPageToken') or response['newStartPageToken']
+                self._set_meta('page_token', token)
+            if 'newStartPageToken' in response:
+                return count
+
+    def add(self, folder_id, name, parent_id=None):
+        """ Records a folder we just created, so it shows up before the next sync. """
+        with self._lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO folders (id, name, parent_id) VALUES (?, ?, ?)",
+                                    (folder_id, name, parent_id))
+
+    # QUERIES
+    def search(self, text="", limit=50, offset=0):
+        """
+        Finds folders by name, case-insensitively. Names starting with the text come first,
+        then names containing it anywhere.
+
+        :param text: Part of the folder name; an empty string matches every folder.
+        :param limit: Maximum number of results (one page of the list).
+        :param offset: Number of results to skip, for loading the next page.
+        :return: List of {'id', 'name', 'path'} dictionaries.
+        """
+        pattern = _like_pattern(text.strip())
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT id, name FROM folders WHERE name LIKE ? ESCAPE '\\' "
+                "ORDER BY name NOT LIKE ? ESCAPE '\\', name, id LIMIT ? OFFSET ?",
+                (f"%{pattern}%", f"{pattern}%", limit, offset)).fetchall()
+        return [{'id': folder_id, 'name': name, 'path': self.path_of(folder_id)} for folder_id, name in rows]
+
+    def path_of(self, folder_id):
+        """ Resolves a folder to its full path, e.g. 'Study/2024/Physics'. Parents we cannot see are left out. """
+        with self._lock:
+            rows = self.connection.execute(
+                "WITH RECURSIVE ancestors(id, name, parent_id, depth) AS ("
+                "  SELECT id, name, parent_id, 0 FROM folders WHERE id = ?"
+                "  UNION ALL SELECT f.id, f.name, f.parent_id, a.depth + 1 FROM folders f"
+                "  JOIN ancestors a ON f.id = a.parent_id WHERE a.depth < 64"
+                ") SELECT name FROM ancestors ORDER BY depth DESC", (folder_id,)).fetchall()
+        return "/".join(name for name, in rows)
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM folders").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -1,14 +1,33 @@
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+# The Google client libraries are imported inside the functions that use them: together with requests
+# they take a noticeable part of a second to import, which should not delay the app's first window.
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import json
+import mimetypes
 import os
+import random
+import threading
+import time
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
 
+# Drive upload endpoint; point it at a local fake server for testing (or set DRIVE_UPLOAD_URL)
+DRIVE_UPLOAD_URL = os.environ.get('DRIVE_UPLOAD_URL', 'https://www.googleapis.com/upload/drive/v3/files')
+CHUNK_ALIGNMENT = 256 * 1024  # Drive requires chunks to be multiples of 256 KiB (except the last one)
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+SESSION_LIFETIME = 6 * 24 * 3600  # Drive keeps resumable sessions for a week; don't trust older ones
+
+
+class UploadError(Exception):
+    """ Raised when a file cannot be uploaded, after all retries. """
+
+
+def get_credentials():
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
 
-def authenticate_drive():
     creds = None
     # Check if the token.json file exists (this stores the user's access and refresh tokens)
     if os.path.exists('token.json'):
@@ -24,7 +43,13 @@ def authenticate_drive():
         # Save the credentials for the next run
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
-    return build('drive', 'v3', credentials=creds)
+    return creds
+
+
+def authenticate_drive(credentials=None):
+    from googleapiclient.discovery import build
+
+    return build('drive', 'v3', credentials=credentials or get_credentials())
 
 
 def list_folders(service):
@@ -39,9 +64,10 @@ def list_folders(service):
 
     while True:
         response = service.files().list(
-            q="mimeType='application/vnd.google-apps.folder' and trashed=false",
+            q=f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false",
             spaces='drive',
-            fields="nextPageToken, files(id, name)",
+            fields="nextPageToken, files(id, name, parents)",
+            pageSize=1000,  # The largest page Drive allows, to keep the number of round trips down
             pageToken=page_token  # Use the pageToken to get the next page of results
         ).execute()
 
@@ -54,23 +80,25 @@ def list_folders(service):
     return folders  # Return the list of folders
 
 
-def create_folder(service, folder_name, status_label):
+def create_folder(service, folder_name, status_label=None):
     """
     Creates a new folder in the user's Google Drive.
 
     :param service: Authorized Google Drive API service instance.
     :param folder_name: Name of the new folder to create.
-    :param status_label: Kivy Label widget to update the status message in the GUI.
+    :param status_label: Kivy Label widget to update the status message in the GUI; leave it out when
+                         calling from a background thread.
     :return: The ID of the created folder.
     """
     file_metadata = {
         'name': folder_name,  # Set the name of the new folder
-        'mimeType': 'application/vnd.google-apps.folder'  # Specify that this is a folder
+        'mimeType': FOLDER_MIME_TYPE  # Specify that this is a folder
     }
     # Create the folder in Google Drive
     folder = service.files().create(body=file_metadata, fields='id').execute()
     # Update the GUI with the new folder ID
-    status_label.text = f"Folder '{folder_name}' created with ID: {folder.get('id')}"
+    if status_label is not None:
+        status_label.text = f"Folder '{folder_name}' created with ID: {folder.get('id')}"
     return folder.get('id')
 
 
@@ -105,12 +133,245 @@ def upload_file_to_drive(service, file_path, folder_id=None, status_label=None):
     :param status_label: Kivy Label widget to update the status message in the GUI.
     :return: None
     """
+    from googleapiclient.http import MediaFileUpload
+
     file_metadata = {'name': os.path.basename(file_path)}  # Set the file name in Google Drive
     if folder_id:
         file_metadata['parents'] = [folder_id]  # Set the parent folder ID if provided
 
     media = MediaFileUpload(file_path, resumable=True)  # Prepare the file for upload
-    # Upload the file to Google Drive
-    file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    # Upload the file to Google Drive, retrying rate limits and server errors with exponential backoff
+    file = service.files().create(body=file_metadata, media_body=media, fields='id').execute(num_retries=5)
     if status_label:
         status_label.text = f"File ID: {file.get('id')}"  # Update the GUI with the file ID
+
+
+# REMEMBER RESUMABLE UPLOAD SESSIONS ACROSS RESTARTS
+class UploadSessionStore:
+    def __init__(self, path='upload_sessions.json'):
+        """
+        Persists the session URIs of unfinished resumable uploads in a JSON file, so an upload that was
+        interrupted (crash, lost connection, closed app) continues from the last confirmed byte.
+        A session is only reused for the same file: same path, size and modification time, and same folder.
+
+        :param path: JSON file holding the sessions; None keeps them in memory only.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.sessions = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self.sessions = json.load(file)
+            except (OSError, ValueError):
+                self.sessions = {}  # A damaged file only costs us a restart of the uploads
+
+    @staticmethod
+    def key(file_path, folder_id=None):
+        stat = os.stat(file_path)
+        return f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{folder_id or ''}"
+
+    def get(self, key):
+        with self._lock:
+            entry = self.sessions.get(key)
+        if entry is None or time.time() - entry['created'] > SESSION_LIFETIME:
+            return None
+        return entry['uri']
+
+    def put(self, key, uri):
+        with self._lock:
+            self.sessions[key] = {'uri': uri, 'created': time.time()}
+            self._save()
+
+    def remove(self, key):
+        with self._lock:
+            if self.sessions.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        # Write to a temporary file first so a crash never leaves a half-written session file
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump(self.sessions, file, indent=2)
+        os.replace(temporary, self.path)
+
+
+# UPLOAD MANY FILES TO GOOGLE DRIVE
+class DriveUploader:
+    def __init__(self, credentials=None, session_factory=None, base_url=DRIVE_UPLOAD_URL,
+                 chunk_size=8 * 1024 * 1024, max_retries=8, backoff=1.0, max_backoff=64.0, session_store=None):
+        """
+        Uploads files with Drive's resumable upload protocol: the file is sent in chunks, failed requests
+        are retried with exponential backoff and jitter, and the upload session is saved so an interrupted
+        upload can resume instead of starting over.
+
+        :param credentials: Google credentials (see get_credentials). Not needed with a session_factory.
+        :param session_factory: Creates an HTTP session (requests.Session interface) for each upload thread,
+                                e.g. a plain requests.Session for a local fake Drive server.
+        :param base_url: Drive upload endpoint.
+        :param chunk_size: Bytes per request; rounded up to a multiple of 256 KiB.
+        :param max_retries: Retries per request on rate limiting (429), server errors (5xx) and connection errors.
+        :param backoff: Initial backoff in seconds; doubled on every retry.
+        :param max_backoff: Upper limit of a single backoff in seconds.
+        :param session_store: UploadSessionStore for resuming uploads; by default sessions are kept in memory.
+        """
+        if session_factory is None:
+            if credentials is None:
+                raise ValueError("DriveUploader needs credentials or a session_factory")
+            from google.auth.transport.requests import AuthorizedSession
+            session_factory = partial(AuthorizedSession, credentials)
+        self.session_factory = session_factory
+        self.base_url = base_url
+        self.chunk_size = max(CHUNK_ALIGNMENT, -(-chunk_size // CHUNK_ALIGNMENT) * CHUNK_ALIGNMENT)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session_store = session_store or UploadSessionStore(None)
+        self._local = threading.local()
+
+    @property
+    def http(self):
+        """ One HTTP session per thread, since sessions are not safe to share between threads. """
+        if not hasattr(self._local, 'session'):
+            self._local.session = self.session_factory()
+        return self._local.session
+
+    def _request(self, method, url, **kwargs):
+        """ Sends a request, retrying rate limits, server errors and connection errors with backoff and jitter. """
+        import requests
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.http.request(method, url, timeout=(10, 120), **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = f"HTTP {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = f"{type(e).__name__}: {e}"
+            if attempt == self.max_retries:
+                raise UploadError(f"{method} {url} failed after {attempt + 1} attempts: {error}")
+            # "Full jitter": a random wait up to the exponential limit spreads out retries of parallel uploads
+            time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def _start_session(self, file_path, folder_id, size, mime_type):
+        metadata = {'name': os.path.basename(file_path)}
+        if folder_id:
+            metadata['parents'] = [folder_id]
+        response = self._request('POST', self.base_url, params={'uploadType': 'resumable', 'fields': 'id'},
+                                 json=metadata, headers={'X-Upload-Content-Type': mime_type,
+                                                         'X-Upload-Content-Length': str(size)})
+        if response.status_code != 200 or 'Location' not in response.headers:
+            raise UploadError(f"Could not start the upload of {file_path}: HTTP {response.status_code}")
+        return response.headers['Location']
+
+    def _query_offset(self, session_uri, size):
+        """
+        Asks Drive how much of the file it already has.
+
+        :return: The next byte to send, the finished upload's JSON, or None if the session has expired.
+        """
+        response = self._request('PUT', session_uri, headers={'Content-Range': f"bytes */{size}"})
+        if response.status_code in (200, 201):
+            return response.json()
+        if response.status_code == 308:
+            return self._next_offset(response)
+        if response.status_code in (404, 410):
+            return None
+        raise UploadError(f"Could not query upload session: HTTP {response.status_code}")
+
+    @staticmethod
+    def _next_offset(response):
+        # Range: bytes=0-1234 means bytes 0 to 1234 were stored; without it nothing was
+        received = response.headers.get('Range')
+        return int(received.rsplit('-', 1)[1]) + 1 if received else 0
+
+    def upload(self, file_path, folder_id=None, progress=None):
+        """
+        Uploads one file, resuming a previously interrupted upload of the same file if possible.
+
+        :param file_path: Path of the file to upload.
+        :param folder_id: ID of the Drive folder, or None for the root directory.
+        :param progress: Optional callback progress(file_path, bytes_sent, total_bytes).
+        :return: The Drive ID of the uploaded file.
+        """
+        size = os.path.getsize(file_path)
+        mime_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        key = self.session_store.key(file_path, folder_id)
+
+        session_uri = self.session_store.get(key)
+        offset = self._query_offset(session_uri, size) if session_uri else None
+        if offset is None:  # No session yet or it expired: start from the beginning
+            session_uri = self._start_session(file_path, folder_id, size, mime_type)
+            self.session_store.put(key, session_uri)
+            offset = 0
+        result = offset if isinstance(offset, dict) else None  # The previous run may have sent everything
+
+        with open(file_path, 'rb') as file:
+            while result is None:
+                if progress:
+                    progress(file_path, offset, size)
+                file.seek(offset)
+                chunk = file.read(self.chunk_size)
+                end = offset + len(chunk) - 1
+                content_range = f"bytes {offset}-{end}/{size}" if chunk else f"bytes */{size}"
+                try:
+                    response = self._request('PUT', session_uri, data=chunk,
+                                             headers={'Content-Range': content_range})
+                except UploadError as e:
+                    # Some bytes may have arrived before the failure; the saved session lets a later run resume
+                    raise UploadError(f"Upload of {file_path} interrupted at byte {offset} of {size}") from e
+                if response.status_code in (200, 201):
+                    result = response.json()
+                elif response.status_code == 308:
+                    offset = self._next_offset(response)
+                elif response.status_code in (404, 410):
+                    self.session_store.remove(key)
+                    raise UploadError(f"Upload session of {file_path} expired; retry to start over")
+                else:
+                    raise UploadError(f"Upload of {file_path} failed: HTTP {response.status_code} {response.text}")
+
+        self.session_store.remove(key)
+        if progress:
+            progress(file_path, size, size)
+        return result.get('id')
+
+    def upload_many(self, file_paths, folder_id=None, workers=4, progress=None):
+        """
+        Uploads files in parallel through a bounded thread pool. A failing file does not stop the others.
+
+        :param file_paths: Paths of the files to upload.
+        :param folder_id: ID of the Drive folder, or None for the root directory.
+        :param workers: Number of files uploaded at the same time.
+        :param progress: Optional callback progress(file_path, bytes_sent, total_bytes), called from the
+                         upload threads.
+        :return: List of {'path', 'id', 'error'} dictionaries in the order of file_paths.
+        """
+        def upload_one(path):
+            try:
+                return {'path': path, 'id': self.upload(path, folder_id, progress), 'error': None}
+            except (UploadError, OSError, ValueError) as e:
+                return {'path': path, 'id': None, 'error': str(e)}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(upload_one, file_paths))
+
+
+def upload_files_to_drive(file_paths, folder_id=None, workers=4, chunk_size=8 * 1024 * 1024,
+                          session_file='upload_sessions.json', credentials=None, progress=None):
+    """
+    Uploads many files to Google Drive concurrently; interrupted uploads resume on the next call.
+
+    :param file_paths: Paths of the files to upload.
+    :param folder_id: ID of the folder to upload the files to. If None, uploads to the root directory.
+    :param workers: Number of files uploaded at the same time.
+    :param chunk_size: Bytes sent per request.
+    :param session_file: Where unfinished upload sessions are saved.
+    :param credentials: Google credentials; by default the user is authenticated with get_credentials().
+    :param progress: Optional callback progress(file_path, bytes_sent, total_bytes).
+    :return: List of {'path', 'id', 'error'} dictionaries in the order of file_paths.
+    """
+    uploader = DriveUploader(credentials or get_credentials(), chunk_size=chunk_size,
+                             session_store=UploadSessionStore(session_file))
+    return uploader.upload_many(file_paths, folder_id, workers, progress)
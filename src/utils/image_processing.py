@@ -1,133 +1,81 @@
-import cv2
 import time
-import numpy as np
-from fpdf import FPDF
+import itertools
 import os
-from textblob import TextBlob
-import pytesseract
+import sqlite3
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from kivy.clock import Clock
+from kivy.graphics.texture import Texture
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
+from kivy.uix.image import Image
 from kivy.uix.label import Label
+from kivy.uix.popup import Popup
 from kivy.app import App
 
-pytesseract.pytesseract.tesseract_cmd = '/opt/homebrew/Cellar/tesseract/5.4.1/bin/tesseract'
+from utils.lazy_import import lazy_import
 
+# Loaded on first use, so the window opens without waiting for OpenCV, NumPy and Tesseract
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+pytesseract = lazy_import('pytesseract')
 
-# TAKE AN IMAGE USING WEBCAM
-def webcam_frame():
-    # Initialize the webcam
-    cap = cv2.VideoCapture(0)
+from utils.detection import (DocumentNotFoundError, edge_map, find_document_contour, find_document_contours,
+                             draw_document_contour, draw_document_contours, detect_document_pyramid,
+                             detect_document_robust, detect_documents_pyramid, order_points)
+from utils.ocr import TSV_COLUMNS, OcrError, get_engine, ocr_tiled, ocr_words, words_to_text
+from utils.page_content import BLANK, TEXT, classify_page
+from utils.live_capture import auto_capture, CaptureCancelledError
+from utils.memory import BufferPool, MemoryBudget, MemoryBudgetError
+from utils.pdf_writer import PdfWriter, A4
+from utils.pipeline import Pipeline, Stage, PreviewObserver, RecordingObserver
+from utils.spelling import MIN_CONFIDENCE, SpellChecker, correct_spelling
+from utils.text_index import TextIndex
+from utils.tracing import Tracer, TracingObserver
 
-    # Check if the webcam is opened correctly
-    if not cap.isOpened():
-        print("Cannot open camera")
-        exit()
+# Scratch arrays of the low-memory pipelines, reused from page to page
+BUFFERS = BufferPool()
 
-    # Adjust the brightness (values range between 0 and 1, though some systems might allow higher values)
-    # cap.set(cv2.CAP_PROP_BRIGHTNESS, 0.8)
 
-    # Adjust contrast (if available)
-    # cap.set(cv2.CAP_PROP_CONTRAST, 0.5)
-
-    # Adjust exposure (negative values may work better)
-    # cap.set(cv2.CAP_PROP_EXPOSURE, -1)
-
-    # Warm up the webcam to avoid dark frames
-    time.sleep(2)
-    # Capture a single frame from the webcam
-    ret, frame = cap.read()
-    # ret is a boolean value: True if the frame is captured successfully, False otherwise
-    # frame is the captured image represented as a NumPy array
-
-    # Display the captured frame
-    if ret:
-        cv2.imshow("Captured Frame", frame)
-        cv2.waitKey(0)  # the image window stays open until a key is pressed
-    else:
-        print("Error: Failed to capture image from the webcam.")
-        exit()
-
-    # Release the webcam and close any open windows
-    cap.release()
-    cv2.destroyAllWindows()
-    return frame
+# LOAD THE CAPTURED IMAGE
+def load_image(image_path):
+    image = cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"Failed to load image '{image_path}'. Check the path and file existence.")
+    return image
 
 
 # PRE-PROCESS THE IMAGE & DETECT THE DOCUMENT CONTOUR
-def contour_detection(image_path):
-    # Step 1: Read the Captured Image
-    image = cv2.imread(image_path)
-    if image is None:
-        print("Failed to load image. Check the path and file existence.")
-        exit()
-
-    # Step 2: Gamma Correction to Enhance Contrast
-    invGamma = 1.0 / 0.3
-    table = np.array([((i / 255.0) ** invGamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray = cv2.LUT(gray, table)
-
-    # Step 3: Simple Thresholding
-    ret, thresh1 = cv2.threshold(gray, 80, 255, cv2.THRESH_BINARY)
-
-    # Step 4: Dilation and Erosion (Morphological Closing)
-    kernel = np.ones((5, 5), np.uint8)
-    dilated = cv2.dilate(thresh1, kernel, iterations=1)
-    closed = cv2.erode(dilated, kernel, iterations=1)
-
-    # Step 5: Canny Edge Detection
-    edged = cv2.Canny(closed, 50, 150)
-    cv2.imshow("Canny Edges", edged)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-
-    # Step 6: Find Contours and Identify the Largest Quadrilateral
-    contours, _ = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-    document_contour = None
-    max_area = 0
-
-    for contour in contours:
-        area = cv2.contourArea(contour)
-        if area > 40000:  # Filter out small contours
-            peri = cv2.arcLength(contour, True)
-            approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
-
-            # Check if the contour has four points and is the largest found
-            if len(approx) == 4 and area > max_area:
-                document_contour = approx  # NumPy array with the coordinates of the vertices
-                max_area = area
-
-    # Step 7: Draw the Contour or Convex Hull Around the Detected Document
-    if document_contour is not None:
-        hull = cv2.convexHull(document_contour)
-        cv2.drawContours(image, [hull], -1, (0, 255, 0), 3)
-        cv2.imshow("Document Detected", image)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
-    else:
-        print("Document contour not found")
-        exit()
-    return image, document_contour
+def contour_detection(image_path, mode='full', multi=False):
+    """
+    Loads an image and detects the document in it.
+
+    :param image_path: Path to the captured image.
+    :param mode: 'full' searches the full-resolution frame; 'pyramid' searches a downscaled copy
+                 and refines the corners at full resolution (much faster on large photos); 'robust' tries
+                 several detector settings at once and keeps the best outline (see detect_document_hypotheses).
+    :param multi: Detect every document in the image instead of only the largest one ('robust' then
+                  searches like 'pyramid').
+    :return: (image, document_contour), or (image, list of document contours) if multi
+    """
+    image = load_image(image_path)
+    if multi:
+        if mode in ('pyramid', 'robust'):
+            return image, detect_documents_pyramid(image)
+        return image, find_document_contours(edge_map(image))
+    if mode == 'robust':
+        return image, detect_document_robust(image)
+    if mode == 'pyramid':
+        return image, detect_document_pyramid(image)
+    return image, find_document_contour(edge_map(image))
 
 
 # APPLY THE PERSPECTIVE TRANSFORM
 def perspective_transform(image, document_contour):
     # Step 1: Ensure the contour points are in the correct order (top-left, top-right, bottom-right, bottom-left)
-    def order_points(pts):
-        rect = np.zeros((4, 2), dtype="float32")
-        s = pts.sum(axis=1)
-        # The point with the smallest sum is the top-left corner (because both x and y are smallest)
-        # and the point with the largest sum is the bottom-right corner
-        rect[0] = pts[np.argmin(s)]  # top-left
-        rect[2] = pts[np.argmax(s)]  # bottom-right
-        diff = np.diff(pts, axis=1)
-        # The point with the smallest difference is the top-right corner (where x is large, and y is small)
-        # and the point with the largest difference is the bottom-left corner (where x is small, and y is large)
-        rect[1] = pts[np.argmin(diff)]  # top-right
-        rect[3] = pts[np.argmax(diff)]  # bottom-left
-        return rect
-
     ordered_points = order_points(document_contour.reshape(4, 2))
 
     # Step 2: Calculate the width and height of the new image (Euclidean distance)
@@ -155,51 +103,213 @@ def perspective_transform(image, document_contour):
     # Step 4: Compute the perspective transform matrix and apply it
     M = cv2.getPerspectiveTransform(ordered_points, dst)
     warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
-
-    # Step 5: Display the warped image (the "scanned" document)
-    cv2.imshow("Warped Image", warped)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
     return warped
 
 
+def perspective_transform_all(image, document_contours):
+    """ Warps every detected document into a page of its own, the pages in the order of the contours. """
+    return [perspective_transform(image, document_contour) for document_contour in document_contours]
+
+
 # APPLY BINARIZATION (BLACK & WHITE CONVERSION)
 def binarize_image(warped):
     gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
-    # Otsu's thresholding
-    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    cv2.imshow("Binarized Image", binary)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-    return binary
+    # Otsu's thresholding, in place
+    cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=gray)
+    return gray
 
 
 # SHARPEN THE IMAGE
-def sharpen_image(processed_image):
+def sharpen_image(processed_image, in_place=False):
     kernel = np.array([[0, -1, 0],
                        [-1, 5, -1],
                        [0, -1, 0]])
-    sharpened = cv2.filter2D(processed_image, -1, kernel)
-    cv2.imshow("Sharpened Image", sharpened)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-    return sharpened
+    # In place overwrites the input, saving a full-size copy (low-memory mode)
+    return cv2.filter2D(processed_image, -1, kernel, dst=processed_image if in_place else None)
+
+
+# ENHANCE THE PAGE IN ONE STEP
+ENHANCE_MODES = ('adaptive', 'otsu', 'unsharp', 'sharpen')
+
+
+def enhance_page(warped, mode='adaptive', window=None, offset=0.15, amount=1.5, in_place=False):
+    """
+    Turns the warped page into the final image in a single step, replacing binarize_image + sharpen_image
+    (sharpening a page that is already black and white adds nothing).
+
+    :param warped: The warped BGR (or greyscale) page.
+    :param mode: 'adaptive': black & white with a threshold that follows the local brightness, so shadows and
+                 uneven lighting do not turn parts of the page black (the default);
+                 'otsu': black & white with one global threshold (fastest, for evenly lit pages);
+                 'unsharp': unsharp masking of the grey page, then a global threshold (thin or faint print);
+                 'sharpen': the page stays in colour and is only sharpened.
+    :param window: Side of the neighbourhood the 'adaptive' threshold is computed over, in pixels.
+                   Defaults to 1/32 of the shorter page side, about two lines of text.
+    :param offset: 'adaptive': how much darker than its neighbourhood (as a fraction) a pixel must be to be ink.
+    :param amount: 'unsharp': strength of the sharpening.
+    :param in_place: 'sharpen': overwrite warped (low-memory mode). The other modes never modify warped.
+    :return: The final image: black & white (0/255) for the thresholding modes, else the sharpened page.
+    """
+    if mode == 'sharpen':
+        return sharpen_image(warped, in_place)
+    if mode not in ENHANCE_MODES:
+        raise ValueError(f"Unknown enhancement mode '{mode}', expected one of {ENHANCE_MODES}")
+    gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY) if warped.ndim == 3 else warped.copy()
+
+    if mode == 'adaptive':
+        # Local mean from running box sums (the separable form of an integral image: constant cost per pixel
+        # whatever the window size); a pixel is ink when it is clearly darker than its surroundings
+        if window is None:
+            window = max(15, min(gray.shape) // 32)
+        mean = cv2.boxFilter(gray, -1, (window, window), borderType=cv2.BORDER_REPLICATE)
+        cv2.convertScaleAbs(mean, dst=mean, alpha=1.0 - offset)
+        return cv2.compare(gray, mean, cv2.CMP_GT, dst=gray)
+
+    if mode == 'unsharp':
+        # gray + amount * (gray - blurred), saturated to 0..255, written over gray
+        blurred = cv2.GaussianBlur(gray, (0, 0), 2.0)
+        cv2.addWeighted(gray, 1.0 + amount, blurred, -amount, 0, dst=gray)
+    cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=gray)
+    return gray
+
+
+# PIPELINES CHAINING THE PROCESSING FUNCTIONS
+def detection_pipeline(observers=(), mode='full', low_memory=False, multi=False):
+    """
+    Builds the pipeline that finds the document in `image` and produces the `warped` page.
+
+    :param observers: Observers (e.g. PreviewObserver) to attach to the pipeline.
+    :param mode: 'full', 'pyramid' (coarse-to-fine) or 'robust' (several settings at once), see contour_detection.
+    :param low_memory: Search a downscaled copy (as in 'pyramid' mode) in reused buffers, so no full-size
+                       edge map is allocated, and return only `document_contour` and `warped`.
+    :param multi: Find every document in the image: the pipeline then produces `document_contours` and
+                  `warped_pages` (one page per document, in reading order) instead.
+    :return: A Pipeline; run it with pipeline.run(image=<array>).
+    """
+    def preview(ctx):
+        return draw_document_contour(ctx['image'], ctx['document_contour'])
+
+    def preview_all(ctx):
+        return draw_document_contours(ctx['image'], ctx['document_contours'])
+
+    if multi:
+        output, warp, warped = 'document_contours', perspective_transform_all, 'warped_pages'
+        detect, find, preview = detect_documents_pyramid, find_document_contours, preview_all
+    else:
+        output, warp, warped = 'document_contour', perspective_transform, 'warped'
+        detect, find = detect_document_pyramid, find_document_contour
+    if mode == 'robust' and not multi:
+        # Searches a downscaled copy only, so it suits the low-memory mode as it is
+        stages = [Stage("Document Detected", detect_document_robust, inputs=['image'], output=output,
+                        preview=preview)]
+    elif mode in ('pyramid', 'robust') or low_memory:
+        params = {'buffers': BUFFERS} if low_memory else {}
+        stages = [Stage("Document Detected", detect, inputs=['image'], output=output, preview=preview, **params)]
+    else:
+        stages = [Stage("Canny Edges", edge_map, inputs=['image'], output='edged', cacheable=False),
+                  Stage("Document Detected", find, inputs=['edged'], output=output, preview=preview)]
+    stages.append(Stage("Warped Image", warp, inputs=['image', output], output=warped))
+    return Pipeline(stages, observers, keep=(output, warped) if low_memory else None)
+
+
+def enhancement_pipeline(binarize=True, observers=(), low_memory=False, mode='adaptive'):
+    """
+    Builds the pipeline that turns the `warped` page into the `final_image`, in a single stage (see enhance_page).
+
+    :param binarize: Whether to convert the page to black and white; otherwise it is only sharpened, in colour.
+    :param observers: Observers (e.g. PreviewObserver) to attach to the pipeline.
+    :param low_memory: Sharpen colour pages in place (overwriting `warped`) and return only `final_image`.
+                       Not for cached pipelines, whose cached arrays are read-only.
+    :param mode: How black & white pages are made: 'adaptive', 'otsu' or 'unsharp' (see enhance_page).
+    :return: A Pipeline; run it with pipeline.run(warped=<array>).
+    """
+    params = {'mode': mode if binarize else 'sharpen'}
+    if low_memory and not binarize:
+        params['in_place'] = True
+    stage = Stage("Enhanced Image", enhance_page, inputs=['warped'], output='final_image', **params)
+    return Pipeline([stage], observers, keep=('final_image',) if low_memory else None)
+
+
+def scan_pipeline(binarize=True, observers=(), detection_mode='full', low_memory=False, enhance_mode='adaptive'):
+    """ Builds the complete image -> final_image pipeline used for unattended scanning. """
+    pipeline = (detection_pipeline(observers, detection_mode, low_memory)
+                + enhancement_pipeline(binarize, observers, low_memory, enhance_mode))
+    if low_memory:
+        pipeline.keep = {'document_contour', 'final_image'}  # The warped page is consumed by the enhancement
+    return pipeline
 
 
 # OPTICAL CHARACTER RECOGNITION
-def ocr(final_image):
-    # Use pytesseract to perform OCR on the image
-    extracted_text = pytesseract.image_to_string(final_image, lang='eng')
-    # Create a TextBlob object
-    # blob = TextBlob(extracted_text)
-    # Correct the spelling (issues with changing people's names)
-    # corrected_text = blob.correct()
+def ocr(final_image, tiled=False, lang='eng', spell_checker=None):
+    # Correcting the spelling needs Tesseract's confidence in every word, so read the words
+    if spell_checker is not None:
+        return words_to_text(spell_checker.correct_words(ocr_words(final_image, lang=lang, tiled=tiled)))
+    # Large pages can be split into bands that are read in parallel
+    if tiled:
+        return ocr_tiled(final_image, lang=lang)
+    # Use the shared OCR engine (kept loaded between calls) to perform OCR on the image
+    extracted_text = get_engine(lang).image_to_string(final_image)
     return extracted_text
-    # print("Corrected Text:", corrected_text)
+
+
+def ocr_page(final_image, tiled=False, lang='eng'):
+    """ Reads the words of the page with their positions, for both the text output and a searchable PDF. """
+    return ocr_words(final_image, lang=lang, tiled=tiled)
+
+
+def ocr_page_content(final_image, page_content, tiled=False, lang='eng'):
+    """
+    Like ocr_page, guided by the page classification (see classify_page): blank and image-only pages are
+    not read at all, and pages with text only within their text area.
+    """
+    if page_content['kind'] != TEXT:
+        return {column: [] for column in TSV_COLUMNS}
+    return ocr_words(final_image, lang=lang, tiled=tiled, region=page_content['text_box'])
+
+
+def draw_words(image, words):
+    """ Draws the OCR word boxes on a copy of the image (for previews and debug dumps). """
+    canvas = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image.copy()
+    for left, top, width, height in zip(words['left'], words['top'], words['width'], words['height']):
+        cv2.rectangle(canvas, (left, top), (left + width, top + height), (0, 0, 255), 2)
+    return canvas
+
+
+def ocr_pipeline(tiled=False, lang='eng', observers=(), spell_checker=None, min_confidence=MIN_CONFIDENCE,
+                 classify=False):
+    """
+    Builds the final_image -> words -> text pipeline: the page is read once, the text is derived from the words.
+    With a spell_checker, the words Tesseract was unsure about (below min_confidence) are corrected in between.
+    With classify, the page is first sorted into blank, image-only or text (`page_content`, see classify_page),
+    and only the text area of text pages is read.
+    """
+    read = 'ocr_words' if spell_checker is not None else 'words'
+
+    def preview(ctx):
+        return draw_words(ctx['final_image'], ctx[read])
+
+    if classify:
+        stages = [Stage("Page Content", classify_page, inputs=['final_image'], output='page_content'),
+                  Stage("OCR", ocr_page_content, inputs=['final_image', 'page_content'], output=read,
+                        preview=preview, tiled=tiled, lang=lang)]
+    else:
+        stages = [Stage("OCR", ocr_page, inputs=['final_image'], output=read, preview=preview, tiled=tiled,
+                        lang=lang)]
+    if spell_checker is not None:
+        stages.append(Stage("Spelling", correct_spelling, inputs=['ocr_words'], output='words',
+                            spell_checker=spell_checker, min_confidence=min_confidence))
+    stages.append(Stage("OCR Text", words_to_text, inputs=['words'], output='text', cacheable=False))
+    return Pipeline(stages, observers)
 
 
 # REVIEW EXTRACTED TEXT
-def manual_review_gui(extracted_text):
+def manual_review_gui(extracted_text, on_save=None):
+    """
+    Builds the text review panel.
+    :param extracted_text: The OCR text to review.
+    :param on_save: Called with the corrected text when it is saved, e.g. to update the text index;
+                    by default the text is written to saved_text.txt.
+    """
     layout = BoxLayout(orientation='vertical')
 
     # TextInput widget for text editing, preloaded with extracted text
@@ -209,8 +319,11 @@ def manual_review_gui(extracted_text):
     # Save function
     def save_text(instance):
         text = text_input.text
-        with open("saved_text.txt", "w") as file:
-            file.write(text)
+        if on_save is not None:
+            on_save(text)
+        else:
+            with open("saved_text.txt", "w") as file:
+                file.write(text)
         print("Text saved successfully!")
 
     # Button to save the text
@@ -221,45 +334,120 @@ def manual_review_gui(extracted_text):
     return layout
 
 
-# TURN THE FINAL IMAGE INTO A PDF
-def turn_into_pdf(final_image):
-    # Save the NumPy array as an image file
-    image_path = "my_package/non_py_files/final_image.png"
-    cv2.imwrite(image_path, final_image)
-    # Create the PDF
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.image(image_path, x=10, y=10, w=190)
-    pdf.output("scanned_document.pdf", "F")
-
-    # Open the PDF with the default viewer
-    pdf_path = "scanned_document.pdf"
+# OPEN A FILE WITH THE DEFAULT VIEWER
+def open_with_default_viewer(path):
     if os.name == 'nt':  # For Windows
-        os.startfile(pdf_path)
-    elif os.name == 'posix':  # For macOS and Linux
-        os.system(f'open "{pdf_path}"')
-    else:  # For other systems, try xdg-open
-        os.system(f'xdg-open "{pdf_path}"')
+        os.startfile(path)
+    elif sys.platform == 'darwin':  # For macOS
+        subprocess.Popen(['open', path])
+    else:  # For Linux and other systems, try xdg-open
+        subprocess.Popen(['xdg-open', path])
+
+
+# TURN THE FINAL IMAGE(S) INTO A PDF
+def turn_into_pdf(pages, pdf_path="scanned_document.pdf", open_viewer=True, paper_size=A4, words=None,
+                  blank_pages='keep'):
+    """
+    Writes one or more pages into a PDF, straight from memory (no intermediate image files).
+    Black & white pages are stored as 1-bit images, other pages as JPEG.
+
+    :param pages: The processed image (NumPy array) or a list/iterable of pages.
+    :param pdf_path: Where to write the PDF.
+    :param open_viewer: Whether to open the PDF with the default viewer afterwards.
+    :param paper_size: Paper size in points (A4 by default), or None to size every page to its image.
+    :param words: OCR words of the page (see ocr_page), or a list with one entry per page (None for pages
+                  without OCR). Pages with words get an invisible text layer, so the PDF is searchable.
+    :param blank_pages: 'keep' writes every page; 'drop' leaves out the blank ones (see classify_page).
+    :return: Number of pages written. No PDF is written if every page was dropped.
+    """
+    if isinstance(pages, np.ndarray):
+        pages, words = [pages], [words]
+    kept = zip(pages, words or itertools.repeat(None))
+    if blank_pages == 'drop':
+        kept = ((page, page_words) for page, page_words in kept if classify_page(page)['kind'] != BLANK)
+    first = next(kept, None)
+    if first is None:
+        return 0
+
+    written = 0
+    with PdfWriter(pdf_path, paper_size=paper_size) as writer:
+        for page, page_words in itertools.chain([first], kept):
+            if page_words is not None:
+                writer.add_searchable_page(page, page_words)
+            else:
+                writer.add_page(page)
+            written += 1
 
-    return
+    if open_viewer:
+        open_with_default_viewer(pdf_path)
+    return written
 
 
 # HANDLING USER INTERACTION
 class DocumentProcessingApp(App):
-    def __init__(self, **kwargs):
+    # Span name of the step each state of the state machine runs
+    STATE_SPANS = {'INITIAL': 'capture', 'IMAGE_CAPTURED': 'enhance', 'BINARIZED': 'ocr',
+                   'OCR_COMPLETED': 'output', 'FINAL': 'output'}
+
+    def __init__(self, observers=None, tracer=None, low_memory=False, memory_budget=None, text_index=None,
+                 spell_checker=None, detection_mode='robust', blank_pages=None, **kwargs):
         """
         Initializes the DocumentProcessingApp class.
         Sets up initial attributes such as state, image, document contour, and processed images.
+        :param observers: Pipeline observers to attach to every processing step.
+                          Defaults to a preview window after each step.
+        :param tracer: Tracer recording a span per state transition and per pipeline stage.
+                       Defaults to Tracer.from_environment() (exported if SCANNER_TRACE_DIR is set).
+        :param low_memory: Process in place and keep only the image the next step needs, without previews
+                           or precomputed answers, for very large photos on machines with little memory.
+        :param memory_budget: MemoryBudget for the low-memory mode (turns it on); larger photos are downscaled
+                              to fit. Defaults to MemoryBudget.from_environment() (SCANNER_MEMORY_BUDGET_MB).
+        :param text_index: TextIndex the OCR text of every page is added to. Defaults to ocr_index.sqlite3 in the
+                           user data directory (SCANNER_DATA_DIR).
+        :param spell_checker: SpellChecker for the words OCR was unsure about. Defaults to
+                              SpellChecker.from_environment() (SCANNER_SPELLING_DICTIONARY), else no correction.
+        :param detection_mode: How the document is found in the photo, see contour_detection. The default
+                               'robust' tries several detector settings, so odd lighting rarely needs a retake.
+        :param blank_pages: 'keep' or 'drop' blank pages (see classify_page) from the PDF. Blank and image-only
+                            pages are never sent to OCR. Defaults to $SCANNER_BLANK_PAGES, else 'keep'.
         """
         super().__init__(**kwargs)
+        # Processing runs on worker threads; these observers are called on the UI thread once a result is used
+        self.observers = [PreviewObserver()] if observers is None else list(observers)
+        self.tracer = tracer if tracer is not None else Tracer.from_environment()
+        self.tracing = TracingObserver(self.tracer)
+        self.memory_budget = memory_budget if memory_budget is not None else MemoryBudget.from_environment()
+        self.low_memory = low_memory or self.memory_budget is not None
+        # Enough workers for both precomputed branches (enhancement and OCR each) at once
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='processing')
+        self.precomputed = {}  # Binarize choice -> (enhancement future, OCR future), started ahead of the answer
+        self.words_future = None  # OCR of the chosen branch
+        self.busy = False  # Buttons are ignored while the UI waits for a result
+        self.transition = None  # Trace span of the answer being processed, open until its result is used
+        self.capture_cancelled = None  # threading.Event of the running webcam capture
+        self.live_frame = None  # Newest webcam preview frame, shown by show_live_frame
+        self.live_view = None  # Widget showing the webcam preview
         self.current_state = 'INITIAL'  # The state machine starts at 'INITIAL'
         self.image = None  # Placeholder for the original image
         self.document_contour = None  # Placeholder for the detected document contour
         self.warped = None  # Placeholder for the perspective-transformed image
-        self.processed_image = None  # Placeholder for the processed (binarized) image
         self.final_image = None  # Placeholder for the final sharpened image
+        self.words = None  # OCR words with their positions, used for the searchable PDF
+        self._text_index = text_index
+        self.spell_checker = spell_checker if spell_checker is not None else SpellChecker.from_environment()
+        self.detection_mode = detection_mode
+        self.blank_pages = blank_pages or os.environ.get('SCANNER_BLANK_PAGES', 'keep')
+        self.document_id = None  # Identifies the current scan in the text index
+        self.source = None  # Where the current photo came from
         self.pdf_generated = False  # Flag to indicate if the PDF has been generated
 
+    @property
+    def text_index(self):
+        """ Full-text index of every page read so far, opened when the first page is indexed. """
+        if self._text_index is None:
+            self._text_index = TextIndex()
+        return self._text_index
+
     def build(self):
         """
         Builds the Kivy UI layout and returns the root widget.
@@ -285,6 +473,12 @@ class DocumentProcessingApp(App):
 
         return self.layout  # Return the complete layout as the root widget
 
+    def on_stop(self):
+        """ Drops work that has not started yet and stops the webcam; running steps finish in the background. """
+        if self.capture_cancelled is not None:
+            self.capture_cancelled.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
     def on_yes(self, instance):
         """
         Handles the event when the 'Yes' button is pressed.
@@ -295,8 +489,11 @@ class DocumentProcessingApp(App):
     def on_no(self, instance):
         """
         Handles the event when the 'No' button is pressed.
-        Moves to the next step in the state machine.
+        Moves to the next step in the state machine, or cancels the webcam capture while it runs.
         """
+        if self.capture_cancelled is not None:
+            self.capture_cancelled.set()
+            return
         self.process_state('NO')
 
     def process_state(self, user_choice):
@@ -305,117 +502,394 @@ class DocumentProcessingApp(App):
         Calls the appropriate handling methods depending on the state.
         :param user_choice: 'YES' or 'NO' based on user interaction.
         """
-        if self.current_state == 'INITIAL':
-            # Handle the initial image choice (pre-captured or webcam)
-            if user_choice == 'YES':
-                self.handle_image_choice(use_precaptured=True)
-            elif user_choice == 'NO':
-                self.handle_image_choice(use_precaptured=False)
-
-        elif self.current_state == 'IMAGE_CAPTURED':
-            # Handle binarization choice (black & white conversion)
-            if user_choice == 'YES':
-                self.handle_binarization(binarize=True)
-            elif user_choice == 'NO':
-                self.handle_binarization(binarize=False)
-
-        elif self.current_state == 'BINARIZED':
-            # Handle OCR (text extraction) choice
-            if user_choice == 'YES':
-                self.handle_ocr()
-            elif user_choice == 'NO':
-                self.current_state = 'FINAL'
-                self.next_question("Do you want to turn the final image into a PDF?")
-
-        elif self.current_state == 'OCR_COMPLETED' or self.current_state == 'FINAL':
-            # Handle PDF creation choice
-            if user_choice == 'YES':
-                self.handle_pdf_creation()
-            elif user_choice == 'NO':
-                self.question_label.text = "This page is for saving the final image"
-                self.save_image(self.final_image)
-                self.current_state = 'DONE'
+        if self.busy:
+            return  # Still waiting for the previous answer to be processed
+        name = self.STATE_SPANS.get(self.current_state, self.current_state.lower())
+        # The span lasts from the answer until its result is shown, so it is ended by end_transition, which
+        # runs once no more work is waited for (see when_done)
+        self.transition = self.tracer.start_span(name, state=self.current_state, choice=user_choice)
+        try:
+            if self.current_state == 'INITIAL':
+                # Handle the initial image choice (pre-captured or webcam)
+                if user_choice == 'YES':
+                    self.handle_image_choice(use_precaptured=True)
+                elif user_choice == 'NO':
+                    self.handle_image_choice(use_precaptured=False)
+
+            elif self.current_state == 'IMAGE_CAPTURED':
+                # Handle binarization choice (black & white conversion)
+                if user_choice == 'YES':
+                    self.handle_binarization(binarize=True)
+                elif user_choice == 'NO':
+                    self.handle_binarization(binarize=False)
+
+            elif self.current_state == 'BINARIZED':
+                # Handle OCR (text extraction) choice
+                if user_choice == 'YES':
+                    self.handle_ocr()
+                elif user_choice == 'NO':
+                    if self.words_future is not None:
+                        self.words_future.cancel()  # No longer needed, if it has not started yet
+                    self.current_state = 'FINAL'
+                    self.next_question("Do you want to turn the final image into a PDF?")
+
+            elif self.current_state == 'OCR_COMPLETED' or self.current_state == 'FINAL':
+                # Handle PDF creation choice
+                if user_choice == 'YES':
+                    self.handle_pdf_creation()
+                elif user_choice == 'NO':
+                    self.question_label.text = "This page is for saving the final image"
+                    self.save_image(self.final_image)
+                    self.current_state = 'DONE'
+
+        except BaseException as e:
+            self.transition.fail(e)
+            raise
+        finally:
+            self.tracer.detach(self.transition)
+            if not self.busy:
+                self.end_transition()
+
+    def end_transition(self):
+        """ Ends the span of the answer being processed, recording how far the state machine got. """
+        span, self.transition = self.transition, None
+        if span is None:
+            return
+        # Handlers show errors instead of raising them (see show_error), so the state tells how far it got
+        span.set(next_state=self.current_state)
+        latest = [image for image in (self.final_image, self.warped, self.image) if image is not None]
+        span.set_image(latest[0] if latest else None)
+        self.tracer.end_span(span)
 
     def handle_image_choice(self, use_precaptured):
         """
-        Handles the image selection process and updates the state accordingly.
+        Handles the image selection process and starts detecting the document in the background.
         :param use_precaptured: Boolean indicating whether to use a pre-captured image or webcam.
         """
         try:
             if use_precaptured:
-                # Load the pre-captured image and detect contours
-                self.image, self.document_contour = contour_detection("your-image-path")  # ADD YOUR IMAGE PATH
+                # The pre-captured image is loaded in the background together with the detection
+                image_path = "your-image-path"  # ADD YOUR IMAGE PATH
+                self.image = None
+                self.source = os.path.abspath(image_path)
+                self.detect_in_background({}, image_path)
             else:
-                # Capture an image using the webcam and detect contours
-                self.image, self.document_contour = contour_detection(webcam_frame())
+                # Stream the webcam in the background until the document is held still and keep the sharpest
+                # frame. OpenCV windows must stay on the main thread, so the preview is shown in the app instead
+                self.busy_with("Hold the document still in front of the webcam...")
+                self.start_live_view()
+                future = self.submit(auto_capture, preview=False, on_frame=self.on_live_frame,
+                                              cancelled=self.capture_cancelled)
+                self.when_done(future, self.on_photo_captured, 'captured')
+
+        except cv2.error as e:
+            self.show_error(f"Image processing error: {e}", e)
+        except Exception as e:
+            self.show_error(f"An unexpected error occurred: {e}", e)
+
+    def on_photo_captured(self, future):
+        """
+        Uses the webcam photo and the document contour found while capturing it, then detects the document.
+        :param future: The finished auto_capture.
+        """
+        self.stop_live_view()
+        try:
+            self.image, document_contour = future.result()
+            self.source = 'webcam'
+            self.detect_in_background({'document_contour': document_contour})
 
-            # Apply perspective transform to the detected document contour
-            self.warped = perspective_transform(self.image, self.document_contour)
+        except CaptureCancelledError:
+            self.question_label.text = "Capture cancelled. Do you want to use a pre-captured image?"
+        except cv2.error as e:
+            self.show_error(f"Image processing error: {e}", e)
+        except Exception as e:
+            self.show_error(f"An unexpected error occurred: {e}", e)
+
+    def start_live_view(self):
+        """ Shows the webcam preview above the question and turns the 'No' button into a cancel button. """
+        self.capture_cancelled = threading.Event()
+        self.live_frame = None
+        self.live_view = Image(fit_mode='contain')
+        self.layout.add_widget(self.live_view, index=len(self.layout.children))
+        self.no_button.text = "Cancel"
+        self.no_button.disabled = False
+
+    def on_live_frame(self, frame):
+        """ Receives a preview frame on the capture thread; only the newest one is drawn, on the UI thread. """
+        self.live_frame = frame
+        Clock.schedule_once(self.show_live_frame)
+
+    def show_live_frame(self, *args):
+        frame, self.live_frame = self.live_frame, None
+        if frame is None or self.live_view is None:
+            return  # Already drawn, or the capture has ended
+        height, width = frame.shape[:2]
+        texture = self.live_view.texture
+        if texture is None or tuple(texture.size) != (width, height):
+            texture = Texture.create(size=(width, height), colorfmt='bgr')
+        # Kivy textures start at the bottom row
+        texture.blit_buffer(cv2.flip(frame, 0).tobytes(), colorfmt='bgr', bufferfmt='ubyte')
+        self.live_view.texture = texture
+        self.live_view.canvas.ask_update()
+
+    def stop_live_view(self):
+        """ Removes the webcam preview and gives the 'No' button its answer back. """
+        self.capture_cancelled = None
+        self.live_frame = None
+        if self.live_view is not None:
+            self.layout.remove_widget(self.live_view)
+            self.live_view = None
+        self.no_button.text = "No"
+
+    def detect_in_background(self, known, image_path=None):
+        """
+        Starts detecting the document contour in self.image (unless live capture already found it) and applying
+        the perspective transform.
+        :param known: Values already known, e.g. the document contour found during live capture.
+        :param image_path: Photo to load first (on the worker thread) instead of using self.image.
+        """
+        self.document_id = time.strftime('scan-%Y%m%d-%H%M%S')
+        self.busy_with("Looking for the document...")
+        future = self.submit(self.detect_document, self.image, known, image_path)
+        self.when_done(future, self.on_document_detected, 'detected')
+
+    def on_document_detected(self, future):
+        """
+        Uses the detection result and starts preparing the answers to the next questions.
+        :param future: The finished detection (see run_pipeline).
+        """
+        try:
+            result = self.pipeline_result(future)
+            self.document_contour = result['document_contour']
+            self.warped = result['warped']
+            # Only the warped page is needed from here on in low-memory mode, where the photo is not kept
+            self.image = result.get('image')
             self.current_state = 'IMAGE_CAPTURED'
             self.next_question("Do you want to convert the document to black and white?")
+            if not self.low_memory:
+                self.precompute()
 
         except FileNotFoundError as e:
-            self.question_label.text = f"File not found: {e}"
+            self.show_error(f"File not found: {e}", e)
+        except DocumentNotFoundError as e:
+            self.show_error(f"{e}. Please try again with a clearer image.", e)
+        except MemoryBudgetError as e:
+            self.show_error(f"Not enough memory: {e}", e)
         except cv2.error as e:
-            self.question_label.text = f"Image processing error: {e}"
+            self.show_error(f"Image processing error: {e}", e)
         except Exception as e:
-            self.question_label.text = f"An unexpected error occurred: {e}"
+            self.show_error(f"An unexpected error occurred: {e}", e)
+
+    def precompute(self):
+        """
+        Starts both answers to the black & white question, and the OCR of each, while the user is still
+        deciding, so the chosen one is usually ready the moment the answer comes.
+        """
+        self.cancel_precomputed()
+        for binarize in (True, False):
+            enhanced = self.submit(self.run_pipeline, enhancement_pipeline(binarize), warped=self.warped)
+            # Submitted after the enhancement it waits for, so that one is always running first
+            words = self.submit(self.read_page, enhanced)
+            self.precomputed[binarize] = (enhanced, words)
+
+    def cancel_precomputed(self, keep=None):
+        """ Cancels the precomputed branches that have not started, except the one for the answer keep. """
+        for binarize, futures in list(self.precomputed.items()):
+            if binarize != keep:
+                for future in futures:
+                    future.cancel()
+                del self.precomputed[binarize]
 
     def handle_binarization(self, binarize):
         """
         Handles the binarization (black & white conversion) of the image.
-        Updates the state after processing.
+        Uses the precomputed result for the answer, waiting for it if it is not finished yet.
         :param binarize: Boolean indicating whether to apply binarization or not.
         """
+        if self.low_memory:
+            # Computed only now, as precomputing both answers would hold two more pages in memory
+            pipeline = enhancement_pipeline(binarize, low_memory=True)
+            enhanced, self.words_future = self.submit(self.run_pipeline, pipeline, warped=self.warped), None
+        else:
+            self.cancel_precomputed(keep=binarize)
+            enhanced, self.words_future = self.precomputed[binarize]
+        self.busy_with("Enhancing the image...")
+        self.when_done(enhanced, self.on_image_enhanced, 'enhanced')
+
+    def on_image_enhanced(self, future):
+        """
+        Uses the enhancement result and updates the state.
+        :param future: The finished enhancement (see run_pipeline).
+        """
         try:
-            if binarize:
-                # Apply binarization to the warped image
-                self.processed_image = binarize_image(self.warped)
-            else:
-                # Use the warped image as is
-                self.processed_image = self.warped
-
-            # Sharpen the processed image
-            self.final_image = sharpen_image(self.processed_image)
+            result = self.pipeline_result(future)
+            self.final_image = result['final_image']
+            if self.low_memory:
+                self.warped = None  # Only the final image is needed from here on
             self.current_state = 'BINARIZED'
             self.next_question("Do you want to perform Optical Character Recognition?")
 
+        except MemoryBudgetError as e:
+            self.show_error(f"Not enough memory: {e}", e)
         except cv2.error as e:
-            self.question_label.text = f"Image processing error: {e}"
+            self.show_error(f"Image processing error: {e}", e)
         except Exception as e:
-            self.question_label.text = f"An unexpected error occurred: {e}"
+            self.show_error(f"An unexpected error occurred: {e}", e)
 
     def handle_ocr(self):
         """
         Handles the Optical Character Recognition (OCR) process.
-        Updates the state after OCR is completed.
+        The page has usually been read already while the previous question was open.
+        """
+        if self.words_future is None:
+            self.words_future = self.submit(self.read_words, self.final_image)
+        self.busy_with("Reading the text...")
+        self.when_done(self.words_future, self.on_text_read, 'text_read')
+
+    def on_text_read(self, future):
+        """
+        Shows the recognised text for review and updates the state.
+        :param future: The finished OCR, giving the words of the page.
         """
         try:
-            app = App()
-            app.build = lambda: manual_review_gui(ocr(self.final_image))
-            app.run()
+            # Read the page once; the words give both the text to review and the PDF text layer
+            self.words = future.result()
             self.current_state = 'OCR_COMPLETED'
+            if not self.words['text']:
+                self.next_question("No text on this page. Do you want to turn the final image into a PDF?")
+                return
+            text = words_to_text(self.words)
+            # Indexed right away; saving the reviewed text replaces it
+            self.index_text(text)
+            Popup(title="Review the extracted text (tap outside to close)", size_hint=(0.9, 0.9),
+                  content=manual_review_gui(text, on_save=self.index_text)).open()
             self.next_question("Do you want to turn the final image into a PDF?")
 
         except pytesseract.TesseractNotFoundError as e:
-            self.question_label.text = f"Tesseract not found: {e}"
-        except pytesseract.TesseractError as e:
-            self.question_label.text = f"OCR processing error: {e}"
+            self.show_error(f"Tesseract not found: {e}", e)
+        except (pytesseract.TesseractError, OcrError) as e:
+            self.show_error(f"OCR processing error: {e}", e)
         except Exception as e:
-            self.question_label.text = f"An unexpected error occurred: {e}"
+            self.show_error(f"An unexpected error occurred: {e}", e)
+
+    def index_text(self, text):
+        """ Stores the text of the current page in the text index, replacing what was stored for it before. """
+        try:
+            self.text_index.add(self.document_id, text, source=self.source)
+        except sqlite3.Error as e:
+            self.show_error(f"Could not save the text: {e}", e)
+
+    def detect_document(self, image, known, image_path=None):
+        """
+        Runs the detection pipeline (on a worker thread). In low-memory mode the photo is first downscaled
+        if it does not fit in the memory budget.
+        :param known: Values already known, e.g. the document contour found during live capture.
+        :param image_path: Photo to load instead of image, shrunk while decoding if it does not fit in the budget.
+        """
+        if image_path is not None:
+            # Decoding a 12 MP photo takes longer than finding the page in it, so it belongs here too
+            image = self.memory_budget.load(image_path) if self.memory_budget else load_image(image_path)
+        elif self.memory_budget is not None:
+            image, scale = self.memory_budget.fit(image)
+            if 'document_contour' in known:
+                known = {**known, 'document_contour': known['document_contour'] * scale}
+        return self.run_pipeline(detection_pipeline(mode=self.detection_mode, low_memory=self.low_memory),
+                                 image=image, **known)
+
+    def run_pipeline(self, pipeline, **inputs):
+        """
+        Runs a pipeline (on a worker thread), recording its stages so their previews can be shown later.
+        In low-memory mode nothing is recorded, as the recording would keep every intermediate image alive.
+        :return: (the pipeline's context, the RecordingObserver or None)
+        """
+        recorder = None if self.low_memory else RecordingObserver()
+        for observer in (recorder, self.tracing, self.memory_budget):
+            if observer is not None:
+                pipeline.add_observer(observer)
+        return pipeline.run(**inputs), recorder
+
+    def pipeline_result(self, future):
+        """ Returns the context of a finished run_pipeline, after showing its previews (on the UI thread). """
+        result, recorder = future.result()
+        if recorder is not None:
+            recorder.replay(self.observers)
+        return result
+
+    def read_page(self, enhanced):
+        """ OCRs the final image of an enhancement future (see precompute). """
+        result, _ = enhanced.result()
+        return self.read_words(result['final_image'])
+
+    def read_words(self, final_image):
+        """
+        OCRs a final image (on a worker thread), correcting the spelling if enabled. Only the text area is read;
+        blank and image-only pages are not read at all (see classify_page).
+        """
+        words = ocr_page_content(final_image, classify_page(final_image))
+        return self.spell_checker.correct_words(words) if self.spell_checker is not None else words
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Runs func on a worker thread inside the span of the current answer, so the spans of its pipeline stages
+        belong to that answer's trace.
+        :return: The Future of the call.
+        """
+        return self.executor.submit(self.run_within, self.transition, func, *args, **kwargs)
+
+    def run_within(self, span, func, *args, **kwargs):
+        with self.tracer.within(span):
+            return func(*args, **kwargs)
+
+    def when_done(self, future, callback, name):
+        """
+        Calls callback(future) on the UI thread once the future has finished: right away if it already has,
+        otherwise through the Kivy clock. The buttons are enabled again afterwards.
+        :param name: Name of the trace span around the callback.
+        """
+        def finish(*args):
+            self.busy = False
+            self.yes_button.disabled = self.no_button.disabled = False
+            with self.tracer.within(self.transition), self.tracer.span(name, state=self.current_state):
+                callback(future)
+            if not self.busy:  # The callback did not start more work for this answer
+                self.end_transition()
+
+        if future.done():
+            finish()
+        else:
+            future.add_done_callback(lambda f: Clock.schedule_once(finish))
+
+    def busy_with(self, message):
+        """ Shows what the app is working on and ignores the buttons until the result is used (see when_done). """
+        self.busy = True
+        self.yes_button.disabled = self.no_button.disabled = True
+        self.question_label.text = message
 
     def handle_pdf_creation(self):
         """
         Handles the PDF creation process and updates the state after the PDF is generated.
         """
         try:
-            turn_into_pdf(self.final_image)
-            self.pdf_generated = True
+            if turn_into_pdf(self.final_image, words=self.words, blank_pages=self.blank_pages):
+                self.pdf_generated = True
+                self.question_label.text = "PDF generated successfully!"
+            else:
+                self.question_label.text = "The page is blank, so no PDF was written."
             self.current_state = 'DONE'
-            self.question_label.text = "PDF generated successfully!"
 
         except Exception as e:
-            self.question_label.text = f"Error creating PDF: {e}"
+            self.show_error(f"Error creating PDF: {e}", e)
+
+    def show_error(self, message, error):
+        """
+        Shows an error to the user and records it on the current trace span.
+        :param message: The message to display.
+        :param error: The exception that caused it.
+        """
+        self.question_label.text = message
+        self.tracer.fail(error)
+        if self.transition is not None:
+            self.transition.fail(error)
 
     def next_question(self, question):
         """
@@ -474,7 +948,7 @@ class DocumentProcessingApp(App):
             cv2.imwrite(image_path, self.final_image)
             self.question_label.text = f"Image saved successfully at {image_path}."
         except Exception as e:
-            self.question_label.text = f"Failed to save the image: {e}"
+            self.show_error(f"Failed to save the image: {e}", e)
 
     def skip_saving(self, instance):
         """ Skips the image-saving process if the user chooses not to save the image. """
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    outputs TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, not_before, id);
+CREATE INDEX IF NOT EXISTS jobs_file ON jobs (path, size, mtime_ns);
+"""
+
+# Job states: a page is processed, then its outputs are uploaded
+PENDING = 'pending'
+PROCESSING = 'processing'
+PROCESSED = 'processed'
+UPLOADING = 'uploading'
+DONE = 'done'
+FAILED = 'failed'
+
+# Where a job that was interrupted (e.g. by a crash) continues: processing is redone, finished pages are not
+RESUME_STATES = {PROCESSING: PENDING, UPLOADING: PROCESSED}
+
+
+def file_digest(path):
+    """ Content hash of a file, so the same page is only processed once, whatever its name. """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# DURABLE QUEUE OF SCAN JOBS
+class JobQueue:
+    def __init__(self, path='scan_jobs.sqlite3', max_attempts=3, retry_delay=30.0):
+        """
+        Keeps track of every image found in the watched folder in a SQLite database, through the states
+        pending -> processing -> processed -> uploading -> done (or failed). Every change is committed
+        right away, so after a crash or restart finished pages are not redone and interrupted ones resume
+        (see recover).
+
+        :param path: Database file, or ':memory:' for a throwaway queue.
+        :param max_attempts: Attempts per step before a job is marked as failed.
+        :param retry_delay: Seconds before a failed step is retried; doubled on every further attempt.
+        """
+        # Jobs are claimed by the daemon's loop and updated from the upload threads
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+
+    def is_known(self, path, size, mtime_ns):
+        """ Whether this exact file (path, size and modification time) is already queued, without hashing it. """
+        with self._lock:
+            return self.connection.execute("SELECT 1 FROM jobs WHERE path = ? AND size = ? AND mtime_ns = ?",
+                                           (path, size, mtime_ns)).fetchone() is not None
+
+    def add(self, path, size, mtime_ns, digest):
+        """
+        Queues a new image. Images whose content was queued before (e.g. a copy under another name) are ignored.
+
+        :return: The ID of the new job, or None if the content is already known.
+        """
+        now = time.time()
+        with self._lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO jobs (digest, path, size, mtime_ns, state, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (digest, path, size, mtime_ns, PENDING, now, now))
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def recover(self):
+        """
+        Puts the jobs that were in progress when the previous run stopped back in line.
+        Call once at start-up, before any job is claimed.
+
+        :return: Number of jobs recovered.
+        """
+        count = 0
+        with self._lock, self.connection:
+            for state, resume_state in RESUME_STATES.items():
+                count += self.connection.execute("UPDATE jobs SET state = ?, updated = ? WHERE state = ?",
+                                                 (resume_state, time.time(), state)).rowcount
+        return count
+
+    def claim(self, state, next_state, only=None):
+        """
+        Takes the oldest job waiting in state (whose retry delay has passed) and moves it to next_state.
+
+        :param only: IDs of the jobs that may be taken, or None for any job.
+        :return: The job as a dictionary, or None if no job is waiting.
+        """
+        now = time.time()
+        ids = "" if only is None else f" AND id IN ({', '.join('?' * len(only))})"
+        with self._lock, self.connection:
+            row = self.connection.execute(
+                f"SELECT * FROM jobs WHERE state = ? AND not_before <= ?{ids} ORDER BY id LIMIT 1",
+                (state, now, *(only or ()))).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE jobs SET state = ?, updated = ? WHERE id = ?", (next_state, now, row['id']))
+        job = dict(row, state=next_state)
+        job['outputs'] = json.loads(job['outputs']) if job['outputs'] else []
+        return job
+
+    def update(self, job_id, state=None, outputs=None):
+        """
+        Records progress of a job: a new state and/or its outputs (list of {'path', 'id'} dictionaries;
+        'id' is the Drive ID once the file is uploaded). Clears the error and the retry count when the state changes.
+        """
+        with self._lock, self.connection:
+            if outputs is not None:
+                self.connection.execute("UPDATE jobs SET outputs = ?, updated = ? WHERE id = ?",
+                                        (json.dumps(outputs), time.time(), job_id))
+            if state is not None:
+                self.connection.execute(
+                    "UPDATE jobs SET state = ?, attempts = 0, not_before = 0, error = NULL, updated = ? WHERE id = ?",
+                    (state, time.time(), job_id))
+
+    def fail(self, job_id, error, retry_state):
+        """
+        Records a failed step. The job goes back to retry_state after the retry delay, or to 'failed' once
+        it has used up its attempts.
+
+        :return: The job's new state.
+        """
+        with self._lock, self.connection:
+            attempts = self.connection.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] + 1
+            state = FAILED if attempts >= self.max_attempts else retry_state
+            not_before = time.time() + self.retry_delay * 2 ** (attempts - 1)
+            self.connection.execute(
+                "UPDATE jobs SET state = ?, attempts = ?, not_before = ?, error = ?, updated = ? WHERE id = ?",
+                (state, attempts, not_before, str(error), time.time(), job_id))
+        return state
+
+    def defer(self, job_id, state, delay):
+        """ Puts a claimed job back in state for delay seconds, without using up one of its attempts. """
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.execute("UPDATE jobs SET state = ?, not_before = ?, updated = ? WHERE id = ?",
+                                    (state, now + delay, now, job_id))
+
+    def retry_failed(self):
+        """ Gives the failed jobs a new set of attempts, e.g. after fixing what made them fail. """
+        with self._lock, self.connection:
+            # Jobs with outputs only failed to upload, so they need not be processed again
+            return self.connection.execute(
+                "UPDATE jobs SET state = CASE WHEN outputs IS NULL THEN ? ELSE ? END, attempts = 0, not_before = 0, "
+                "updated = ? WHERE state = ?", (PENDING, PROCESSED, time.time(), FAILED)).rowcount
+
+    # QUERIES
+    def counts(self):
+        """ Number of jobs per state. """
+        with self._lock:
+            return dict(self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def sharing_outputs(self, job):
+        """
+        The other unfinished or done jobs with outputs in common with job: a rescan of a known page gets the
+        outputs of the first scan, which that page's own job may still be uploading.
+
+        :return: List of {'id', 'state', 'outputs'} dictionaries.
+        """
+        paths = [output['path'] for output in job['outputs']]
+        if not paths:
+            return []
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT id, state, outputs FROM jobs WHERE id != ? AND state IN (?, ?, ?) AND EXISTS ("
+                "SELECT 1 FROM json_each(jobs.outputs) WHERE json_extract(value, '$.path') IN "
+                f"({', '.join('?' * len(paths))}))", (job['id'], PROCESSED, UPLOADING, DONE, *paths)).fetchall()
+        return [dict(row, outputs=json.loads(row['outputs'])) for row in rows]
+
+    def waiting(self, states):
+        """
+        The jobs waiting in states, to be claimed or for their retry delay to pass.
+
+        :return: (number of jobs, seconds until the first of them can be claimed (0 if one can be claimed now),
+                 or None if there are none)
+        """
+        with self._lock:
+            count, first = self.connection.execute(
+                f"SELECT COUNT(*), MIN(not_before) FROM jobs WHERE state IN ({', '.join('?' * len(states))})",
+                states).fetchone()
+        return count, None if first is None else max(first - time.time(), 0.0)
+
+    def failures(self, limit=20):
+        """ The most recent failed jobs as (path, error) pairs. """
+        with self._lock:
+            return self.connection.execute("SELECT path, error FROM jobs WHERE state = ? ORDER BY updated DESC LIMIT ?",
+                                           (FAILED, limit)).fetchall()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,26 @@
+import importlib.util
+import sys
+
+
+# LOAD HEAVY LIBRARIES ON FIRST USE
+def lazy_import(name):
+    """
+    Returns a module that is only loaded when one of its attributes is first used, so heavy libraries
+    (OpenCV, NumPy, Tesseract) do not delay the first window of the app.
+    Every module that should not trigger the load must use lazy_import too: a plain `import name`
+    statement inspects the module and therefore loads it.
+
+    :param name: Full module name, e.g. 'cv2'.
+    :return: The module (not yet executed if it was not imported before).
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)  # Fail now, not on first use
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,211 @@
+import threading
+import time
+from collections import deque
+
+from utils.lazy_import import lazy_import
+from utils.detection import DocumentNotFoundError, detect_document_pyramid, draw_document_contour, order_points
+from utils.tracking import CornerTracker
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+
+class CaptureCancelledError(Exception):
+    """ Raised when the user closes the live preview before a page was captured. """
+
+
+# READ WEBCAM FRAMES IN THE BACKGROUND
+class FrameGrabber:
+    def __init__(self, source=0, buffer_size=4):
+        """
+        Keeps reading frames from a camera on a background thread into a bounded ring buffer,
+        so slow processing never blocks the camera and always sees the newest frame.
+
+        :param source: Camera index or video file/stream passed to cv2.VideoCapture.
+        :param buffer_size: Number of frames kept; older frames are dropped.
+        """
+        self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            raise IOError("Cannot open camera")
+        self.frames = deque(maxlen=buffer_size)
+        self.frame_id = 0  # Number of frames read so far
+        self.failed = False  # Set when the camera stops delivering frames
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.is_set():
+            ret, frame = self.capture.read()
+            with self._condition:
+                if not ret:
+                    self.failed = True
+                    self._condition.notify_all()
+                    return
+                self.frame_id += 1
+                self.frames.append((self.frame_id, frame))
+                self._condition.notify_all()
+
+    def latest(self, after_id=0, timeout=1.0):
+        """
+        Waits for a frame newer than after_id and returns the newest one.
+
+        :param after_id: ID of the last frame the caller has already seen.
+        :param timeout: Seconds to wait for a new frame.
+        :return: (frame_id, frame)
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.frame_id > after_id or self.failed, timeout):
+                raise IOError("Timed out waiting for a camera frame")
+            if self.frame_id <= after_id:
+                raise IOError("Error: Failed to capture image from the webcam.")
+            return self.frames[-1]
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+        self.capture.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+# CHEAP PER-FRAME SCORES
+def sharpness_score(frame, max_side=320):
+    """ Variance of the Laplacian on a small greyscale copy; higher means sharper. """
+    height, width = frame.shape[:2]
+    scale = min(max_side / max(height, width), 1.0)
+    small = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+def corner_shift(previous, current, frame_shape):
+    """ Largest corner movement between two quads, as a fraction of the frame diagonal. """
+    previous = order_points(previous.reshape(4, 2))
+    current = order_points(current.reshape(4, 2))
+    diagonal = np.hypot(frame_shape[0], frame_shape[1])
+    return float(np.linalg.norm(previous - current, axis=1).max() / diagonal)
+
+
+# PICK THE BEST FRAME ONCE THE DOCUMENT HOLDS STILL
+class SteadyFrameSelector:
+    def __init__(self, steady_frames=8, max_shift=0.01):
+        """
+        Tracks how long the detected quad has stayed in place.
+
+        :param steady_frames: Number of consecutive frames the quad must stay still.
+        :param max_shift: Largest corner movement between frames (fraction of the diagonal) that still counts as still.
+        """
+        self.steady_frames = steady_frames
+        self.max_shift = max_shift
+        self.candidates = []  # (sharpness, frame, contour) of the current steady run
+        self.previous_contour = None
+
+    def reset(self):
+        self.candidates = []
+        self.previous_contour = None
+
+    @property
+    def progress(self):
+        """ Fraction of the required steady run seen so far (0..1). """
+        return min(len(self.candidates) / self.steady_frames, 1.0)
+
+    def update(self, frame, contour):
+        """
+        Feeds the next frame and its detected quad (None if nothing was detected).
+
+        :return: (frame, contour) of the sharpest frame of the steady run once it is long enough, otherwise None.
+        """
+        if contour is None:
+            self.reset()
+            return None
+        if self.previous_contour is not None and \
+                corner_shift(self.previous_contour, contour, frame.shape) > self.max_shift:
+            self.candidates = []  # The document moved; start a new steady run
+        self.previous_contour = contour
+        self.candidates.append((sharpness_score(frame), frame, contour))
+
+        if len(self.candidates) < self.steady_frames:
+            return None
+        _, best_frame, best_contour = max(self.candidates, key=lambda candidate: candidate[0])
+        return best_frame, best_contour
+
+
+# CAPTURE A DOCUMENT AUTOMATICALLY FROM THE WEBCAM
+def preview_frame(frame, contour, progress):
+    """ A copy of the frame with the detected outline (if any) and how long the document has been held still. """
+    shown = frame.copy() if contour is None else draw_document_contour(frame, contour)
+    cv2.putText(shown, f"Hold still... {progress:.0%}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+    return shown
+
+
+def auto_capture(source=0, steady_frames=8, max_shift=0.01, timeout=30.0, preview=True,
+                 detector=detect_document_pyramid, track=True, on_frame=None, cancelled=None):
+    """
+    Streams frames from the webcam, runs the document detector on each new frame and returns the
+    sharpest frame once the document has been held still for steady_frames frames.
+    No warm-up delay or keypress is needed.
+
+    :param source: Camera index or video source.
+    :param steady_frames: Number of consecutive still frames required before capturing.
+    :param max_shift: Allowed corner movement between frames, as a fraction of the frame diagonal.
+    :param timeout: Seconds to wait for a steady document.
+    :param preview: Show a live window with the detected outline (press 'q' or Esc to cancel). OpenCV windows
+                    must be opened from the main thread, so pass False when capturing on a worker thread.
+    :param detector: Function (frame -> document_contour) raising DocumentNotFoundError when nothing is found.
+    :param track: Follow the corners with optical flow between frames and only re-run the detector
+                  when tracking is lost (keeps the preview smooth on slow machines).
+    :param on_frame: Called with every preview frame (see preview_frame), e.g. to show it in a GUI instead.
+    :param cancelled: threading.Event; setting it cancels the capture.
+    :return: (frame, document_contour)
+    """
+    selector = SteadyFrameSelector(steady_frames, max_shift)
+    tracker = CornerTracker(detector) if track else None
+    deadline = time.monotonic() + timeout
+    frame_id = 0
+    window_open = False
+
+    with FrameGrabber(source) as grabber:
+        try:
+            while time.monotonic() < deadline:
+                if cancelled is not None and cancelled.is_set():
+                    raise CaptureCancelledError("Capture cancelled")
+                frame_id, frame = grabber.latest(after_id=frame_id)
+                if tracker is not None:
+                    contour = tracker.update(frame)
+                else:
+                    try:
+                        contour = detector(frame)
+                    except DocumentNotFoundError:
+                        contour = None
+
+                best = selector.update(frame, contour)
+                if best is not None:
+                    best_frame, best_contour = best
+                    if tracker is not None:
+                        best_contour = tracker.refine(best_frame, best_contour)
+                    return best_frame, best_contour
+
+                if on_frame is None and not preview:
+                    continue
+                shown = preview_frame(frame, contour, selector.progress)
+                if on_frame is not None:
+                    on_frame(shown)
+                if preview:
+                    cv2.imshow("Live Capture", shown)
+                    window_open = True
+                    if cv2.waitKey(1) & 0xFF in (ord('q'), 27):
+                        raise CaptureCancelledError("Capture cancelled")
+        finally:
+            if window_open:
+                cv2.destroyWindow("Live Capture")
+    raise DocumentNotFoundError(f"No steady document found within {timeout:.0f} seconds")
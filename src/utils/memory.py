@@ -0,0 +1,216 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import threading
+import warnings
+
+from utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# Memory the low-memory pipeline needs per pixel of the photo at its peak: the BGR photo (3 bytes),
+# the pooled grey and edge buffers (2), the warped page (up to 3) and the binarized page (1)
+LOW_MEMORY_BYTES_PER_PIXEL = 9
+
+# Photos are never downscaled below this (about 1 megapixel); a smaller budget is an error
+MIN_PIXELS = 1_000_000
+
+# Factors by which OpenCV can shrink a photo while decoding it (much less memory than decoding it whole)
+REDUCED_READ_FLAGS = {2: 'IMREAD_REDUCED_COLOR_2', 4: 'IMREAD_REDUCED_COLOR_4', 8: 'IMREAD_REDUCED_COLOR_8'}
+
+
+class MemoryBudgetError(MemoryError):
+    """ Raised when processing would go, or went, over the memory budget. """
+
+
+# Flavor of task_info that fills in a mach_task_basic_info (<mach/task_info.h>)
+MACH_TASK_BASIC_INFO = 20
+
+
+class _MachTaskBasicInfo(ctypes.Structure):
+    _fields_ = [('virtual_size', ctypes.c_uint64), ('resident_size', ctypes.c_uint64),
+                ('resident_size_max', ctypes.c_uint64), ('user_time', ctypes.c_int32 * 2),
+                ('system_time', ctypes.c_int32 * 2), ('policy', ctypes.c_int32), ('suspend_count', ctypes.c_int32)]
+
+
+# MEASURE THE PROCESS
+def current_rss():
+    """ Memory currently resident for this process in bytes, or None where it cannot be read (e.g. Windows). """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == 'darwin':
+        return _mach_resident_size()
+    return None
+
+
+def _mach_resident_size():
+    # macOS has no /proc; task_info is what ps and top read the resident size from
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        info = _MachTaskBasicInfo()
+        count = ctypes.c_uint32(ctypes.sizeof(info) // 4)  # In natural_t units
+        task = ctypes.c_uint32.in_dll(libc, 'mach_task_self_')
+        if libc.task_info(task, MACH_TASK_BASIC_INFO, ctypes.byref(info), ctypes.byref(count)) != 0:
+            return None
+    except (OSError, AttributeError, ValueError):
+        return None
+    return info.resident_size
+
+
+def peak_rss():
+    """ Highest resident memory of this process so far in bytes, or None where it cannot be read (Windows). """
+    try:
+        # On Linux, getrusage would include the peak of the process that started this one, as it survives exec
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Bytes on macOS, kilobytes elsewhere
+
+
+def image_size(path):
+    """ (width, height) from the header of a PNG or JPEG file, without decoding it; None for other files. """
+    with open(path, 'rb') as file:
+        head = file.read(24)
+        if head[:8] == b'\x89PNG\r\n\x1a\n':
+            return struct.unpack('>II', head[16:24])
+        if head[:2] != b'\xff\xd8':
+            return None
+        # Walk the JPEG segments up to the frame header (SOF0-SOF15, except DHT, JPG and DAC)
+        file.seek(2)
+        while True:
+            marker = file.read(4)
+            if len(marker) < 4 or marker[0] != 0xFF:
+                return None
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>xHH', file.read(5))
+                return width, height
+            file.seek(struct.unpack('>H', marker[2:])[0] - 2, os.SEEK_CUR)
+
+
+# REUSABLE SCRATCH ARRAYS
+class BufferPool:
+    def __init__(self):
+        """
+        Scratch arrays kept by name (one set per thread), so pages of the same size reuse the same memory
+        instead of allocating new full-size arrays for every page.
+        A buffer is overwritten by the next request for the same name: only use it for values that are
+        consumed before the next page is processed (e.g. the edge map, see detection.edge_map).
+        """
+        self._local = threading.local()
+
+    def get(self, name, shape, dtype='uint8'):
+        """ Returns the buffer for name, reallocated only if the shape or dtype changed. Contents are undefined. """
+        buffers = self._local.__dict__.setdefault('buffers', {})
+        buffer = buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != np.dtype(dtype):
+            buffer = buffers[name] = np.empty(shape, dtype)
+        return buffer
+
+    def clear(self):
+        """ Frees the buffers of the calling thread. """
+        self._local.__dict__.pop('buffers', None)
+
+    def __repr__(self):
+        # Stable, so pipeline cache keys do not change with the pool's address
+        return "BufferPool()"
+
+
+# KEEP A PAGE WITHIN A MEMORY LIMIT
+class MemoryBudget:
+    def __init__(self, limit_bytes, bytes_per_pixel=LOW_MEMORY_BYTES_PER_PIXEL):
+        """
+        Keeps the process within limit_bytes of resident memory while a page is processed.
+        fit() downscales photos whose working set would not fit in what is left of the budget, and as a
+        pipeline observer it raises MemoryBudgetError after any stage that took the process over the limit.
+
+        :param limit_bytes: Limit for the whole process, including the app itself.
+        :param bytes_per_pixel: Working set of the pipeline per pixel of the photo.
+        """
+        self.limit_bytes = limit_bytes
+        self.bytes_per_pixel = bytes_per_pixel
+
+    @classmethod
+    def from_environment(cls):
+        """ A budget of $SCANNER_MEMORY_BUDGET_MB megabytes if that variable is set, else None. """
+        megabytes = os.environ.get('SCANNER_MEMORY_BUDGET_MB')
+        return cls(int(float(megabytes) * 1024 ** 2)) if megabytes else None
+
+    def in_use(self):
+        """ Resident memory of the process (see current_rss), or 0 with a warning where it cannot be measured. """
+        rss = current_rss()
+        if rss is None:
+            # Shown once per process, as a warning is only shown the first time it is raised from the same line
+            warnings.warn("The memory in use cannot be measured on this system, so the memory budget only limits "
+                          "the photo size, not the memory of the process", RuntimeWarning)
+        return rss or 0
+
+    def max_pixels(self, in_use=None):
+        """ Largest photo (in pixels) that can be processed with what is left of the budget. """
+        in_use = self.in_use() if in_use is None else in_use
+        return (self.limit_bytes - in_use) // self.bytes_per_pixel
+
+    def load(self, image_path):
+        """
+        Loads a photo, shrinking it while it is decoded if it would not fit in the budget, then fits it exactly.
+        Decoding a 48 MP JPEG at half size takes about a quarter of the memory of decoding it whole.
+
+        :return: The photo as a BGR image, possibly downscaled.
+        """
+        size = image_size(image_path)
+        flags = cv2.IMREAD_COLOR
+        if size is not None:
+            pixels, max_pixels = size[0] * size[1], self.max_pixels()
+            # The smallest reduction that fits, but never below MIN_PIXELS; fit() takes care of the rest
+            for factor, flag in REDUCED_READ_FLAGS.items():
+                if pixels <= max_pixels or pixels // factor ** 2 < MIN_PIXELS:
+                    break
+                flags = getattr(cv2, flag)
+                if pixels // factor ** 2 <= max_pixels:
+                    break
+        image = cv2.imread(image_path, flags)
+        if image is None:
+            raise FileNotFoundError(f"Failed to load image '{image_path}'. Check the path and file existence.")
+        return self.fit(image)[0]
+
+    def fit(self, image):
+        """
+        Downscales the photo (with area averaging) if processing it would not fit in the budget.
+
+        :param image: The photo, already in memory.
+        :return: (photo, scale factor applied to it)
+        """
+        pixels = image.shape[0] * image.shape[1]
+        # The photo itself is part of the working set, so do not count it twice
+        in_use = self.in_use() - image.nbytes
+        max_pixels = self.max_pixels(in_use)
+        if pixels <= max_pixels:
+            return image, 1.0
+        if max_pixels < MIN_PIXELS:
+            raise MemoryBudgetError(f"The memory budget of {self.limit_bytes / 1024 ** 2:.0f} MB leaves no room "
+                                    f"for processing ({in_use / 1024 ** 2:.0f} MB already in use)")
+        scale = (max_pixels / pixels) ** 0.5
+        return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+    def check(self, where):
+        """ Raises MemoryBudgetError if the process is over the budget. """
+        rss = self.in_use()
+        if rss > self.limit_bytes:
+            raise MemoryBudgetError(f"{where}: {rss / 1024 ** 2:.0f} MB in use, "
+                                    f"over the budget of {self.limit_bytes / 1024 ** 2:.0f} MB")
+
+    def on_stage_end(self, stage, context, seconds):
+        self.check(stage.name)
@@ -0,0 +1,372 @@
+import os
+import queue
+import shlex
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+pytesseract = lazy_import('pytesseract')
+
+# Where to find the tesseract binary and its language data; override with environment variables
+# (e.g. TESSERACT_CMD=/opt/homebrew/bin/tesseract) or configure_ocr().
+TESSERACT_CMD = os.environ.get('TESSERACT_CMD', 'tesseract')
+TESSDATA_DIR = os.environ.get('TESSDATA_PREFIX')
+
+# Columns of Tesseract's TSV output, as used by pytesseract.Output.DICT
+TSV_COLUMNS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text')
+
+
+class OcrError(Exception):
+    """ Raised when an OCR engine cannot be started or fails to read a page. """
+
+
+# CONFIGURE THE OCR ENGINE
+def configure_ocr(tesseract_cmd=None, tessdata_dir=None):
+    """
+    Sets the tesseract binary and language data directory for all engines created afterwards.
+
+    :param tesseract_cmd: Path to the tesseract binary (used by the subprocess backend).
+    :param tessdata_dir: Directory containing the *.traineddata files.
+    :return: None
+    """
+    global TESSERACT_CMD, TESSDATA_DIR
+    if tesseract_cmd:
+        TESSERACT_CMD = tesseract_cmd
+    if tessdata_dir:
+        TESSDATA_DIR = tessdata_dir
+    with _engines_lock:
+        _engines.clear()
+
+
+def parse_tsv(tsv):
+    """ Converts Tesseract TSV output into the column dictionary returned by pytesseract.image_to_data. """
+    data = {column: [] for column in TSV_COLUMNS}
+    for row in tsv.splitlines():
+        fields = row.split('\t')
+        if len(fields) < len(TSV_COLUMNS) - 1 or fields[0] == 'level':
+            continue  # Skip the header and malformed rows
+        fields += [''] * (len(TSV_COLUMNS) - len(fields))
+        for column, value in zip(TSV_COLUMNS, fields):
+            if column == 'text':
+                data[column].append(value)
+            elif column == 'conf':
+                data[column].append(float(value))
+            else:
+                data[column].append(int(value))
+    return data
+
+
+# OCR BACKEND: ONE TESSERACT PROCESS PER CALL
+class SubprocessEngine:
+    def __init__(self, lang='eng', threads=None):
+        """
+        Runs the tesseract binary through pytesseract. Every call writes a temporary image,
+        starts tesseract and reloads the language model, so it is the slowest backend,
+        but it only needs the tesseract binary to be installed.
+
+        :param lang: Tesseract language(s), e.g. 'eng' or 'eng+lav'.
+        :param threads: Threads each tesseract process may use (OMP_THREAD_LIMIT), or None for all cores.
+        """
+        self.lang = lang
+        self.threads = threads
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+        self.config = f'--tessdata-dir "{TESSDATA_DIR}"' if TESSDATA_DIR else ''
+        self._limited = {}  # Threads -> engine, see with_threads
+
+    def with_threads(self, threads):
+        """ An engine like this one whose tesseract processes use at most this many threads. """
+        if threads == self.threads:
+            return self
+        if threads not in self._limited:
+            self._limited[threads] = SubprocessEngine(self.lang, threads)
+        return self._limited[threads]
+
+    def _run(self, image, extension):
+        # pytesseract always hands os.environ to tesseract, so a thread limit for these calls alone
+        # needs tesseract started here, reading the image from stdin and writing to stdout
+        ok, png = cv2.imencode('.png', image)
+        if not ok:
+            raise OcrError("Could not encode the page for tesseract")
+        command = [TESSERACT_CMD, 'stdin', 'stdout', '-l', self.lang, *shlex.split(self.config), *extension]
+        try:
+            completed = subprocess.run(command, input=png.tobytes(), capture_output=True,
+                                       env={**os.environ, 'OMP_THREAD_LIMIT': str(self.threads)})
+        except OSError as e:
+            raise OcrError(f"Could not run tesseract ({TESSERACT_CMD}): {e}") from e
+        if completed.returncode:
+            raise OcrError(f"tesseract failed: {completed.stderr.decode(errors='replace').strip()}")
+        return completed.stdout.decode('utf-8')
+
+    def image_to_string(self, image):
+        if self.threads is not None:
+            return self._run(image, [])
+        return pytesseract.image_to_string(image, lang=self.lang, config=self.config)
+
+    def image_to_data(self, image):
+        if self.threads is not None:
+            return parse_tsv(self._run(image, ['tsv']))
+        return pytesseract.image_to_data(image, lang=self.lang, config=self.config,
+                                         output_type=pytesseract.Output.DICT)
+
+
+# OCR BACKEND: LONG-LIVED IN-PROCESS TESSERACT
+class InProcessEngine:
+    def __init__(self, lang='eng', instances=None):
+        """
+        Keeps Tesseract loaded in this process through tesserocr, so the language data is read
+        once and pages are passed as raw pixel buffers without encoding a temporary file.
+        A small pool of Tesseract instances lets several threads read pages at the same time
+        (tesserocr releases the GIL while recognising).
+
+        :param lang: Tesseract language(s).
+        :param instances: Number of Tesseract instances (defaults to the number of CPU cores).
+        """
+        try:
+            import tesserocr
+        except ImportError as e:
+            raise OcrError("The in-process OCR backend needs the 'tesserocr' package") from e
+        self.lang = lang
+        self._tesserocr = tesserocr
+        self._apis = queue.Queue()
+        self._created = 0
+        self._max_instances = instances or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._apis.put(self._new_api())  # Fail early if the language data cannot be loaded
+
+    def _new_api(self):
+        try:
+            if TESSDATA_DIR:
+                api = self._tesserocr.PyTessBaseAPI(path=TESSDATA_DIR, lang=self.lang)
+            else:
+                api = self._tesserocr.PyTessBaseAPI(lang=self.lang)
+        except RuntimeError as e:
+            raise OcrError(f"Could not load Tesseract language data for '{self.lang}': {e}") from e
+        self._created += 1
+        return api
+
+    def _acquire(self):
+        try:
+            return self._apis.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self._max_instances:
+                    return self._new_api()
+            return self._apis.get()
+
+    def _recognise(self, image, read):
+        api = self._acquire()
+        try:
+            pixels = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+            height, width = pixels.shape[:2]
+            channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+            api.SetImageBytes(pixels.tobytes(), width, height, channels, width * channels)
+            return read(api)
+        finally:
+            api.Clear()
+            self._apis.put(api)
+
+    def image_to_string(self, image):
+        return self._recognise(image, lambda api: api.GetUTF8Text())
+
+    def image_to_data(self, image):
+        def read(api):
+            api.Recognize()
+            return parse_tsv(api.GetTSVText(0))
+        return self._recognise(image, read)
+
+    def with_threads(self, threads):
+        """ This engine: Tesseract reads its thread limit once, when the library is loaded. """
+        return self
+
+    def close(self):
+        while not self._apis.empty():
+            self._apis.get_nowait().End()
+
+
+# PICK AND REUSE AN ENGINE
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(lang='eng', backend='auto'):
+    """
+    Returns a shared OCR engine, creating it on first use.
+
+    :param lang: Tesseract language(s).
+    :param backend: 'inprocess' (tesserocr), 'subprocess' (pytesseract) or 'auto' (in-process if available).
+    :return: An engine with image_to_string(image) and image_to_data(image) methods.
+    """
+    with _engines_lock:
+        engine = _engines.get((backend, lang))
+        if engine is None:
+            if backend == 'subprocess':
+                engine = SubprocessEngine(lang)
+            elif backend == 'inprocess':
+                engine = InProcessEngine(lang)
+            else:
+                try:
+                    engine = InProcessEngine(lang)
+                except OcrError:
+                    engine = SubprocessEngine(lang)
+            _engines[(backend, lang)] = engine
+        return engine
+
+
+# FIND SAFE PLACES TO CUT THE PAGE
+def split_into_bands(image, band_height=600, search=80, overlap=40):
+    """
+    Splits a page into horizontal bands for parallel OCR. Cuts are moved to the emptiest row
+    (a gap between text lines) near each target position. Where a cut still goes through ink,
+    the neighbouring bands are read with an extra margin so the cut line is complete in both.
+
+    :param image: Greyscale or BGR page.
+    :param band_height: Target height of a band in pixels.
+    :param search: How far (in pixels) to look around each target cut for a gap between lines.
+    :param overlap: Margin in pixels added on each side of a cut that goes through ink.
+    :return: List of (crop_top, crop_bottom, core_top, core_bottom). Words are kept by the band whose
+             core contains their vertical centre, so a line read twice is only kept once.
+    """
+    height = image.shape[0]
+    if height <= band_height + search:
+        return [(0, height, 0, height)]
+
+    # Ink per row: dark pixels on a light page
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    profile = ink.sum(axis=1)
+
+    cuts = [0]
+    while height - cuts[-1] > band_height + search:
+        lo = cuts[-1] + band_height - search
+        hi = min(cuts[-1] + band_height + search, height - 1)
+        cuts.append(lo + int(np.argmin(profile[lo:hi])))
+    cuts.append(height)
+
+    bands = []
+    for top, bottom in zip(cuts[:-1], cuts[1:]):
+        crop_top = top - overlap if top > 0 and profile[top] > 0 else top
+        crop_bottom = bottom + overlap if bottom < height and profile[bottom] > 0 else bottom
+        bands.append((max(crop_top, 0), min(crop_bottom, height), top, bottom))
+    return bands
+
+
+# KEEP ONLY THE RECOGNISED WORDS
+def select_words(data, keep=None):
+    """
+    Filters Tesseract's image_to_data output down to the word rows (with text), dropping the
+    page, block, paragraph and line rows.
+
+    :param data: Column dictionary as returned by an engine's image_to_data.
+    :param keep: Optional predicate on the row index for further filtering.
+    :return: Column dictionary with one entry per word, in reading order.
+    """
+    words = {column: [] for column in TSV_COLUMNS}
+    for i, text in enumerate(data['text']):
+        if not text.strip() or (keep is not None and not keep(i)):
+            continue
+        for column in TSV_COLUMNS:
+            words[column].append(data[column][i])
+    return words
+
+
+def words_to_text(words):
+    """
+    Joins OCR words into plain text: words of a line are separated by spaces, lines of a paragraph
+    by newlines and paragraphs by an empty line.
+
+    :param words: Column dictionary of words (see select_words), in reading order.
+    :return: The text.
+    """
+    text = []
+    previous_line = previous_paragraph = None
+    for i, word in enumerate(words['text']):
+        paragraph = (words['block_num'][i], words['par_num'][i])
+        line = paragraph + (words['line_num'][i],)
+        if line == previous_line:
+            text[-1] += " " + word
+            continue
+        if previous_paragraph is not None and paragraph != previous_paragraph:
+            text.append("")
+        text.append(word)
+        previous_line, previous_paragraph = line, paragraph
+    return "\n".join(text)
+
+
+# READ THE WORDS IN ONE BAND
+def _band_words(image, band, engine):
+    crop_top, crop_bottom, core_top, core_bottom = band
+    data = engine.image_to_data(image[crop_top:crop_bottom])
+
+    def in_core(i):
+        centre = crop_top + data['top'][i] + data['height'][i] / 2
+        return core_top <= centre < core_bottom
+    words = select_words(data, in_core)
+    words['top'] = [top + crop_top for top in words['top']]  # Back to page coordinates
+    return words
+
+
+# OCR A LARGE PAGE IN PARALLEL
+def ocr_words(image, lang='eng', tiled=False, band_height=600, workers=None, engine=None, region=None):
+    """
+    Reads the words on a page together with their bounding boxes. The result carries everything needed
+    for both the plain text (words_to_text) and a searchable PDF text layer, so a page is only read once.
+
+    :param image: The page to read (NumPy array).
+    :param lang: Tesseract language.
+    :param tiled: Read horizontal bands of the page in parallel (faster for large pages).
+                  Both engine backends release the GIL while recognising, so threads are enough to use all cores.
+    :param band_height: Target height of a band in pixels.
+    :param workers: Number of bands read at the same time (defaults to the number of CPU cores).
+    :param engine: OCR engine to use (defaults to get_engine(lang)).
+    :param region: Only read this (x, y, width, height) part of the page, e.g. the text area found by
+                   page_content.classify_page.
+    :return: Column dictionary (see TSV_COLUMNS) with one entry per word, in page coordinates and reading order.
+    """
+    if region is not None:
+        x, y, width, height = region
+        words = ocr_words(image[y:y + height, x:x + width], lang, tiled, band_height, workers, engine)
+        words['left'] = [left + x for left in words['left']]  # Back to page coordinates
+        words['top'] = [top + y for top in words['top']]
+        return words
+    engine = engine or get_engine(lang)
+    bands = split_into_bands(image, band_height) if tiled else []
+    if len(bands) <= 1:
+        return select_words(engine.image_to_data(image))
+
+    # Each band is small, so one tesseract thread per band is faster than letting every process use all cores
+    band_engine = engine.with_threads(1) if hasattr(engine, 'with_threads') else engine
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        band_words = list(executor.map(lambda band: _band_words(image, band, band_engine), bands))
+
+    # Every band numbers its blocks from 1; shift them so blocks stay distinct and in reading order
+    words = {column: [] for column in TSV_COLUMNS}
+    block_offset = 0
+    for band in band_words:
+        blocks = [block + block_offset for block in band['block_num']]
+        for column in TSV_COLUMNS:
+            words[column].extend(blocks if column == 'block_num' else band[column])
+        block_offset = max(blocks, default=block_offset)
+    return words
+
+
+def ocr_tiled(image, lang='eng', band_height=600, workers=None, engine=None):
+    """
+    Runs OCR on horizontal bands of the page in parallel and stitches the text back together in reading order.
+
+    :param image: The page to read (NumPy array).
+    :param lang: Tesseract language.
+    :param band_height: Target height of a band in pixels.
+    :param workers: Number of bands read at the same time (defaults to the number of CPU cores).
+    :param engine: OCR engine to use (defaults to get_engine(lang)).
+    :return: The extracted text.
+    """
+    engine = engine or get_engine(lang)
+    if len(split_into_bands(image, band_height)) == 1:
+        return engine.image_to_string(image)
+    return words_to_text(ocr_words(image, lang, True, band_height, workers, engine))
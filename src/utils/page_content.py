@@ -0,0 +1,131 @@
+from utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# What a page holds, as told by classify_page
+BLANK = 'blank'  # Nothing worth reading or keeping (blank backs, separator sheets)
+IMAGE_ONLY = 'image'  # Pictures, diagrams or handwriting strokes, but no lines of print
+TEXT = 'text'
+
+# What happens to blank pages: 'keep' them in the outputs (only their OCR is skipped) or 'drop' them
+# from the PDFs and uploads
+BLANK_PAGE_POLICIES = ('keep', 'drop')
+
+# Pages are classified at this size; a letter is then roughly 8 to 30 pixels tall
+CLASSIFY_SIDE = 1200
+# A page with fewer letter-sized marks than this has no text
+MIN_GLYPHS = 12
+# Ink covering at least this fraction of a page without text makes it an image page rather than a blank one
+MIN_IMAGE_INK = 0.01
+# Number of vertical strips the text lines are looked for in
+STRIPS = 8
+
+
+# TELL BLANK, IMAGE-ONLY AND TEXT PAGES APART
+def ink_mask(page, max_side=CLASSIFY_SIDE):
+    """
+    The dark marks of a page, shrunk so its longest side is max_side pixels.
+
+    :param page: The enhanced page: black & white, grey or BGR.
+    :return: (binary mask with 255 for ink, scale factor applied)
+    """
+    grey = cv2.cvtColor(page, cv2.COLOR_BGR2GRAY) if page.ndim == 3 else page
+    # Shrinking by a whole factor takes OpenCV's fast path, and the page ends up at most max_side pixels
+    factor = -(-max(grey.shape[:2]) // max_side)
+    if factor > 1:
+        small = cv2.resize(grey, None, fx=1 / factor, fy=1 / factor, interpolation=cv2.INTER_AREA)
+    else:
+        small = grey
+    scale = small.shape[0] / grey.shape[0]
+    sample = grey[::16, ::16]
+    if not np.count_nonzero((sample > 0) & (sample < 255)):
+        # Already black & white: shrinking turned thin strokes grey, so a light threshold keeps them
+        return cv2.threshold(small, 160, 255, cv2.THRESH_BINARY_INV)[1], scale
+    # Colour pages keep their shadows, so marks are found relative to their surroundings,
+    # plus the areas that are dark anyway (the inside of pictures)
+    marks = cv2.adaptiveThreshold(small, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 15)
+    return cv2.bitwise_or(marks, cv2.threshold(small, 60, 255, cv2.THRESH_BINARY_INV)[1]), scale
+
+
+def text_lines(glyph_rows, min_height, max_height):
+    """ Row ranges (start, end) of the text lines in a horizontal projection profile of the glyphs. """
+    inked = np.concatenate([[False], glyph_rows > 0, [False]])
+    changes = np.flatnonzero(inked[1:] != inked[:-1])
+    return [(start, end) for start, end in zip(changes[::2], changes[1::2])
+            if min_height <= end - start <= max_height]
+
+
+def classify_page(page, max_side=CLASSIFY_SIDE, margin=0.03, min_glyphs=MIN_GLYPHS, min_image_ink=MIN_IMAGE_INK):
+    """
+    Tells whether a page is blank, image-only or has text, from cheap measures of its ink (tens of milliseconds
+    for a 300 dpi page, against seconds for OCR): how much of the page is inked, how many marks have the size
+    of a letter (connected components) and whether those marks line up into text lines (horizontal projection
+    profile).
+
+    :param page: The enhanced page (see enhance_page): black & white, grey or BGR.
+    :param max_side: Longest side of the copy the page is measured on.
+    :param margin: Border left out, as a fraction of each side; warping often leaves a dark edge there.
+    :param min_glyphs: Fewest letter-sized marks on a page with text.
+    :param min_image_ink: Smallest inked fraction of an image-only page.
+    :return: Dictionary with 'kind' (BLANK, IMAGE_ONLY or TEXT), 'ink' (inked fraction), 'glyphs' (letters
+             in text lines), 'lines' (most text lines across one strip of the page) and 'text_box'
+             ((x, y, width, height) around the text in page coordinates, or None).
+    """
+    ink, scale = ink_mask(page, max_side)
+    side = max(ink.shape)  # Sizes below are relative to the measured copy
+    height, width = ink.shape
+    top, left = int(height * margin), int(width * margin)
+    ink = ink[top:height - top, left:width - left]
+
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights, widths = stats[:, cv2.CC_STAT_HEIGHT], stats[:, cv2.CC_STAT_WIDTH]
+    # Letters (and the parts of broken ones) are taller than specks and much smaller than the page
+    glyph = ((heights >= max(3, 0.004 * side)) & (heights <= 0.05 * side) & (widths <= 0.1 * side)
+             & (stats[:, cv2.CC_STAT_AREA] >= 6))
+    glyph[0] = False  # The background
+    # Pictures are large marks that fill much of their box (ruled frames and tables do not); the speckles
+    # inside them can look like letters
+    lefts, tops = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+    centres_x, centres = lefts + widths // 2, tops + heights // 2
+    picture = (heights > 0.05 * side) & (stats[:, cv2.CC_STAT_AREA] >= 0.25 * heights * widths)
+    picture[0] = False
+    for x, y, w, h, _ in stats[picture]:
+        glyph &= ~((centres_x >= x) & (centres_x < x + w) & (centres >= y) & (centres < y + h))
+    # Rows of letters make text lines. The profile is taken in narrow vertical strips, where the lines of a
+    # page that is still slightly skewed stay apart
+    glyph_mask = glyph[labels]
+    strip_width = max(1, ink.shape[1] // STRIPS)
+    strip = np.minimum(centres_x // strip_width, STRIPS - 1)
+    in_line = np.zeros_like(glyph)
+    lines = 0
+    for index in range(STRIPS):
+        x0, x1 = index * strip_width, ink.shape[1] if index == STRIPS - 1 else (index + 1) * strip_width
+        runs = text_lines(np.count_nonzero(glyph_mask[:, x0:x1], axis=1), max(3, 0.004 * side), 0.06 * side)
+        lines = max(lines, len(runs))
+        if runs:
+            starts, ends = np.array(runs).T
+            line = np.searchsorted(starts, centres, side='right') - 1
+            in_line |= (strip == index) & (line >= 0) & (centres < ends[line.clip(0)])
+    # The text area takes in every letter-sized mark, so words off the lines (page numbers, notes) are read too
+    marks = glyph.copy()
+    glyph &= in_line
+
+    glyphs = int(np.count_nonzero(glyph))
+    inked = float(np.count_nonzero(ink)) / ink.size if ink.size else 0.0
+    result = {'kind': BLANK, 'ink': round(inked, 4), 'glyphs': glyphs, 'lines': lines, 'text_box': None}
+    if glyphs >= min_glyphs:
+        result['kind'] = TEXT
+        boxes = stats[marks]
+        x0, y0 = boxes[:, 0].min(), boxes[:, 1].min()
+        x1 = (boxes[:, 0] + boxes[:, 2]).max()
+        y1 = (boxes[:, 1] + boxes[:, 3]).max()
+        # Back to page coordinates, with room for the letters' edges lost when shrinking
+        pad = 0.01 * side
+        page_height, page_width = page.shape[:2]
+        x0, y0 = max(0, int((x0 + left - pad) / scale)), max(0, int((y0 + top - pad) / scale))
+        x1, y1 = min(page_width, int((x1 + left + pad) / scale)), min(page_height, int((y1 + top + pad) / scale))
+        result['text_box'] = (x0, y0, x1 - x0, y1 - y0)
+    elif inked >= min_image_ink:
+        result['kind'] = IMAGE_ONLY
+    return result
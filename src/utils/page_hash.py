@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import threading
+import time
+
+from utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    page_id INTEGER NOT NULL REFERENCES pages (id),
+    path TEXT NOT NULL,
+    drive_id TEXT
+);
+CREATE INDEX IF NOT EXISTS outputs_page ON outputs (page_id);
+CREATE INDEX IF NOT EXISTS outputs_path ON outputs (path);
+"""
+
+# The hash keeps the signs of the 16x16 lowest frequencies of the page: 256 bits, stored as 4 words
+HASH_SIZE = 16
+HASH_WORDS = HASH_SIZE * HASH_SIZE // 64
+
+# Pages at most this many bits apart are the same page. Rescans of a page (other photo, angle, resolution,
+# lighting) differed by up to 20 bits in benchmarks.page_hash_lookup, different pages with the same layout by 70
+# or more
+DEFAULT_MAX_DISTANCE = 40
+# Side of the square copy the ink is found on; a line of text is then about 20 pixels tall
+INK_SIDE = 512
+
+
+# PERCEPTUAL HASH OF A PAGE
+def page_hash(page, size=HASH_SIZE):
+    """
+    Perceptual hash (pHash) of the ink of a warped page: the page is shrunk to INK_SIDE pixels square, its ink is
+    found relative to its surroundings, and the ink mask is shrunk to 4*size pixels square. Every bit tells
+    whether one of its size x size lowest DCT frequencies is above their median. Hashing the ink rather than the
+    brightness keeps shadows and uneven lighting out of the hash; resolution and small shifts barely change it,
+    so rescans of the same page get nearly the same hash.
+
+    :param page: The warped page (BGR or grey).
+    :return: The hash as a hexadecimal string (size * size / 4 characters).
+    """
+    grey = cv2.cvtColor(page, cv2.COLOR_BGR2GRAY) if page.ndim == 3 else page
+    grey = cv2.resize(grey, (INK_SIDE, INK_SIDE), interpolation=cv2.INTER_AREA)
+    ink = cv2.adaptiveThreshold(grey, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 10)
+    small = cv2.resize(ink, (size * 4, size * 4), interpolation=cv2.INTER_AREA).astype(np.float32)
+    frequencies = cv2.dct(small)[:size, :size].ravel()
+    # The first coefficient is the mean brightness, which would skew the median
+    return np.packbits(frequencies > np.median(frequencies[1:])).tobytes().hex()
+
+
+def hash_words(page_hash):
+    """ The hash as 64-bit words, for comparing hashes with XOR and bit counts. """
+    return np.frombuffer(bytes.fromhex(page_hash), '>u8').astype(np.uint64)
+
+
+# FIND PAGES THAT WERE SCANNED BEFORE
+class PageHashIndex:
+    def __init__(self, path='page_hashes.sqlite3', max_distance=DEFAULT_MAX_DISTANCE):
+        """
+        Remembers the perceptual hash and the outputs of every scanned page in a SQLite database, so a rescan of
+        a page can reuse the outputs (and Drive uploads) of the first scan instead of being processed again.
+        The hashes are also kept in memory, one array per 64-bit word, and a lookup compares the new hash with
+        all of them at once; that takes under a millisecond for 100 000 pages. (Document pages all look
+        alike to a perceptual hash, so trees or bucketed lookups that skip distant hashes would prune very little.)
+
+        :param path: Database file, or ':memory:' for a throwaway index.
+        :param max_distance: Largest number of differing bits between two scans of the same page.
+        """
+        # Pages are looked up by the processing workers and recorded from the main or upload threads
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._words = np.empty((HASH_WORDS, 1024), np.uint64)  # Grown by doubling
+        self._ids = np.empty(1024, np.int64)
+        self._count = 0
+        self._last_id = 0
+
+    def _refresh(self):
+        # Picks up pages recorded since the last lookup, also by other processes
+        rows = self.connection.execute("SELECT id, hash FROM pages WHERE id > ? ORDER BY id",
+                                       (self._last_id,)).fetchall()
+        if not rows:
+            return
+        count = self._count + len(rows)
+        if count > len(self._ids):
+            capacity = max(count, 2 * len(self._ids))
+            self._words = np.concatenate([self._words[:, :self._count],
+                                          np.empty((HASH_WORDS, capacity - self._count), np.uint64)], axis=1)
+            self._ids = np.concatenate([self._ids[:self._count], np.empty(capacity - self._count, np.int64)])
+        self._ids[self._count:count] = [row['id'] for row in rows]
+        self._words[:, self._count:count] = np.stack([hash_words(row['hash']) for row in rows], axis=1)
+        self._count = count
+        self._last_id = rows[-1]['id']
+
+    def _outputs(self, page_id):
+        return [{'path': row['path'], 'id': row['drive_id']} for row in self.connection.execute(
+            "SELECT path, drive_id FROM outputs WHERE page_id = ? ORDER BY rowid", (page_id,))]
+
+    # LOOKUPS
+    def find(self, page_hash):
+        """
+        Looks for an earlier scan of the page.
+
+        :param page_hash: Hash of the page (see page_hash).
+        :return: The closest earlier scan within max_distance as a dictionary with source, distance and
+                 outputs (list of {'path', 'id'}, 'id' being the Drive ID once uploaded), or None.
+        """
+        query = hash_words(page_hash)
+        with self._lock:
+            self._refresh()
+            if self._count == 0:
+                return None
+            distances = np.zeros(self._count, np.uint16)
+            for word, value in zip(self._words[:, :self._count], query):
+                distances += np.bitwise_count(word ^ value)
+            best = int(distances.argmin())
+            if distances[best] > self.max_distance:
+                return None
+            page_id = int(self._ids[best])
+            row = self.connection.execute("SELECT source FROM pages WHERE id = ?", (page_id,)).fetchone()
+            return {'page_id': page_id, 'source': row['source'], 'distance': int(distances[best]),
+                    'outputs': self._outputs(page_id)}
+
+    # UPDATES
+    def add(self, page_hash, source, outputs):
+        """
+        Records a scanned page and the files made from it.
+
+        :param page_hash: Hash of the page (see page_hash).
+        :param source: Path of the photo the page was scanned from.
+        :param outputs: Paths of the generated files.
+        :return: ID of the page.
+        """
+        with self._lock, self.connection:
+            page_id = self.connection.execute("INSERT INTO pages (hash, source, created) VALUES (?, ?, ?)",
+                                              (page_hash, source, time.time())).lastrowid
+            self.connection.executemany("INSERT INTO outputs (page_id, path) VALUES (?, ?)",
+                                        [(page_id, os.path.abspath(path)) for path in outputs])
+        return page_id
+
+    def set_drive_id(self, file_path, drive_id):
+        """ Records the Drive ID of an uploaded output, so rescans of its page need no upload either. """
+        with self._lock, self.connection:
+            return self.connection.execute("UPDATE outputs SET drive_id = ? WHERE path = ?",
+                                           (drive_id, os.path.abspath(file_path))).rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
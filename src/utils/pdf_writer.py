@@ -0,0 +1,278 @@
+import io
+import zlib
+
+from utils.lazy_import import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+POINTS_PER_INCH = 72
+A4 = (595.28, 841.89)  # Page size in points
+
+# Glyph widths of the standard Helvetica font (1/1000 em) for the printable ASCII characters, used to stretch
+# each invisible word to the width of the word on the scan
+HELVETICA_WIDTHS = dict(zip(
+    " !\"#$%&'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\]^_`abcdefghijklmnopqrstuvwxyz{|}~",
+    [278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278] + [556] * 10 +
+    [278, 278, 584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833,
+     722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556, 333, 556,
+     556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556, 556, 556, 333, 500, 278, 556,
+     500, 722, 500, 500, 500, 334, 260, 334, 584]))
+TEXT_FONT = "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"
+
+
+# Whether Pillow can write CCITT Group 4, found out on the first black & white page (see have_g4)
+_have_g4 = None
+
+
+def have_g4():
+    """ True if Pillow is installed with libtiff, which it needs to write CCITT Group 4. """
+    global _have_g4
+    if _have_g4 is None:
+        try:
+            from PIL import features
+        except ImportError:
+            _have_g4 = False
+        else:
+            _have_g4 = features.check('libtiff')
+    return _have_g4
+
+
+# DETECT BLACK & WHITE PAGES
+def is_bilevel(image):
+    """ True if the image is single-channel and contains only pure black and pure white pixels. """
+    return image.ndim == 2 and image.dtype == np.uint8 and cv2.countNonZero(cv2.inRange(image, 1, 254)) == 0
+
+
+# ENCODE A PAGE FOR THE PDF
+def encode_g4(image):
+    """
+    Compresses a black & white page with CCITT Group 4 (the fax compression used by scanners),
+    typically 10-20x smaller than PNG for text pages.
+
+    :return: (encoded bytes, PDF filter name, decode parameters) or None if Group 4 is not available.
+    """
+    if not have_g4():
+        return None
+    from PIL import Image
+    height, width = image.shape
+    buffer = io.BytesIO()
+    # A single strip, so the TIFF payload is exactly one Group 4 stream
+    Image.fromarray(image).convert('1').save(buffer, 'TIFF', compression='group4', tiffinfo={278: height})
+    tiff = Image.open(io.BytesIO(buffer.getvalue()))
+    offsets, counts = tiff.tag_v2.get(273), tiff.tag_v2.get(279)
+    if offsets is None or len(offsets) != 1:
+        return None
+    data = buffer.getvalue()[offsets[0]:offsets[0] + counts[0]]
+    # Pillow writes white as 1 ("BlackIsZero"), which PDF expresses as BlackIs1
+    return data, '/CCITTFaxDecode', f"<< /K -1 /Columns {width} /Rows {height} /BlackIs1 true >>"
+
+
+def encode_page(image, jpeg_quality=80):
+    """
+    Picks a compact encoding for the page: CCITT Group 4 or packed 1-bit Flate (whichever is smaller)
+    for black & white pages and JPEG for greyscale or colour pages.
+
+    :param image: Page as a NumPy array (greyscale or BGR).
+    :param jpeg_quality: JPEG quality for greyscale and colour pages.
+    :return: Dictionary with the encoded data and the PDF image attributes.
+    """
+    height, width = image.shape[:2]
+    if is_bilevel(image):
+        # 8 pixels per byte, deflated; clean synthetic pages sometimes compress better this way than with Group 4
+        packed = zlib.compress(np.packbits(image > 127, axis=1).tobytes(), 6)
+        encoded = {'data': packed, 'filter': '/FlateDecode', 'decode_parms': None,
+                   'width': width, 'height': height, 'color_space': '/DeviceGray', 'bits': 1}
+        g4 = encode_g4(image)
+        if g4 is not None and len(g4[0]) < len(packed):
+            encoded.update(data=g4[0], filter=g4[1], decode_parms=g4[2])
+        return encoded
+
+    ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    if not ok:
+        raise ValueError("Could not encode the page as JPEG")
+    return {'data': jpeg.tobytes(), 'filter': '/DCTDecode', 'decode_parms': None, 'width': width,
+            'height': height, 'color_space': '/DeviceGray' if image.ndim == 2 else '/DeviceRGB', 'bits': 8}
+
+
+# INVISIBLE TEXT OVER THE SCAN
+def pdf_string(text):
+    """ Encodes text as a PDF literal string in WinAnsi; characters outside it become '?'. """
+    data = text.encode('cp1252', errors='replace')
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def text_layer(words, image_size, layout, font="/F1"):
+    """
+    Builds content stream operators that place every OCR word, invisibly (text render mode 3), over its
+    position on the scan. Viewers can then search, select and copy the text of an image-only page.
+
+    :param words: OCR words with their boxes in pixels (see ocr.ocr_words).
+    :param image_size: (width, height) of the scanned image in pixels.
+    :param layout: Where the image is drawn on the page (see PdfWriter.page_layout).
+    :param font: Resource name of the Helvetica font on the page.
+    :return: Content stream bytes.
+    """
+    width, height = image_size
+    _, _, x, y, drawn_width, drawn_height = layout
+    scale_x, scale_y = drawn_width / width, drawn_height / height
+    content = [b"BT 3 Tr"]
+    for i, word in enumerate(words['text']):
+        word = word.strip()
+        box_width, box_height = words['width'][i] * scale_x, words['height'][i] * scale_y
+        if not word or box_width <= 0 or box_height <= 0:
+            continue
+        size = box_height
+        text_width = sum(HELVETICA_WIDTHS.get(char, 556) for char in word) * size / 1000
+        # Baseline at the bottom of the box; PDF y grows upwards while image rows grow downwards
+        left = x + words['left'][i] * scale_x
+        bottom = y + (height - words['top'][i] - words['height'][i]) * scale_y
+        # The trailing space lets viewers copy the words of a line with spaces in between
+        content.append(f"{font} {size:.2f} Tf {100 * box_width / text_width:.1f} Tz "
+                       f"1 0 0 1 {left:.2f} {bottom:.2f} Tm ".encode() + pdf_string(word + " ") + b" Tj")
+    content.append(b"ET\n")
+    return b"\n".join(content)
+
+
+# WRITE MANY PAGES INTO ONE PDF
+class PdfWriter:
+    def __init__(self, file, dpi=200, paper_size=None, margin=28.35):
+        """
+        Writes a multi-page PDF page by page. Every page is encoded and written to the file as soon as it
+        is added, so memory use does not grow with the number of pages and no temporary files are needed.
+
+        :param file: Output path or a binary file object.
+        :param dpi: Resolution of the scans, used to size the pages when paper_size is None.
+        :param paper_size: (width, height) in points, e.g. pdf_writer.A4, to fit every page onto that paper;
+                           None makes each page exactly the size of its image.
+        :param margin: Margin in points around the image when paper_size is set (default 10 mm).
+        """
+        self._own_file = isinstance(file, (str, bytes)) or hasattr(file, '__fspath__')
+        self.file = open(file, 'wb') if self._own_file else file
+        self.dpi = dpi
+        self.paper_size = paper_size
+        self.margin = margin
+        self.offsets = {}  # Object number -> byte offset, for the cross-reference table
+        self.page_ids = []
+        self.position = 0
+        # Objects 1 (catalog) and 2 (page tree) are written last, once all pages are known
+        self.next_id = 3
+        self.closed = False
+        self.font_id = None  # Written together with the first searchable page
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.file.write(data)
+        self.position += len(data)
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def _write_object(self, object_id, body, stream=None):
+        self.offsets[object_id] = self.position
+        self._write(f"{object_id} 0 obj\n".encode())
+        if stream is None:
+            self._write(body.encode() + b"\nendobj\n")
+        else:
+            self._write(body.encode() + b"\nstream\n")
+            self._write(stream)
+            self._write(b"\nendstream\nendobj\n")
+
+    def page_layout(self, width, height):
+        """ Returns (page width, page height, x, y, drawn width, drawn height) in points for an image. """
+        image_width = width * POINTS_PER_INCH / self.dpi
+        image_height = height * POINTS_PER_INCH / self.dpi
+        if self.paper_size is None:
+            return image_width, image_height, 0, 0, image_width, image_height
+        paper_width, paper_height = self.paper_size
+        scale = min((paper_width - 2 * self.margin) / image_width, (paper_height - 2 * self.margin) / image_height)
+        drawn_width, drawn_height = image_width * scale, image_height * scale
+        # Centred horizontally, aligned to the top margin (PDF coordinates start at the bottom left)
+        x = (paper_width - drawn_width) / 2
+        y = paper_height - self.margin - drawn_height
+        return paper_width, paper_height, x, y, drawn_width, drawn_height
+
+    def add_page(self, image, jpeg_quality=80, extra_content=b"", extra_resources=""):
+        """
+        Encodes an image and appends it as a new page.
+
+        :param image: Page as a NumPy array (greyscale, black & white or BGR).
+        :param jpeg_quality: JPEG quality for greyscale and colour pages.
+        :param extra_content: Additional content stream operators drawn after the image (e.g. a text layer).
+        :param extra_resources: Additional entries for the page's /Resources dictionary.
+        :return: The page layout (see page_layout).
+        """
+        if self.closed:
+            raise ValueError("Cannot add pages to a closed PdfWriter")
+        encoded = encode_page(image, jpeg_quality)
+        layout = self.page_layout(encoded['width'], encoded['height'])
+        page_width, page_height, x, y, drawn_width, drawn_height = layout
+
+        image_id = self._new_id()
+        decode = f" /DecodeParms {encoded['decode_parms']}" if encoded['decode_parms'] else ""
+        self._write_object(image_id, f"<< /Type /XObject /Subtype /Image /Width {encoded['width']} "
+                                     f"/Height {encoded['height']} /ColorSpace {encoded['color_space']} "
+                                     f"/BitsPerComponent {encoded['bits']} /Filter {encoded['filter']}{decode} "
+                                     f"/Length {len(encoded['data'])} >>", encoded['data'])
+
+        content = f"q {drawn_width:.2f} 0 0 {drawn_height:.2f} {x:.2f} {y:.2f} cm /Im0 Do Q\n".encode() + extra_content
+        content = zlib.compress(content)
+        content_id = self._new_id()
+        self._write_object(content_id, f"<< /Length {len(content)} /Filter /FlateDecode >>", content)
+
+        page_id = self._new_id()
+        self._write_object(page_id, f"<< /Type /Page /Parent 2 0 R "
+                                    f"/MediaBox [0 0 {page_width:.2f} {page_height:.2f}] "
+                                    f"/Resources << /XObject << /Im0 {image_id} 0 R >> {extra_resources}>> "
+                                    f"/Contents {content_id} 0 R >>")
+        self.page_ids.append(page_id)
+        self.file.flush()
+        return layout
+
+    def add_searchable_page(self, image, words, jpeg_quality=80):
+        """
+        Appends a page with an invisible OCR text layer over the scan, so the PDF can be searched
+        and its text copied, without running OCR again.
+
+        :param image: Page as a NumPy array.
+        :param words: OCR words with their boxes in image pixels (see ocr.ocr_words).
+        :param jpeg_quality: JPEG quality for greyscale and colour pages.
+        :return: The page layout (see page_layout).
+        """
+        if self.font_id is None:
+            self.font_id = self.add_object(TEXT_FONT)
+        height, width = image.shape[:2]
+        layer = text_layer(words, (width, height), self.page_layout(width, height))
+        return self.add_page(image, jpeg_quality, extra_content=layer,
+                             extra_resources=f"/Font << /F1 {self.font_id} 0 R >> ")
+
+    def add_object(self, body, stream=None):
+        """ Writes a shared object (e.g. a font) once and returns its object number. """
+        object_id = self._new_id()
+        self._write_object(object_id, body, stream)
+        return object_id
+
+    def close(self):
+        """ Writes the page tree, catalog and cross-reference table, and closes the file if we opened it. """
+        if self.closed:
+            return
+        self.closed = True
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>")
+        self._write_object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_position = self.position
+        self._write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode())
+        for object_id in range(1, self.next_id):
+            self._write(f"{self.offsets[object_id]:010d} 00000 n \n".encode())
+        self._write(f"trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref_position}\n%%EOF\n".encode())
+        self.file.flush()
+        if self._own_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,256 @@
+import os
+import time
+
+from utils.lazy_import import lazy_import
+from utils.cache import content_key, derived_key
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+
+# A SINGLE PROCESSING STEP
+class Stage:
+    def __init__(self, name, func, inputs, output, preview=None, cacheable=True, version=1, **params):
+        """
+        Wraps a pure function so it can be chained in a Pipeline.
+
+        :param name: Name of the stage, used by observers (e.g. as the preview window title).
+        :param func: Pure function that takes the input values (and params) and returns the output value.
+        :param inputs: Names of the context values passed positionally to func.
+        :param output: Name under which the result is stored in the context.
+        :param preview: Optional function (context -> image) used by observers to visualise the stage.
+                        By default the stage output itself is shown.
+        :param cacheable: Whether the output may be stored in the pipeline's ResultCache.
+                          Cheap or very large intermediates (e.g. edge maps) are better recomputed.
+        :param version: Bump when the function's built-in constants change, so old cached results are not reused.
+        :param params: Extra keyword arguments passed to func on every run.
+        """
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.output = output
+        self.preview = preview
+        self.cacheable = cacheable
+        self.version = version
+        self.params = params
+
+    def run(self, context):
+        """ Calls the stage function on the values it needs from the context. """
+        args = [context[name] for name in self.inputs]
+        return self.func(*args, **self.params)
+
+    def cache_key(self, keys):
+        """ Key of this stage's output: derived from the stage definition and the keys of its inputs. """
+        return derived_key(self.name, f"{self.func.__module__}.{self.func.__qualname__}", self.version,
+                           sorted(self.params.items()), [keys[name] for name in self.inputs])
+
+    def preview_image(self, context):
+        """ Returns the image that best shows what this stage produced. """
+        if self.preview is not None:
+            return self.preview(context)
+        return context[self.output]
+
+
+# CHAINING STAGES WITH OPTIONAL OBSERVERS
+class Pipeline:
+    def __init__(self, stages=(), observers=(), cache=None, keep=None):
+        """
+        Runs stages in order over a shared context of named values.
+        Observers (previews, debug dumps, timing) are notified after every stage but never change the data,
+        so the same pipeline runs at full speed headless and with previews on the desktop.
+
+        :param stages: Stage objects to run in order.
+        :param observers: Objects implementing on_stage_start(stage, context), on_stage_end(stage, context, seconds)
+                          and/or on_stage_error(stage, context, error).
+        :param cache: Optional ResultCache. Outputs are keyed by the content of the initial inputs plus the
+                      definitions of the stages that produced them, so unchanged pages are not recomputed.
+        :param keep: Names of the values to return. If given, every other value (the initial inputs too) is
+                     dropped from the context as soon as the last stage that needs it has run, so large
+                     intermediate images are freed early. None returns everything.
+        """
+        self.stages = list(stages)
+        self.observers = list(observers)
+        self.cache = cache
+        self.keep = set(keep) if keep is not None else None
+
+    def add_stage(self, stage):
+        self.stages.append(stage)
+        return self
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+        return self
+
+    def __add__(self, other):
+        """ Concatenates two pipelines; the observers of both are kept, and the kept values of both (if any). """
+        observers = self.observers + [o for o in other.observers if o not in self.observers]
+        keep = self.keep | other.keep if self.keep is not None and other.keep is not None else None
+        return Pipeline(self.stages + other.stages, observers, self.cache or other.cache, keep)
+
+    def run(self, **context):
+        """
+        Runs every stage and returns the context with all intermediate results.
+        Stages whose output is already given in the context are skipped, so a pipeline can be
+        entered part-way, e.g. with a document_contour that was found during live capture.
+
+        :param context: Initial named values, e.g. image=<array>.
+        :return: Dictionary of all values produced by the pipeline.
+        """
+        keys, cached, needed = self._plan(context) if self.cache is not None else ({}, {}, None)
+        releases = self._releases(context) if self.keep is not None else {}
+        for index, stage in enumerate(self.stages):
+            self._run_stage(stage, context, keys, cached, needed)
+            for name in releases.get(index, ()):
+                context.pop(name, None)
+        return context
+
+    def _run_stage(self, stage, context, keys, cached, needed):
+        if stage.output in context:
+            return
+        if stage.output in cached:
+            context[stage.output] = cached[stage.output]
+            self._notify('on_stage_end', stage, context, 0.0)
+            return
+        if needed is not None and stage.output not in needed:
+            return  # Only fed stages whose results came from the cache
+        self._notify('on_stage_start', stage, context)
+        start = time.perf_counter()
+        try:
+            context[stage.output] = stage.run(context)
+        except Exception as e:
+            self._notify('on_stage_error', stage, context, e)
+            raise
+        seconds = time.perf_counter() - start
+        if self.cache is not None and stage.cacheable:
+            self.cache.put(keys[stage.output], context[stage.output])
+        self._notify('on_stage_end', stage, context, seconds)
+
+    def _releases(self, context):
+        """ Maps the index of a stage to the values that are not needed anymore once it has run. """
+        last_use = {name: 0 for name in context}
+        for index, stage in enumerate(self.stages):
+            last_use[stage.output] = max(last_use.get(stage.output, index), index)
+            for name in stage.inputs:
+                last_use[name] = index
+        releases = {}
+        for name, index in last_use.items():
+            if name not in self.keep:
+                releases.setdefault(index, []).append(name)
+        return releases
+
+    def _plan(self, context):
+        """
+        Looks up cached outputs before anything runs.
+        :return: (cache key of every value, cached outputs, names of the outputs that must be computed)
+        """
+        keys = {name: content_key(value) for name, value in context.items()}
+        for stage in self.stages:
+            if stage.output not in keys:
+                keys[stage.output] = stage.cache_key(keys)
+
+        # Every cacheable result and the final result are wanted; walking backwards, a cache hit
+        # means the inputs of that stage do not have to be computed at all
+        wanted = {stage.output for stage in self.stages if stage.cacheable}
+        if self.stages:
+            wanted.add(self.stages[-1].output)
+        cached, needed = {}, set()
+        for stage in reversed(self.stages):
+            if stage.output in context or stage.output not in wanted | needed:
+                continue
+            if stage.cacheable:
+                value = self.cache.get(keys[stage.output])
+                if value is not None:
+                    cached[stage.output] = value
+                    continue
+            needed.add(stage.output)
+            needed.update(stage.inputs)
+        return keys, cached, needed
+
+    def _notify(self, event, *args):
+        for observer in self.observers:
+            handler = getattr(observer, event, None)
+            if handler is not None:
+                handler(*args)
+
+
+# OBSERVERS
+class PreviewObserver:
+    def __init__(self, stages=None, wait=True):
+        """
+        Shows the result of each stage in an OpenCV window.
+
+        :param stages: Names of the stages to preview; None previews all of them.
+        :param wait: Block until a key is pressed (True) or just refresh the window (False).
+        """
+        self.stages = set(stages) if stages is not None else None
+        self.wait = wait
+
+    def on_stage_end(self, stage, context, seconds):
+        if self.stages is not None and stage.name not in self.stages:
+            return
+        image = stage.preview_image(context)
+        if not isinstance(image, np.ndarray):
+            return  # Nothing to show for text and other non-image results
+        cv2.imshow(stage.name, image)
+        if self.wait:
+            cv2.waitKey(0)  # the image window stays open until a key is pressed
+            cv2.destroyAllWindows()
+        else:
+            cv2.waitKey(1)
+
+
+class RecordingObserver:
+    def __init__(self):
+        """
+        Records every finished stage, so a pipeline can run on a worker thread and its previews be shown
+        later on the UI thread (OpenCV windows must not be opened from other threads), by replaying them.
+        """
+        self.events = []
+
+    def on_stage_end(self, stage, context, seconds):
+        self.events.append((stage, dict(context), seconds))
+
+    def replay(self, observers):
+        """ Passes the recorded stages to the on_stage_end of the given observers, in their original order. """
+        for stage, context, seconds in self.events:
+            for observer in observers:
+                handler = getattr(observer, 'on_stage_end', None)
+                if handler is not None:
+                    handler(stage, context, seconds)
+
+
+class DebugDumpObserver:
+    def __init__(self, directory, prefix=""):
+        """
+        Writes the result of each stage as a PNG file, numbered in execution order.
+
+        :param directory: Directory for the dumped images (created if missing).
+        :param prefix: Prepended to every file name, e.g. the name of the source image.
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.counter = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def on_stage_end(self, stage, context, seconds):
+        self.counter += 1
+        image = stage.preview_image(context)
+        if not isinstance(image, np.ndarray):
+            return  # Only images are dumped
+        file_name = f"{self.prefix}{self.counter:02d}_{stage.name.lower().replace(' ', '_')}.png"
+        cv2.imwrite(os.path.join(self.directory, file_name), image)
+
+
+class TimingObserver:
+    def __init__(self):
+        """ Records how long every stage took, in seconds. """
+        self.timings = {}
+
+    def on_stage_end(self, stage, context, seconds):
+        self.timings[stage.name] = self.timings.get(stage.name, 0.0) + seconds
+
+    def report(self):
+        """ Returns a human-readable table of the recorded timings. """
+        lines = [f"{name:20} {seconds * 1000:9.1f} ms" for name, seconds in self.timings.items()]
+        lines.append(f"{'total':20} {sum(self.timings.values()) * 1000:9.1f} ms")
+        return "\n".join(lines)
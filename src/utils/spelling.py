@@ -0,0 +1,209 @@
+import os
+import re
+import zlib
+
+from utils.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+# Corrections are at most this many edits (insertions, deletions, substitutions, swaps) away from the word read
+MAX_EDIT_DISTANCE = 2
+# Only the start of a word is indexed; the rest is checked when the candidates are compared
+PREFIX_LENGTH = 7
+# Tesseract confidence (0-100) from which a word is trusted as read and never corrected
+MIN_CONFIDENCE = 70
+
+# Punctuation before the word, the word, punctuation after it
+TOKEN = re.compile(r"^(\W*)(.*?)(\W*)$")
+# Only words made of letters (with an apostrophe, as in "don't") are corrected, never numbers or codes
+CORRECTABLE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+
+def deletes(word, max_distance):
+    """ Every string made by deleting up to max_distance characters from word (the word itself included). """
+    found = {word}
+    layer = {word}
+    for _ in range(max_distance):
+        layer = {candidate[:i] + candidate[i + 1:] for candidate in layer for i in range(len(candidate))} - found
+        found |= layer
+    return found
+
+
+def _key(text):
+    return zlib.crc32(text.encode())
+
+
+def edit_distance(a, b, limit):
+    """ Optimal string alignment distance between a and b, or limit + 1 as soon as it is known to be larger. """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before_previous, previous = None, list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def read_frequencies(path):
+    """
+    Reads a word frequency list: one 'word count' pair per line (e.g. SymSpell's frequency dictionaries or
+    TextBlob's en-spelling.txt); lines starting with ';' or '#' are comments.
+
+    :return: Dictionary of lowercase word -> count.
+    """
+    counts = {}
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) < 2 or fields[0].startswith((';', '#')) or not fields[1].isdigit():
+                continue
+            word = fields[0].lower()
+            counts[word] = counts.get(word, 0) + int(fields[1])
+    return counts
+
+
+def read_terms(path):
+    """ Reads protected terms (names, course codes, ...): one per line, '#' starts a comment. """
+    with open(path, encoding='utf-8') as file:
+        return [line.split('#', 1)[0].strip() for line in file if line.split('#', 1)[0].strip()]
+
+
+# SYMMETRIC DELETE SPELLING CORRECTION
+class SpellChecker:
+    def __init__(self, words, counts, keys, entries, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH,
+                 protected=()):
+        """
+        Spelling correction with a precomputed symmetric delete index (as in SymSpell): every dictionary word is
+        indexed under all the strings made by deleting up to max_distance characters from its start, so the
+        candidates for a misspelling are found by looking up its own deletions, without generating every
+        possible edit. The index is a pair of sorted arrays that load from a single .npz file (see load and save).
+        Build a checker with build() or load(), not directly.
+
+        :param protected: Terms that are never corrected (names, course codes, ...), matched case-insensitively.
+        """
+        self.words = words
+        self.counts = counts
+        self.keys = keys
+        self.entries = entries
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.lookup = {word: i for i, word in enumerate(words)}
+        self.protected = {term.lower() for term in protected}
+        # Identifies the dictionary and the protected terms in pipeline cache keys
+        self.fingerprint = zlib.crc32("\n".join(sorted(self.protected)).encode(), zlib.crc32("\n".join(words).encode()))
+
+    @classmethod
+    def build(cls, word_counts, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH, protected=()):
+        """
+        Builds the index from word frequencies (a few seconds for 100 000 words; save it to load it instantly).
+
+        :param word_counts: Dictionary of word -> how common it is (see read_frequencies).
+        """
+        words = sorted(word_counts, key=lambda word: (-word_counts[word], word))
+        pairs = {(_key(delete), i) for i, word in enumerate(words)
+                 for delete in deletes(word[:prefix_length], max_distance)}
+        index = np.array(sorted(pairs), dtype=np.uint32).reshape(-1, 2)
+        counts = np.array([word_counts[word] for word in words], dtype=np.uint64)
+        return cls(words, counts, index[:, 0].copy(), index[:, 1].copy(), max_distance, prefix_length, protected)
+
+    @classmethod
+    def load(cls, path, protected=()):
+        """ Loads a checker saved with save(). """
+        with np.load(path) as data:
+            words = bytes(data['words']).decode('utf-8').split('\n')
+            max_distance, prefix_length = (int(value) for value in data['settings'])
+            return cls(words, data['counts'], data['keys'], data['entries'], max_distance, prefix_length, protected)
+
+    @classmethod
+    def from_environment(cls):
+        """
+        The dictionary in $SCANNER_SPELLING_DICTIONARY, with the terms in $SCANNER_PROTECTED_TERMS protected,
+        if the dictionary is set; else None (no spelling correction).
+        """
+        path = os.environ.get('SCANNER_SPELLING_DICTIONARY')
+        if not path:
+            return None
+        terms = os.environ.get('SCANNER_PROTECTED_TERMS')
+        return cls.load(path, read_terms(terms) if terms else ())
+
+    def save(self, path):
+        """ Saves the dictionary and its index as one uncompressed .npz file, which loads in milliseconds. """
+        np.savez(path, words=np.frombuffer("\n".join(self.words).encode('utf-8'), np.uint8), counts=self.counts,
+                 keys=self.keys, entries=self.entries, settings=np.array([self.max_distance, self.prefix_length]))
+
+    def __repr__(self):
+        return f"SpellChecker({len(self.words)} words, {self.fingerprint:08x})"
+
+    # LOOKUPS
+    def suggest(self, word, max_distance=None):
+        """
+        The most common dictionary word closest to word (lowercase), or None if there is none within max_distance.
+        A word that is in the dictionary is its own suggestion.
+        """
+        if word in self.lookup:
+            return word
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        queries = np.array([_key(delete) for delete in deletes(word[:self.prefix_length], max_distance)], np.uint32)
+        starts = np.searchsorted(self.keys, queries, 'left')
+        ends = np.searchsorted(self.keys, queries, 'right')
+        candidates = {int(i) for start, end in zip(starts, ends) if end > start for i in self.entries[start:end]}
+        best, best_distance = None, max_distance + 1
+        # Candidates are most common first, so on equal distance the most common word wins,
+        # and the first word one edit away is the answer
+        for i in sorted(candidates):
+            distance = edit_distance(word, self.words[i], best_distance - 1)
+            if distance < best_distance:
+                best, best_distance = self.words[i], distance
+                if distance == 1:
+                    break
+        return best
+
+    def correct_token(self, token, capitalised_allowed=True):
+        """
+        Corrects one word as read by OCR, keeping its punctuation and capitalisation.
+        Protected terms, short words, words with digits and acronyms are returned unchanged,
+        and so are capitalised words (likely names) unless capitalised_allowed.
+        """
+        before, word, after = TOKEN.match(token).groups()
+        if len(word) < 3 or not CORRECTABLE.fullmatch(word) or word.isupper() or word.lower() in self.protected:
+            return token
+        if word[0].isupper() and not capitalised_allowed:
+            return token
+        # Short words have many neighbours, so only allow a single edit for them
+        suggestion = self.suggest(word.lower(), 1 if len(word) <= 4 else None)
+        if suggestion is None or suggestion == word.lower():
+            return token
+        if word[0].isupper():
+            suggestion = suggestion[0].upper() + suggestion[1:]
+        return before + suggestion + after
+
+    def correct_words(self, words, min_confidence=MIN_CONFIDENCE):
+        """
+        Corrects the words Tesseract was unsure about (confidence below min_confidence); the rest are kept as read.
+        Capitalised words are only corrected at the start of a sentence, elsewhere they are likely names.
+
+        :param words: Column dictionary of words (see ocr.select_words).
+        :return: A copy of words with the corrected text.
+        """
+        texts = list(words['text'])
+        previous_paragraph = None
+        sentence_start = True
+        for i, text in enumerate(texts):
+            paragraph = (words['block_num'][i], words['par_num'][i])
+            sentence_start = sentence_start or paragraph != previous_paragraph
+            if 0 <= words['conf'][i] < min_confidence:
+                texts[i] = self.correct_token(text, capitalised_allowed=sentence_start)
+            sentence_start = text.endswith(('.', '!', '?'))
+            previous_paragraph = paragraph
+        return {**words, 'text': texts}
+
+
+def correct_spelling(words, spell_checker, min_confidence=MIN_CONFIDENCE):
+    """ Pipeline stage: the OCR words with the low-confidence ones corrected (see SpellChecker.correct_words). """
+    return spell_checker.correct_words(words, min_confidence)
@@ -0,0 +1,182 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+# Databases the app keeps between runs live in a per-user directory rather than wherever it was started from
+APP_NAME = 'study-organizer'
+
+# The text lives once in `pages`; `pages_text` is an FTS5 index over it, kept in step by the triggers
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    document_id TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    source TEXT,
+    file_path TEXT,
+    drive_id TEXT,
+    text TEXT NOT NULL,
+    updated REAL NOT NULL,
+    UNIQUE (document_id, page)
+);
+CREATE INDEX IF NOT EXISTS pages_file ON pages (file_path);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_text USING fts5(
+    text, content='pages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS pages_inserted AFTER INSERT ON pages BEGIN
+    INSERT INTO pages_text (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS pages_deleted AFTER DELETE ON pages BEGIN
+    INSERT INTO pages_text (pages_text, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS pages_updated AFTER UPDATE OF text ON pages WHEN old.text IS NOT new.text BEGIN
+    INSERT INTO pages_text (pages_text, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO pages_text (rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+# A new OCR result replaces the text; the other fields are only replaced when given
+UPSERT = """
+INSERT INTO pages (document_id, page, source, file_path, drive_id, text, updated) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (document_id, page) DO UPDATE SET
+    text = excluded.text, updated = excluded.updated, source = COALESCE(excluded.source, source),
+    file_path = COALESCE(excluded.file_path, file_path), drive_id = COALESCE(excluded.drive_id, drive_id)
+"""
+
+SEARCH = """
+SELECT pages.document_id, pages.page, pages.source, pages.file_path, pages.drive_id, pages_text.rank AS score,
+       snippet(pages_text, 0, '[', ']', '...', 12) AS snippet
+FROM pages_text JOIN pages ON pages.id = pages_text.rowid
+WHERE pages_text MATCH ?
+ORDER BY pages_text.rank
+LIMIT ? OFFSET ?
+"""
+
+
+def match_expression(query):
+    """
+    Turns what the user typed into an FTS5 query: every word must occur (in any order), and a word ending
+    in * matches any word starting with it. Quoting the words keeps FTS5 operators and punctuation from
+    being interpreted, so any input is a valid query.
+
+    :return: The MATCH expression, or None if the query has no words.
+    """
+    terms = [f'"{word}"{"*" if star else ""}' for word, star in re.findall(r'(\w+)(\*?)', query)]
+    return " ".join(terms) or None
+
+
+def user_data_dir():
+    """
+    Per-user directory for the app's databases, created if needed: $SCANNER_DATA_DIR if it is set, else the
+    platform's data directory (%APPDATA%, ~/Library/Application Support or $XDG_DATA_HOME / ~/.local/share).
+    """
+    directory = os.environ.get('SCANNER_DATA_DIR')
+    if not directory:
+        if sys.platform == 'win32':
+            base = os.environ.get('APPDATA') or os.path.expanduser('~')
+        elif sys.platform == 'darwin':
+            base = os.path.expanduser('~/Library/Application Support')
+        else:
+            base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+        directory = os.path.join(base, APP_NAME)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def default_index_path():
+    """ Where the full-text index is kept unless another file is given. """
+    return os.path.join(user_data_dir(), 'ocr_index.sqlite3')
+
+
+# SEARCHABLE INDEX OF THE OCR TEXT
+class TextIndex:
+    def __init__(self, path=None):
+        """
+        Keeps the OCR text of every scanned page in a local SQLite database with an FTS5 full-text index,
+        along with the document it belongs to, its source image, the generated file and its Drive ID.
+        Pages are added one at a time as they are scanned; searches are ranked with BM25 and take
+        milliseconds even across tens of thousands of pages.
+
+        :param path: Database file, or ':memory:' for a throwaway index. Defaults to default_index_path().
+        """
+        if path is None:
+            path = default_index_path()
+        # Pages are added from the UI thread and from upload threads
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    # UPDATES
+    def add(self, document_id, text, page=1, source=None, file_path=None, drive_id=None):
+        """
+        Adds the text of a page, or replaces it if the page is already indexed (e.g. after a manual review).
+
+        :param document_id: Identifies the document, e.g. the path of the source image.
+        :param text: The OCR text of the page.
+        :param page: Page number within the document, starting at 1.
+        :param source: Path of the photo the page was scanned from.
+        :param file_path: Path of the generated file (e.g. the PDF), used to attach the Drive ID on upload.
+        :param drive_id: Drive ID of the uploaded file, if already known.
+        """
+        self.add_many([(document_id, text, page, source, file_path, drive_id)])
+
+    def add_many(self, pages):
+        """ Adds many pages in one transaction; pages are (document_id, text, page, source, file_path, drive_id). """
+        now = time.time()
+        rows = [(document_id, page, source, file_path and os.path.abspath(file_path), drive_id, text, now)
+                for document_id, text, page, source, file_path, drive_id in pages]
+        with self._lock, self.connection:
+            self.connection.executemany(UPSERT, rows)
+
+    def set_drive_id(self, file_path, drive_id):
+        """
+        Records the Drive ID of an uploaded file on the pages generated into it.
+
+        :return: Number of pages updated.
+        """
+        with self._lock, self.connection:
+            return self.connection.execute("UPDATE pages SET drive_id = ? WHERE file_path = ?",
+                                           (drive_id, os.path.abspath(file_path))).rowcount
+
+    def remove(self, document_id):
+        """ Removes all pages of a document. """
+        with self._lock, self.connection:
+            return self.connection.execute("DELETE FROM pages WHERE document_id = ?", (document_id,)).rowcount
+
+    def optimize(self):
+        """ Merges the index segments written by many small updates, which keeps searches fast. """
+        with self._lock, self.connection:
+            self.connection.execute("INSERT INTO pages_text (pages_text) VALUES ('optimize')")
+
+    # QUERIES
+    def search(self, query, limit=20, offset=0):
+        """
+        Finds the pages containing every word of the query, best matches first.
+
+        :param query: Words to look for; 'photosynth*' matches every word starting with 'photosynth'.
+        :return: List of dictionaries with document_id, page, source, file_path, drive_id, score (lower is
+                 better) and snippet (the matching text, with the words in [brackets]).
+        """
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        with self._lock:
+            return [dict(row) for row in self.connection.execute(SEARCH, (expression, limit, offset))]
+
+    def text(self, document_id, page=1):
+        """ The indexed text of a page, or None. """
+        with self._lock:
+            row = self.connection.execute("SELECT text FROM pages WHERE document_id = ? AND page = ?",
+                                          (document_id, page)).fetchone()
+        return row[0] if row else None
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,267 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the Prometheus duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# ONE TIMED STEP
+class Span:
+    def __init__(self, name, trace_id, span_id, parent_id, attributes):
+        """ A timed step of the work, e.g. a state transition of the app or a pipeline stage. Created by Tracer. """
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.outcome = 'ok'
+        self.error = None
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.memory_start = None
+        self.memory_peak = 0
+        self.allocated_bytes = None
+        self.peak_bytes = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def set_image(self, image, prefix='image'):
+        """ Records the dimensions of an image (NumPy array); anything else is ignored. """
+        shape = getattr(image, 'shape', None)
+        if shape is not None and len(shape) >= 2:
+            self.attributes[f"{prefix}_width"] = int(shape[1])
+            self.attributes[f"{prefix}_height"] = int(shape[0])
+            self.attributes[f"{prefix}_channels"] = int(shape[2]) if len(shape) > 2 else 1
+        return self
+
+    def fail(self, error):
+        """ Marks the span as failed; error is an exception or a message. """
+        self.outcome = 'error'
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+        return self
+
+    def to_dict(self):
+        return {'name': self.name, 'trace_id': self.trace_id, 'span_id': self.span_id,
+                'parent_id': self.parent_id, 'start_time': round(self.start_time, 6),
+                'duration_seconds': round(self.duration, 6) if self.duration is not None else None,
+                'outcome': self.outcome, 'error': self.error, 'allocated_bytes': self.allocated_bytes,
+                'peak_bytes': self.peak_bytes, 'attributes': self.attributes}
+
+
+# COLLECTING AND EXPORTING SPANS
+class Tracer:
+    def __init__(self, jsonl_path=None, prometheus_path=None, trace_memory=True, keep=1000):
+        """
+        Records spans: how long each step took, how much memory it allocated and whether it failed.
+        Finished spans are appended to a JSON lines file, and aggregated per span name into a Prometheus
+        textfile (for node_exporter's textfile collector), rewritten whenever a top-level span ends.
+
+        :param jsonl_path: File to append finished spans to, or None.
+        :param prometheus_path: Prometheus textfile to write the aggregated metrics to, or None.
+        :param trace_memory: Measure allocations with tracemalloc (adds some overhead to Python allocations;
+                             NumPy arrays are included, OpenCV's internal buffers are not). Peaks are
+                             approximate while spans run on several threads at once.
+        :param keep: Number of finished spans kept in memory (see finished).
+        """
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.trace_memory = trace_memory
+        self.finished = deque(maxlen=keep)
+        self.metrics = {}  # Span name -> aggregated values
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        for path in (jsonl_path, prometheus_path):
+            if path and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @classmethod
+    def from_environment(cls):
+        """ Exports to spans.jsonl and scanner.prom in $SCANNER_TRACE_DIR if it is set; else keeps spans in memory. """
+        directory = os.environ.get('SCANNER_TRACE_DIR')
+        if not directory:
+            return cls(trace_memory=False)
+        return cls(os.path.join(directory, 'spans.jsonl'), os.path.join(directory, 'scanner.prom'))
+
+    @property
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self):
+        """ The innermost open span of this thread, or None. """
+        return self._stack[-1] if self._stack else None
+
+    def _fold_memory_peak(self):
+        # tracemalloc has a single peak; fold it into every open span before it is reset,
+        # so nested spans each get their own peak
+        if not (self.trace_memory and tracemalloc.is_tracing()):
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        for span in self._stack:
+            span.memory_peak = max(span.memory_peak, peak)
+        tracemalloc.reset_peak()
+        return current
+
+    def start_span(self, name, **attributes):
+        """ Opens a span as a child of the current one. Close it with end_span (or use span()). """
+        parent = self.current()
+        span_id = os.urandom(8).hex()
+        span = Span(name, parent.trace_id if parent else span_id, span_id, parent.span_id if parent else None,
+                    attributes)
+        span.memory_start = self._fold_memory_peak()
+        self._stack.append(span)
+        return span
+
+    def end_span(self, span, error=None):
+        """ Closes a span (and any span left open inside it), recording its duration, memory and outcome. """
+        if error is not None:
+            span.fail(error)
+        memory_now = self._fold_memory_peak()
+        self.detach(span)
+        span.duration = time.perf_counter() - span.start
+        if memory_now is not None and span.memory_start is not None:
+            span.allocated_bytes = memory_now - span.memory_start
+            span.peak_bytes = max(span.memory_peak - span.memory_start, 0)
+        self._record(span)
+        if not self._stack:
+            self.write_prometheus()
+
+    def detach(self, span):
+        """
+        Takes an open span (and any span left open inside it) off this thread's stack without ending it,
+        so it can be ended later, e.g. once work it handed to other threads has finished.
+        """
+        stack = self._stack
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index] is span:
+                del stack[index:]
+                return
+
+    @contextmanager
+    def within(self, span):
+        """
+        Makes an open span the current one of this thread while the block runs, without ending it,
+        so the spans of work handed to a worker thread become its children. None runs the block as it is.
+        """
+        if span is None:
+            yield None
+            return
+        self._stack.append(span)
+        try:
+            yield span
+        finally:
+            self.detach(span)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """ Context manager around start_span/end_span; an exception marks the span as failed and is re-raised. """
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            self.end_span(span)
+
+    def fail(self, error):
+        """ Marks the current span as failed, for errors that are handled (e.g. shown to the user), not raised. """
+        span = self.current()
+        if span is not None:
+            span.fail(error)
+
+    def _record(self, span):
+        with self._lock:
+            self.finished.append(span)
+            metric = self.metrics.setdefault(span.name, {'outcomes': {}, 'duration_sum': 0.0,
+                                                         'buckets': [0] * len(DURATION_BUCKETS), 'count': 0,
+                                                         'allocated_bytes': 0, 'peak_bytes': 0})
+            metric['outcomes'][span.outcome] = metric['outcomes'].get(span.outcome, 0) + 1
+            metric['count'] += 1
+            metric['duration_sum'] += span.duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    metric['buckets'][i] += 1
+            if span.allocated_bytes is not None:
+                metric['allocated_bytes'] += max(span.allocated_bytes, 0)
+                metric['peak_bytes'] = max(metric['peak_bytes'], span.peak_bytes)
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a') as file:
+                    file.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def prometheus_text(self):
+        """ Returns the aggregated metrics in the Prometheus text exposition format. """
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        with self._lock:
+            metrics = {name: {**values, 'outcomes': dict(values['outcomes']), 'buckets': list(values['buckets'])}
+                       for name, values in self.metrics.items()}
+        lines = ["# HELP scanner_spans_total Finished spans by name and outcome.",
+                 "# TYPE scanner_spans_total counter"]
+        for name, metric in sorted(metrics.items()):
+            for outcome, count in sorted(metric['outcomes'].items()):
+                lines.append(f'scanner_spans_total{{span="{label(name)}",outcome="{label(outcome)}"}} {count}')
+        lines += ["# HELP scanner_span_duration_seconds Duration of the spans.",
+                  "# TYPE scanner_span_duration_seconds histogram"]
+        for name, metric in sorted(metrics.items()):
+            for bound, count in zip(DURATION_BUCKETS, metric['buckets']):
+                lines.append(f'scanner_span_duration_seconds_bucket{{span="{label(name)}",le="{bound}"}} {count}')
+            lines.append(f'scanner_span_duration_seconds_bucket{{span="{label(name)}",le="+Inf"}} {metric["count"]}')
+            lines.append(f'scanner_span_duration_seconds_sum{{span="{label(name)}"}} {metric["duration_sum"]:.6f}')
+            lines.append(f'scanner_span_duration_seconds_count{{span="{label(name)}"}} {metric["count"]}')
+        if self.trace_memory:
+            lines += ["# HELP scanner_span_allocated_bytes_total Memory allocated and still held when the spans ended.",
+                      "# TYPE scanner_span_allocated_bytes_total counter"]
+            lines += [f'scanner_span_allocated_bytes_total{{span="{label(name)}"}} {metric["allocated_bytes"]}'
+                      for name, metric in sorted(metrics.items())]
+            lines += ["# HELP scanner_span_peak_bytes Largest peak of memory allocated during a span.",
+                      "# TYPE scanner_span_peak_bytes gauge"]
+            lines += [f'scanner_span_peak_bytes{{span="{label(name)}"}} {metric["peak_bytes"]}'
+                      for name, metric in sorted(metrics.items())]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=None):
+        """ Writes the metrics textfile atomically, so the collector never reads a half-written file. """
+        path = path or self.prometheus_path
+        if not path:
+            return
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as file:
+            file.write(self.prometheus_text())
+        os.replace(temporary, path)
+
+
+# PIPELINE STAGES AS SPANS
+class TracingObserver:
+    def __init__(self, tracer):
+        """ Pipeline observer that records every stage as a span, nested in whatever span is open. """
+        self.tracer = tracer
+        self.spans = {}
+
+    def on_stage_start(self, stage, context):
+        # Keyed by thread too: pipelines with the same stages may run side by side
+        self.spans[threading.get_ident(), stage.name] = self.tracer.start_span(stage.name, stage=True)
+
+    def on_stage_end(self, stage, context, seconds):
+        span = self.spans.pop((threading.get_ident(), stage.name), None)
+        if span is None:  # Taken from the cache, so the stage never started
+            span = self.tracer.start_span(stage.name, stage=True, cached=True)
+        span.set_image(context.get(stage.output))
+        self.tracer.end_span(span)
+
+    def on_stage_error(self, stage, context, error):
+        span = self.spans.pop((threading.get_ident(), stage.name), None)
+        if span is not None:
+            self.tracer.end_span(span, error)
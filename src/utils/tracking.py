@@ -0,0 +1,96 @@
+from utils.lazy_import import lazy_import
+from utils.detection import DocumentNotFoundError, detect_document_pyramid, downscale, refine_corners
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+
+# FOLLOW THE DOCUMENT CORNERS FROM FRAME TO FRAME
+class CornerTracker:
+    def __init__(self, detector=detect_document_pyramid, max_side=480, max_error=1.0, max_area_change=0.15,
+                 redetect_every=90):
+        """
+        Tracks the four document corners with sparse optical flow (pyramidal Lucas-Kanade) on a small
+        greyscale copy of every frame. The full detector only runs when there is nothing to track yet
+        or the tracking confidence drops.
+
+        :param detector: Function (frame -> document_contour) raising DocumentNotFoundError when nothing is found.
+        :param max_side: Longest side of the frames used for tracking.
+        :param max_error: Largest forward-backward error (in tracking pixels) accepted for a corner.
+        :param max_area_change: Largest relative change of the quad area between two frames.
+        :param redetect_every: Run the full detector at least every this many frames to correct drift (0 = never).
+        """
+        self.detector = detector
+        self.max_side = max_side
+        self.max_error = max_error
+        self.max_area_change = max_area_change
+        self.redetect_every = redetect_every
+        self.lk_params = dict(winSize=(21, 21), maxLevel=3,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+        self.previous_gray = None  # Small greyscale copy of the last frame
+        self.points = None  # Tracked corners in small-frame coordinates, shape (4, 1, 2)
+        self.scale = 1.0
+        self.tracked_frames = 0  # Frames tracked since the last full detection
+        self.detections = 0  # How often the full detector has run (useful to check the tracker is doing its job)
+
+    def reset(self):
+        self.previous_gray = None
+        self.points = None
+
+    def update(self, frame):
+        """
+        Returns the document quad in the frame, tracking it from the previous frame when possible.
+
+        :param frame: Full-resolution BGR frame.
+        :return: Corner points in full-resolution coordinates, float32 with shape (4, 1, 2), or None.
+        """
+        small, self.scale = downscale(frame, self.max_side)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        points = None
+        if self.points is not None and not (self.redetect_every and self.tracked_frames >= self.redetect_every):
+            points = self._track(gray)
+        if points is None:
+            points = self._detect(frame)
+            self.tracked_frames = 0
+        else:
+            self.tracked_frames += 1
+
+        self.previous_gray = gray
+        self.points = points
+        return None if points is None else points / self.scale
+
+    def refine(self, frame, contour):
+        """ Snaps a tracked quad to the exact corners at full resolution (tracking runs on a small copy). """
+        radius = int(np.ceil(2.0 / self.scale)) + 4
+        return refine_corners(frame, contour.reshape(4, 2), radius).reshape(4, 1, 2)
+
+    def _detect(self, frame):
+        self.detections += 1
+        try:
+            contour = self.detector(frame)
+        except DocumentNotFoundError:
+            return None
+        return (contour.reshape(4, 1, 2) * self.scale).astype(np.float32)
+
+    def _track(self, gray):
+        # Track forwards and backwards; a corner is trusted only if it comes back to where it started
+        forward, status, _ = cv2.calcOpticalFlowPyrLK(self.previous_gray, gray, self.points, None, **self.lk_params)
+        if forward is None or not status.all():
+            return None
+        backward, status_back, _ = cv2.calcOpticalFlowPyrLK(gray, self.previous_gray, forward, None,
+                                                            **self.lk_params)
+        if backward is None or not status_back.all():
+            return None
+        error = np.linalg.norm((self.points - backward).reshape(4, 2), axis=1)
+        if error.max() > self.max_error:
+            return None
+
+        # The result must still look like the same document: convex and about the same size
+        quad = forward.reshape(4, 2)
+        if not cv2.isContourConvex(quad):
+            return None
+        previous_area = cv2.contourArea(self.points.reshape(4, 2))
+        if previous_area <= 0 or abs(cv2.contourArea(quad) / previous_area - 1.0) > self.max_area_change:
+            return None
+        return forward
@@ -0,0 +1,408 @@
+import argparse
+import os
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from batch_scan import DEFAULT_OPTIONS, collect_images, index_page, init_worker, process_file
+from utils.job_queue import DONE, FAILED, PENDING, PROCESSED, PROCESSING, UPLOADING, JobQueue, file_digest
+from utils.page_content import BLANK_PAGE_POLICIES
+from utils.page_hash import DEFAULT_MAX_DISTANCE, PageHashIndex
+from utils.text_index import TextIndex
+
+
+def init_watch_worker():
+    """ Like batch_scan's workers, but Ctrl+C only reaches the daemon, which lets the running pages finish. """
+    init_worker()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def output_name(job):
+    """
+    Names the outputs of a job after its image and the start of its content hash, so a scanner that reuses
+    file names (or a page saved again under the same name) does not overwrite outputs that may not be uploaded yet.
+    """
+    return f"{os.path.splitext(os.path.basename(job['path']))[0]}_{job['digest'][:8]}"
+
+
+# FIND NEW IMAGES IN THE WATCHED FOLDER
+class FolderWatcher:
+    def __init__(self, directory, queue, settle_seconds=2.0):
+        """
+        Polls a folder and queues every image once it has stopped changing, so files that are still being
+        written (e.g. by a scanner or a sync client) are not picked up half-way. Polling works the same on
+        every platform and on network drives, where file system events are unreliable.
+
+        :param directory: Folder to watch (subfolders are not watched).
+        :param queue: JobQueue the new images are added to.
+        :param settle_seconds: How long size and modification time must stay the same before a file is queued.
+        """
+        self.directory = directory
+        self.queue = queue
+        self.settle_seconds = settle_seconds
+        self.candidates = {}  # Path -> ((size, mtime_ns), when first seen like that)
+        self.handled = {}  # Path -> (size, mtime_ns) already queued, so unchanged files are not hashed again
+
+    def poll(self):
+        """
+        Queues the images that settled since the last poll.
+
+        :return: Number of new jobs.
+        """
+        now = time.monotonic()
+        added = 0
+        paths = collect_images([self.directory])
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:  # Removed or renamed in the meantime
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.handled.get(path) == signature:
+                continue
+            if self.queue.is_known(path, *signature):  # Queued by an earlier run
+                self.handled[path] = signature
+                continue
+            seen = self.candidates.get(path)
+            if seen is None or seen[0] != signature:
+                self.candidates[path] = (signature, now)
+                continue
+            if now - seen[1] < self.settle_seconds:
+                continue
+            try:
+                digest = file_digest(path)
+            except OSError:
+                continue
+            del self.candidates[path]
+            self.handled[path] = signature
+            if self.queue.add(path, *signature, digest) is not None:
+                added += 1
+        # Forget files that disappeared
+        for path in self.candidates.keys() - set(paths):
+            del self.candidates[path]
+        return added
+
+
+# SCAN AND UPLOAD EVERYTHING THAT ARRIVES
+class ScanDaemon:
+    def __init__(self, watcher, queue, output_dir, options=None, workers=2, uploader=None, folder_id=None,
+                 upload_workers=2, poll_interval=2.0, text_index=None, page_index=None):
+        """
+        Runs every queued image through the scanning pipeline (batch_scan.process_file) in a pool of worker
+        processes, then uploads its outputs to Google Drive. Progress is recorded in the job queue after
+        every step and every uploaded file, so a restart neither redoes finished pages nor loses the ones
+        that were in progress.
+
+        :param watcher: FolderWatcher that finds the new images.
+        :param queue: JobQueue holding the jobs.
+        :param output_dir: Directory for the generated files.
+        :param options: Processing options, see batch_scan.DEFAULT_OPTIONS.
+        :param workers: Pages processed at the same time.
+        :param uploader: google_api.DriveUploader, or None to only process the pages.
+        :param folder_id: ID of the Drive folder, or None for the root directory.
+        :param upload_workers: Pages uploaded at the same time.
+        :param poll_interval: Seconds between two looks at the watched folder.
+        :param text_index: TextIndex the OCR text of every page is added to, with the Drive ID once uploaded.
+        :param page_index: PageHashIndex every processed page is added to, with the Drive IDs once uploaded.
+                           Set options['page_index'] to its path to have rescans of known pages skipped.
+        """
+        self.watcher = watcher
+        self.queue = queue
+        self.output_dir = output_dir
+        self.options = {**DEFAULT_OPTIONS, **(options or {})}
+        self.workers = workers
+        self.uploader = uploader
+        self.folder_id = folder_id
+        self.upload_workers = upload_workers
+        self.poll_interval = poll_interval
+        self.text_index = text_index
+        self.page_index = page_index
+        self.running = {}  # Future -> (job, step)
+        self.suspects = set()  # IDs of the jobs caught in a crashed process pool, to be run on their own
+        self.stopping = threading.Event()
+        self._processes = None
+
+    def stop(self):
+        """ Stops taking new jobs; the running ones are finished first. Safe to call from a signal handler. """
+        self.stopping.set()
+
+    def process_pool(self):
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(max_workers=self.workers, initializer=init_watch_worker)
+        return self._processes
+
+    def upload_outputs(self, job):
+        """ Uploads the outputs of a job that were not uploaded yet, recording each Drive ID right away. """
+        outputs = job['outputs']
+        for output in outputs:
+            if output.get('id') is None:
+                output['id'] = self.uploader.upload(output['path'], self.folder_id)
+                self.queue.update(job['id'], outputs=outputs)
+                for index in (self.text_index, self.page_index):
+                    if index is not None:
+                        index.set_drive_id(output['path'], output['id'])
+        return outputs
+
+    def ready_to_upload(self, job):
+        """
+        Checks a job about to be uploaded against the jobs it shares outputs with (a rescan of a known page gets
+        the outputs of the first scan): takes over the Drive IDs of the files they already uploaded, and defers
+        the job while one of them is about to upload the rest, so no file is uploaded twice.
+
+        :return: Whether the job can be uploaded now.
+        """
+        missing = {output['path']: output for output in job['outputs'] if output.get('id') is None}
+        others = [other for other in self.queue.sharing_outputs(job)
+                  if any(output['path'] in missing for output in other['outputs'])]
+        taken_over = False
+        for other in others:
+            for output in other['outputs']:
+                if output['path'] in missing and output.get('id') is not None:
+                    missing.pop(output['path'])['id'] = output['id']
+                    taken_over = True
+        if taken_over:
+            self.queue.update(job['id'], outputs=job['outputs'])
+        # The job uploaded or queued first goes ahead, so two jobs never wait for each other
+        uploading = [other for other in others if other['state'] == UPLOADING
+                     or (other['state'] == PROCESSED and other['id'] < job['id'])]
+        if any(output['path'] in missing and output.get('id') is None
+               for other in uploading for output in other['outputs']):
+            self.queue.defer(job['id'], PROCESSED, self.poll_interval)
+            return False
+        return True
+
+    def start_jobs(self, uploads):
+        """ Claims as many waiting jobs as there are free workers. """
+        steps = [('process', PENDING, PROCESSING, self.workers)]
+        if self.uploader is not None:
+            steps.append(('upload', PROCESSED, UPLOADING, self.upload_workers))
+        for step, state, next_state, limit in steps:
+            if step == 'process' and self.suspects and not self.start_suspect():
+                continue
+            while sum(running_step == step for _, running_step in self.running.values()) < limit:
+                job = self.queue.claim(state, next_state)
+                if job is None:
+                    break
+                if step == 'upload' and not self.ready_to_upload(job):
+                    continue
+                if step == 'process':
+                    future = self.process_pool().submit(process_file, job['path'], self.output_dir, self.options,
+                                                        output_name(job))
+                else:
+                    future = uploads.submit(self.upload_outputs, job)
+                self.running[future] = (job, step)
+
+    def start_suspect(self):
+        """
+        Runs the jobs caught in a crashed process pool one at a time, so the one that crashes it can be told
+        from the ones that were only running next to it.
+
+        :return: Whether other pages may be processed now.
+        """
+        if any(step == 'process' for _, step in self.running.values()):
+            return False  # Let the pool empty first; a suspect never shares it
+        job = self.queue.claim(PENDING, PROCESSING, only=self.suspects)
+        if job is None:  # None of them is waiting any more
+            self.suspects.clear()
+            return True
+        future = self.process_pool().submit(process_file, job['path'], self.output_dir, self.options,
+                                            output_name(job))
+        self.running[future] = (job, 'process')
+        return False
+
+    def finish_job(self, future):
+        """ Records the outcome of a finished step in the queue. """
+        job, step = self.running.pop(future)
+        name = os.path.basename(job['path'])
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            # A worker died (e.g. out of memory); the pool cannot be used any more, and every page it was
+            # working on gets this error, not just the one that killed the worker
+            if self._processes is not None:
+                self._processes.shutdown(wait=False)
+                self._processes = None
+            error = f"worker process died: {e}"
+            if job['id'] not in self.suspects:
+                # Try again on its own, without using up an attempt; only a page that crashes alone is charged
+                self.suspects.add(job['id'])
+                self.queue.defer(job['id'], PENDING, 0)
+                print(f"{step:7} crash  {name} - {error}; trying again on its own")
+                return
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            error = result['error'] if step == 'process' else None
+        self.suspects.discard(job['id'])
+        if error is not None:
+            # Outputs that went missing before they were uploaded have to be made again
+            retry_state = PENDING if step == 'process' or 'FileNotFoundError' in error else PROCESSED
+            state = self.queue.fail(job['id'], error, retry_state)
+            print(f"{step:7} {'failed' if state == FAILED else 'retry':6} {name} - {error}")
+        elif step == 'process':
+            if self.text_index is not None and result.get('text') is not None:
+                index_page(self.text_index, result, result['text'])
+            if self.page_index is not None and result.get('page_hash'):
+                self.page_index.add(result['page_hash'], result['source'], result['outputs'])
+            # A rescan of a known page gets the outputs of the first scan, and their Drive IDs if uploaded
+            drive_ids = result.get('drive_ids', {})
+            outputs = [{'path': path, 'id': drive_ids.get(path)} for path in result['outputs']]
+            uploaded = all(output['id'] is not None for output in outputs)
+            self.queue.update(job['id'], PROCESSED if self.uploader is not None and not uploaded else DONE, outputs)
+            if result['status'] == 'duplicate':
+                print(f"process same   {name} as {os.path.basename(result['duplicate_of'])}")
+            elif result['status'] == 'blank':
+                print(f"process blank  {name} (left out)")
+            else:
+                print(f"process ok     {name} ({result['seconds']:.1f}s)")
+        else:
+            self.queue.update(job['id'], DONE)
+            print(f"upload  ok     {name} ({len(result)} files)")
+
+    def queued(self):
+        """
+        The jobs still waiting for a step, mostly for the retry delay of a failed step (see JobQueue.fail) or for
+        another job to upload their files (see ready_to_upload).
+
+        :return: (number of jobs, seconds until the first of them can start, or None if there are none)
+        """
+        return self.queue.waiting([PENDING] if self.uploader is None else [PENDING, PROCESSED])
+
+    def run(self, once=False):
+        """
+        Watches the folder until stop() is called (or, with once, until everything queued is done, including
+        the retries of failed steps).
+
+        :return: Number of jobs per state when the daemon stopped.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"Resuming {recovered} interrupted jobs")
+        next_poll = 0.0
+        reported = 0  # Jobs waiting for a retry, as last reported
+        try:
+            with ThreadPoolExecutor(max_workers=self.upload_workers) as uploads:
+                while not self.stopping.is_set():
+                    if time.monotonic() >= next_poll:
+                        self.watcher.poll()
+                        next_poll = time.monotonic() + self.poll_interval
+                    self.start_jobs(uploads)
+                    timeout = max(next_poll - time.monotonic(), 0)
+                    if once and not self.running and not self.watcher.candidates:
+                        count, delay = self.queued()
+                        if not count:
+                            break
+                        if count != reported and delay > 0:
+                            print(f"{count} pages wait to be retried, the next in {delay:.0f}s (Ctrl+C to stop)")
+                        reported = count
+                        timeout = min(timeout, delay)
+                    if not self.running:
+                        self.stopping.wait(timeout)
+                        continue
+                    done, _ = wait(self.running, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.finish_job(future)
+                # Let the running steps finish, so they do not have to be redone on the next start
+                for future in list(self.running):
+                    wait([future])
+                    self.finish_job(future)
+        finally:
+            if self._processes is not None:
+                self._processes.shutdown(wait=False, cancel_futures=True)
+        return self.queue.counts()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan every document photo that arrives in a folder and upload "
+                                                 "the results to Google Drive.")
+    parser.add_argument('input_dir', help="Folder to watch")
+    parser.add_argument('-o', '--output-dir', default='scanned', help="Where to write the results")
+    parser.add_argument('--queue', default='scan_jobs.sqlite3', help="Job database (default: scan_jobs.sqlite3)")
+    parser.add_argument('--upload', action='store_true', help="Upload the results to Google Drive")
+    parser.add_argument('--drive-folder', help="ID of the Drive folder to upload to (default: root directory)")
+    parser.add_argument('-j', '--workers', type=int, default=2, help="Pages processed at the same time")
+    parser.add_argument('--upload-workers', type=int, default=2, help="Pages uploaded at the same time")
+    parser.add_argument('--poll', type=float, default=2.0, help="Seconds between two looks at the folder")
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help="Seconds a file must stay unchanged before it is processed")
+    parser.add_argument('--max-attempts', type=int, default=3, help="Attempts per page before it is marked failed")
+    parser.add_argument('--retry-failed', action='store_true', help="Give the failed pages another set of attempts")
+    parser.add_argument('--once', action='store_true', help="Process what is in the folder, then exit")
+    parser.add_argument('--status', action='store_true', help="Show the number of jobs per state and exit")
+    parser.add_argument('--format', dest='formats', action='append', choices=['pdf', 'png'],
+                        help="Output format, can be repeated (default: pdf)")
+    parser.add_argument('--no-binarize', action='store_true', help="Keep the pages in colour")
+    parser.add_argument('--enhance', choices=['adaptive', 'otsu', 'unsharp'], default='adaptive',
+                        help="Black & white conversion, see batch_scan.py")
+    parser.add_argument('--no-ocr', action='store_true', help="Skip text extraction")
+    parser.add_argument('--detection', choices=['full', 'pyramid', 'robust'], default='full',
+                        help="Document detection mode")
+    parser.add_argument('--multi', action='store_true', help="Find every document in each photo, see batch_scan.py")
+    parser.add_argument('--lang', default='eng', help="OCR language, e.g. 'eng' or 'eng+lav'")
+    parser.add_argument('--spelling', metavar='DICTIONARY', help="Correct uncertain OCR words, see batch_scan.py")
+    parser.add_argument('--protected-terms', metavar='FILE', help="Terms spelling correction leaves alone")
+    parser.add_argument('--no-classify', action='store_true', help="OCR every page in full, see batch_scan.py")
+    parser.add_argument('--blank-pages', choices=BLANK_PAGE_POLICIES, default='keep',
+                        help="'drop' leaves blank pages out of the outputs and uploads")
+    parser.add_argument('--index', help="Full-text index the OCR text is added to "
+                                         "(default: ocr_index.sqlite3 in the user data directory)")
+    parser.add_argument('--no-index', action='store_true', help="Do not add the text to the full-text index")
+    parser.add_argument('--skip-duplicates', metavar='PAGE_INDEX', nargs='?', const='page_hashes.sqlite3',
+                        help="Reuse the outputs and uploads of pages scanned before instead of processing rescans "
+                             "of them (pages are remembered in PAGE_INDEX, default page_hashes.sqlite3)")
+    parser.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                        help="Differing hash bits (of 256) up to which two pages are the same")
+    args = parser.parse_args()
+    if args.blank_pages == 'drop' and args.no_classify:
+        parser.error("--blank-pages drop needs the page classification that --no-classify turns off")
+    if args.multi and args.skip_duplicates:
+        parser.error("--skip-duplicates knows one page per photo, so it cannot be combined with --multi")
+
+    queue = JobQueue(args.queue, max_attempts=args.max_attempts)
+    if args.status or args.retry_failed:
+        if args.retry_failed:
+            print(f"{queue.retry_failed()} failed pages queued again")
+        print(", ".join(f"{state}: {count}" for state, count in sorted(queue.counts().items())) or "No jobs")
+        for path, error in queue.failures():
+            print(f"  failed {path} - {error}")
+        return 0
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"{args.input_dir} is not a directory")
+
+    uploader = None
+    if args.upload:
+        from utils.google_api import DriveUploader, UploadSessionStore, get_credentials
+        uploader = DriveUploader(get_credentials(), session_store=UploadSessionStore('upload_sessions.json'))
+
+    daemon = ScanDaemon(FolderWatcher(args.input_dir, queue, args.settle), queue, args.output_dir,
+                        options={'binarize': not args.no_binarize, 'enhance_mode': args.enhance,
+                                 'run_ocr': not args.no_ocr, 'formats': tuple(args.formats or ['pdf']),
+                                 'detection_mode': args.detection, 'multi_page': args.multi, 'lang': args.lang,
+                                 'spelling': args.spelling, 'protected_terms': args.protected_terms,
+                                 'classify_pages': not args.no_classify, 'blank_pages': args.blank_pages,
+                                 'page_index': args.skip_duplicates, 'max_distance': args.max_distance},
+                        workers=args.workers, uploader=uploader, folder_id=args.drive_folder,
+                        upload_workers=args.upload_workers, poll_interval=args.poll,
+                        text_index=None if args.no_index or args.no_ocr else TextIndex(args.index),
+                        page_index=PageHashIndex(args.skip_duplicates) if args.skip_duplicates else None)
+    # Ctrl+C or a service manager's SIGTERM: finish the running pages, then exit
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+    print(f"Watching {os.path.abspath(args.input_dir)} (Ctrl+C to stop)")
+    counts = daemon.run(once=args.once)
+    queued, _ = daemon.queued()
+    queue.close()
+    for index in (daemon.text_index, daemon.page_index):
+        if index is not None:
+            index.close()
+    print(", ".join(f"{state}: {count}" for state, count in sorted(counts.items())))
+    if queued:
+        print(f"{queued} pages are still queued; the next run picks them up")
+    return 1 if counts.get(FAILED) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())